@@ -6,6 +6,7 @@ import csv
 import io
 import json
 import shutil
+from datetime import date
 from tabulate import tabulate
 
 # valid table formats for tabulate
@@ -53,6 +54,23 @@ class SauceData:
 
         self.headers = generate_headers(data) or []
         self.headerlabels = {}
+        # column -> (formatter, table label), applied only to table cells that are rendered
+        self.formatters = {}
+
+    def set_formatter(self, column, formatter, label=None):
+        """
+        Format a column's values when the data is rendered as a table.
+
+        The data keeps its raw values, so JSON and CSV output carry them unchanged, and the formatter
+        only runs for cells that make it into the table.  None values are not formatted.
+
+        Parameters:
+        column (str): The data key of the column.
+        formatter (callable): Takes a raw value and returns the value to display.
+        label (str, optional): Table header to use instead of the column's header label, e.g. to
+                               show units.
+        """
+        self.formatters[column] = (formatter, label)
     
     def append(self, newdata):
         if not isinstance(newdata, dict):
@@ -78,7 +96,7 @@ class SauceData:
 
     # just dump the data as a json string.  This ignores the headerlabels
     def _str_json(self):
-        return json.dumps(self.data, indent=4)
+        return json.dumps(self.data, indent=4, default=export_value)
 
     def _str_csv(self):
         if not self.data:
@@ -115,7 +133,7 @@ class SauceData:
                 if self.headerlabels.get(field, field) is None:
                     continue
                 new_key = self.headerlabels.get(field, field) if field in self.headerlabels else field
-                remapped_row[new_key] = value
+                remapped_row[new_key] = export_value(value) if isinstance(value, date) else value
 
             # Write the row to CSV, ensuring only included keys are written
             filtered_row = {key: remapped_row[key] for key in fieldnames if key in remapped_row}
@@ -127,33 +145,40 @@ class SauceData:
     def _str_table(self):
         if not self.data:
             return ""
-        
-        # Initial headers based on data keys
-        final_headers = self.headers[:]
 
-        # Apply header labels, dropping columns with None value
-        final_headers = [self.headerlabels.get(header, header) for header in final_headers if self.headerlabels.get(header, header) is not None]
+        # Columns to show, dropping those whose header label is None
+        columns = [header for header in self.headers if self.headerlabels.get(header, header) is not None]
+        labels = {column: self._table_label(column) for column in columns}
 
         # Prioritize columns, ensuring prioritized columns come first
-        # Note: Prioritization happens after dropping columns flagged with None
-        prioritized_headers = [col for col in self.prioritize_columns if col in final_headers]
-        other_headers = [col for col in final_headers if col not in self.prioritize_columns]
-        final_headers = prioritized_headers + other_headers
+        prioritized = [column for label in self.prioritize_columns for column in columns if labels[column] == label]
+        columns = prioritized + [column for column in columns if column not in prioritized]
+
+        # Format one column at a time, so columns that don't fit the terminal are never formatted
+        final_headers = []
+        cells = []
+        total_width = 0
+        for index, column in enumerate(columns):
+            values = [self._format_cell(column, row.get(column, '')) for row in self.data]
+            if self.truncate:
+                width = max(len(str(item)) for item in values + [labels[column]]) + 3
+                if index >= self.mincol and total_width + width > self.width:
+                    break
+                total_width += width
+            final_headers.append(labels[column])
+            cells.append(values)
 
-        # Convert data to a list of lists format, considering dropped columns
-        remapped_data = []
-        for row in self.data:
-            row_data = [row.get(header, '') for header in self.headers if self.headerlabels.get(header, header) is not None]
-            remapped_data.append(row_data)
+        # Generate table string with tabulate
+        return tabulate(list(zip(*cells)), headers=final_headers, tablefmt=self.table_format)
 
-        # Fit the table columns to the terminal width if truncate is enabled
-        if self.truncate:
-            remapped_data, adjusted_final_headers = fit_table_columns(self.width, remapped_data, final_headers, self.mincol)
-            # Adjust headers in line with the data after truncation
-            final_headers = [final_headers[i] for i in range(len(adjusted_final_headers))]
+    def _table_label(self, column):
+        label = self.formatters.get(column, (None, None))[1]
+        return label if label is not None else self.headerlabels.get(column, column)
 
-        # Generate table string with tabulate
-        return tabulate(remapped_data, headers=final_headers, tablefmt=self.table_format)
+    def _format_cell(self, column, value):
+        if value is None or column not in self.formatters:
+            return value
+        return self.formatters[column][0](value)
 
     def sort_data(self, sort_by):
         """
@@ -189,11 +214,45 @@ class SauceData:
                 print(f"Error applying filter conditions to row {row}: {e}")
         self.data = filtered_data
 
+    def aggregate(self, group_by, sum_columns):
+        """
+        Group the data by columns and sum other columns within each group.
+
+        Parameters:
+        group_by (list): Columns whose distinct value combinations become the rows of the result.
+        sum_columns (list): Numeric columns summed within each group.  Missing values count as 0.
+
+        Returns:
+        SauceData: A new SauceData with the same output settings, one row per group in order of
+        first appearance.
+        """
+        groups = {}
+        for row in self.data:
+            key = tuple(row.get(column) for column in group_by)
+            if key not in groups:
+                groups[key] = {**dict(zip(group_by, key)), **{column: 0 for column in sum_columns}}
+            for column in sum_columns:
+                groups[key][column] += row.get(column) or 0
+
+        result = SauceData(data=list(groups.values()), output_format=self.output_format, output_file=self.output_file,
+                           table_format=self.table_format, prioritize_columns=self.prioritize_columns)
+        result.headerlabels = dict(self.headerlabels)
+        result.formatters = {column: formatter for column, formatter in self.formatters.items() if column in sum_columns + group_by}
+        return result
+
 
 ###
 ### Helper functions
 ###
         
+def export_value(value):
+    """
+    Return dates and datetimes as ISO 8601 strings for JSON and CSV output.
+    """
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
 def generate_headers(data):
     newheaders = []
     for row in data:
@@ -214,38 +273,3 @@ def get_terminal_width():
     except AttributeError:
         # Default width if the terminal size cannot be determined
         return 80
-
-def fit_table_columns(terminal_width, data, headers, mincol, extwidth=3):
-    """
-    Adjust columns to fit within the terminal width for data formatted as a list of lists.
-
-    Parameters:
-    terminal_width (int): The width of the terminal.
-    data (list of lists): The data to be displayed in the table, each sublist is a row.
-    headers (list): The headers for the table.
-    mincol (int): The minimum number of columns to display on the left.
-    extwidth (int): The extra width to add to each column to account for padding and spacing.
-
-    Returns:
-    tuple: Adjusted data (list of lists) and headers (list) fitting within the terminal width.
-    """
-    # Determine the width of each column based on content
-    col_widths = [max(len(str(item)) for item in col) + extwidth for col in zip(*data, headers)]
-
-    # Start with the minimum required columns
-    total_width = sum(col_widths[:mincol])
-    included_cols = mincol
-
-    # Add more columns as space allows
-    for width in col_widths[mincol:]:
-        if total_width + width <= terminal_width:
-            included_cols += 1
-            total_width += width
-        else:
-            break
-
-    # Adjust headers and data based on included columns
-    adjusted_headers = headers[:included_cols]
-    adjusted_data = [row[:included_cols] for row in data]
-
-    return adjusted_data, adjusted_headers
@@ -2,6 +2,7 @@
 
 import unittest
 import json
+from datetime import datetime
 from handler import SauceData, get_terminal_width
 import sys
 import os
@@ -269,6 +270,46 @@ class TestSauceData(unittest.TestCase):
         for row in sauce_data.data:
             self.assertTrue(int(row['key1']) > threshold)
 
+    def test_aggregate(self):
+        sauce_data = SauceData(data=[
+            {"service": "EC2", "usage": "BoxUsage", "cost": 1.5},
+            {"service": "S3", "usage": "Requests", "cost": 0.25},
+            {"service": "EC2", "usage": "EBS", "cost": 2.0},
+            {"service": "EC2", "usage": "BoxUsage"},
+        ], output_format="csv")
+
+        by_service = sauce_data.aggregate(["service"], ["cost"])
+        self.assertEqual(by_service.data, [{"service": "EC2", "cost": 3.5}, {"service": "S3", "cost": 0.25}])
+        self.assertEqual(by_service.headers, ["service", "cost"])
+        self.assertEqual(by_service.output_format, "csv")
+        # the original data is untouched
+        self.assertEqual(len(sauce_data.data), 4)
+
+    def test_formatters_apply_to_tables_only(self):
+        created = datetime(2024, 1, 2, 3, 4, 5)
+        sauce_data = SauceData(data=[{"size": 2 * 1024 ** 3, "created": created}, {"size": None, "created": created}])
+        sauce_data.headerlabels = {"size": "Size in Bytes", "created": "Created"}
+        sauce_data.set_formatter("size", lambda value: format(value / 1024 ** 3, ".1f"), label="Size in GiB")
+        sauce_data.set_formatter("created", lambda value: value.strftime("%Y-%m-%d %H:%M"))
+
+        table_str = str(sauce_data)
+        self.assertIn("Size in GiB", table_str)
+        self.assertNotIn("2147483648", table_str)
+        self.assertIn("2024-01-02 03:04", table_str)
+
+        sauce_data.output_format = "csv"
+        self.assertEqual(str(sauce_data).splitlines()[:2], ["Size in Bytes,Created", "2147483648,2024-01-02T03:04:05"])
+        sauce_data.output_format = "json"
+        self.assertEqual(json.loads(str(sauce_data))[0], {"size": 2147483648, "created": "2024-01-02T03:04:05"})
+
+    def test_formatters_skip_truncated_columns(self):
+        calls = []
+        sauce_data = SauceData(data=[{"name": "a" * 30, "wide": "b" * 60, "hidden": 1}])
+        sauce_data.width = 80
+        sauce_data.set_formatter("hidden", lambda value: calls.append(value) or str(value))
+        self.assertNotIn("hidden", str(sauce_data))
+        self.assertEqual(calls, [])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
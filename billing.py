@@ -19,7 +19,9 @@ from utils import amazon
 from utils import utilities
 from utils.logging import get_loggers
 from utils.utilities import get_terminal_width, get_last_day_of_month, format_time_period
-from utils.amazon import get_aws_session, get_aws_client
+from utils.amazon import get_aws_session, get_aws_client, get_identity
+from utils.coststore import get_cost_store, dimension_name
+from utils.concurrency import run_concurrently
 
 app = typer.Typer()
 
@@ -30,21 +32,29 @@ loggers = get_loggers()
 EXIT_CODE_GENERAL_ERROR = 1
 EXIT_CODE_AWS_DATA_RETRIEVAL_ERROR = 2
 
-def get_aws_cost_for_period(ctx:typer.Context, start_date, end_date, granularity, group_by=None):
+BILLING_VIEWS = ('detail', 'daily', 'table', 'summary')
+
+def iter_cost_and_usage(client, args: dict):
     """
-    Retrieve AWS cost and usage data for a specified time period with enhanced exception handling.
+    Yield ResultsByTime entries from get_cost_and_usage, following NextPageToken until all pages are read.
 
-    Parameters:
-    start_date (str): Start date in 'YYYY-MM-DD' format.
-    end_date (str): End date in 'YYYY-MM-DD' format.
-    granularity (str): The granularity of the AWS cost data (e.g., 'DAILY').
-    group_by (list, optional): The grouping of AWS cost data.
+    Grouped results for one day can be split across pages, so the same TimePeriod may be yielded
+    more than once with different groups.  BotoCoreError and ClientError are raised to the caller.
 
-    Returns:
-    dict: The response containing cost and usage data.
+    Parameters:
+    client: The Cost Explorer client.
+    args (dict): The get_cost_and_usage parameters, without NextPageToken.
     """
-    client = get_aws_client(ctx, 'ce')
+    args = dict(args)
+    while True:
+        response = client.get_cost_and_usage(**args)
+        yield from response['ResultsByTime']
+        token = response.get('NextPageToken')
+        if not token:
+            break
+        args['NextPageToken'] = token
 
+def cost_and_usage_args(start_date, end_date, granularity, group_by=None) -> dict:
     args = {
         'TimePeriod': {'Start': start_date, 'End': end_date},
         'Granularity': granularity,
@@ -52,150 +62,172 @@ def get_aws_cost_for_period(ctx:typer.Context, start_date, end_date, granularity
     }
     if group_by:
         args['GroupBy'] = group_by
+    return args
 
-    try:
-        response = client.get_cost_and_usage(**args)
-        return response
-    except BotoCoreError as e:
-        print(f"An error occurred while fetching AWS cost data: {e}")
-        return None
-    except ClientError as e:
-        print(f"Client error in AWS request: {e}")
-        return None
-
-def detailed_data(response):
+def fetch_stale_costs(ctx: typer.Context, store, account: str, periods: list, group_by=None, refresh=False) -> bool:
     """
-    Parse detailed cost data grouped by service from AWS response.
+    Bring the cost store up to date for each period, fetching only days it lacks from AWS.
+
+    Each period's stale days are fetched as one Cost Explorer request.  Several periods are fetched
+    concurrently under the shared Cost Explorer rate limit and written to the store on this thread.
 
     Parameters:
-    response (dict): The response data from AWS Cost Explorer API.
+    store (CostStore): The open cost store.
+    account (str): The AWS account ID.
+    periods (list): (start, end) date pairs, end exclusive, in 'YYYY-MM-DD' format.
+    group_by (list, optional): The grouping of AWS cost data.
+    refresh (bool): Fetch the whole of every period again, ignoring stored days.
 
     Returns:
-    tuple: A tuple of data list and headers for tabulation.
+    bool: True if every fetch succeeded.
     """
-    service_costs = {}
-    total_cost = 0
+    dimension = dimension_name(group_by)
+    stale_periods = []
+    for start_date, end_date in periods:
+        stale = (start_date, end_date) if refresh else store.stale_range(account, dimension, start_date, end_date)
+        if stale:
+            stale_periods.append(tuple(str(day) for day in stale))
 
-    for result in response['ResultsByTime']:
-        for group in result['Groups']:
-            amount = float(group['Metrics']['UnblendedCost']['Amount'])
-            if amount > 0:
-                keys = ', '.join(group['Keys'])
-                service_costs[keys] = service_costs.get(keys, 0) + amount
-                total_cost += amount
+    if not stale_periods:
+        loggers['debug'].debug("All %s costs read from the cost store", dimension)
+        return True
 
-    # Calculate the maximum length for cost formatting
-    max_cost_length = max(len(f"${cost:.2f}") for cost in service_costs.values())
+    client = get_aws_client(ctx, 'ce')
 
-    data = [[service, f"${cost:>{max_cost_length}.2f}"] for service, cost in sorted(service_costs.items(), key=lambda item: item[1])]
-    if total_cost > 0:
-        data.append(['Total', f"${total_cost:>{max_cost_length}.2f}"])
+    def fetch(period):
+        loggers['debug'].debug("Fetching %s costs for %s to %s", dimension, *period)
+        return iter_cost_and_usage(client, cost_and_usage_args(period[0], period[1], 'DAILY', group_by))
 
-    headers = ['Service', 'Cost']
-    return data, headers
+    try:
+        if len(stale_periods) == 1:
+            # pages are written to the store as they arrive; a failure part way rolls the whole fetch back
+            store.store_results(account, dimension, fetch(stale_periods[0]))
+            return True
+
+        succeeded = True
+        for period, results, error in run_concurrently(ctx, lambda period: list(fetch(period)), stale_periods):
+            if error is not None:
+                if not isinstance(error, (BotoCoreError, ClientError)):
+                    raise error
+                print(f"Failed to fetch AWS cost data for {period[0]} to {period[1]}: {error}", file=sys.stderr)
+                succeeded = False
+                continue
+            store.store_results(account, dimension, results)
+        return succeeded
+    except BotoCoreError as e:
+        print(f"An error occurred while fetching AWS cost data: {e}")
+        return False
+    except ClientError as e:
+        print(f"Client error in AWS request: {e}")
+        return False
 
-def daily_data(response, now):
+def load_daily_costs(ctx: typer.Context, start_date, end_date, group_by=None, refresh=False):
     """
-    Generate daily cost data for the current month.
+    Return daily cost data for a period, fetching from AWS only the days the local cost store lacks.
+
+    Days that are missing or were fetched too recently to be final are fetched in a single
+    Cost Explorer request and merged into the store; everything else is read back from it.
 
     Parameters:
-    response (dict): The response data from AWS Cost Explorer API.
-    now (datetime): Current datetime object.
+    start_date (str): Start date in 'YYYY-MM-DD' format.
+    end_date (str): End date in 'YYYY-MM-DD' format, exclusive.
+    group_by (list, optional): The grouping of AWS cost data.
+    refresh (bool): Fetch the whole period again, ignoring stored days.
 
     Returns:
-    tuple: A tuple of data list and headers for tabulation.
+    dict: A response shaped like get_cost_and_usage's, or None if the AWS request failed.
     """
-    dates = sorted({result['TimePeriod']['Start'] for result in response['ResultsByTime'] if result['TimePeriod']['Start'] <= now.strftime("%Y-%m-%d")})
-    formatted_dates = [datetime.strptime(date, "%Y-%m-%d").strftime("%b-%d") for date in dates]
-
-    total_costs = [0.0] * len(dates)
-    for i, date in enumerate(dates):
-        for result in response['ResultsByTime']:
-            if result['TimePeriod']['Start'] == date:
-                total_costs[i] += sum(float(group['Metrics']['UnblendedCost']['Amount']) for group in result['Groups'])
-
-    data = [['Total'] + [f"${cost:.2f}" for cost in total_costs]]
-    headers = ['Date'] + formatted_dates
-    return data, headers
+    account = get_identity(ctx)['Account']
+    store = get_cost_store(ctx)
+    try:
+        if not fetch_stale_costs(ctx, store, account, [(start_date, end_date)], group_by, refresh):
+            return None
+        return {'ResultsByTime': store.results_by_time(account, dimension_name(group_by), start_date, end_date)}
+    finally:
+        store.close()
 
-def table_data(response, now):
+class CostAggregator:
     """
-    Organize daily cost data by service for the current month into a table format.
+    Aggregate Cost Explorer ResultsByTime entries in a single pass into every billing view.
 
-    Parameters:
-    response (dict): The response data from AWS Cost Explorer API.
-    now (datetime): Current datetime object.
-
-    Returns:
-    tuple: A tuple of data list and headers for tabulation.
+    Entries can be added one at a time as they are fetched or read from the cost store, and may
+    repeat a day when Cost Explorer split its groups across pages.
     """
-    dates = sorted({result['TimePeriod']['Start'] for result in response['ResultsByTime'] if result['TimePeriod']['Start'] <= now.strftime("%Y-%m-%d")})
-    formatted_dates = [datetime.strptime(date, "%Y-%m-%d").strftime("%b-%d") for date in dates]
-
-    service_costs = {date: {} for date in dates}
-    service_totals = {}
-
-    for result in response['ResultsByTime']:
+    def __init__(self, now=None):
+        self.today = (now or datetime.now()).strftime("%Y-%m-%d")
+        self.daily_costs = {}       # date -> {service: amount}
+        self.service_totals = {}    # service -> amount
+        self.positive_totals = {}   # service -> sum of positive amounts, for the detail view
+        self.total = 0.0
+
+    def add(self, result: dict):
         date = result['TimePeriod']['Start']
+        day = self.daily_costs.setdefault(date, {})
         for group in result['Groups']:
             service = ', '.join(group['Keys'])
             amount = float(group['Metrics']['UnblendedCost']['Amount'])
-            service_costs[date].setdefault(service, 0.0)
-            service_costs[date][service] += amount
-            service_totals[service] = service_totals.get(service, 0.0) + amount
-
-    data = []
-    for service, total in service_totals.items():
-        row = [service, f"${total:.2f}"] + [f"${service_costs[date].get(service, 0.0):.2f}" for date in dates]
-        data.append(row)
-
-    daily_totals = [sum(service_costs[date].values()) for date in dates]
-    data.append(['Total', f"${sum(daily_totals):.2f}"] + [f"${total:.2f}" for total in daily_totals])
-
-    # headers
-    headers = ['Service', 'Total'] + formatted_dates
-
-    # Find and remove the 'Tax' row if it exists
-    tax_row = None
-    for row in data:
-        if row[0] == 'Tax':
-            tax_row = row
-            data.remove(row)
-            break
-
-    # Sort data by the 'Total' column in ascending order
-    # Skip the header row and the 'Total' row at the end
-    sorted_data = sorted(data[:-1], key=lambda x: float(x[1][1:].replace(',', '')))
-    
-    # Re-insert the 'Tax' row before the 'Total' row if it was found
-    if tax_row:
-        sorted_data.append(tax_row)
-
-    # Append the 'Total' row at the end
-    sorted_data.append(data[-1])
-
-    return sorted_data, headers
-
-def summary_data(current_month_response):
-    """
-    Calculate and display the total cost for the current month.
-
-    Parameters:
-    current_month_response (dict): The response data from AWS Cost Explorer API for the current month.
-    """
-    current_month_cost = 0.0
-    for time_period in current_month_response['ResultsByTime']:
-        for group in time_period['Groups']:
-            amount = float(group['Metrics']['UnblendedCost']['Amount'])
-            current_month_cost += amount
-
-    # Prepare data for summary table
-    data = [
-        ["Current Month", f"${current_month_cost:.2f}"]
-    ]
-
-    # Print summary table
-    print(tabulate(data, headers=["Period", "Cost"], tablefmt="plain"))
+            day[service] = day.get(service, 0.0) + amount
+            self.service_totals[service] = self.service_totals.get(service, 0.0) + amount
+            if amount > 0:
+                self.positive_totals[service] = self.positive_totals.get(service, 0.0) + amount
+            self.total += amount
+
+    def update(self, results):
+        for result in results:
+            self.add(result)
+        return self
+
+    def dates(self) -> list:
+        return sorted(date for date in self.daily_costs if date <= self.today)
+
+    def detail(self):
+        """
+        Return (data, headers) of the cost of each service with a positive cost, cheapest first.
+        """
+        positive_total = sum(self.positive_totals.values())
+        max_cost_length = max((len(f"${cost:.2f}") for cost in self.positive_totals.values()), default=0)
+
+        data = [[service, f"${cost:>{max_cost_length}.2f}"] for service, cost in sorted(self.positive_totals.items(), key=lambda item: item[1])]
+        if positive_total > 0:
+            data.append(['Total', f"${positive_total:>{max_cost_length}.2f}"])
+        return data, ['Service', 'Cost']
+
+    def daily(self):
+        """
+        Return (data, headers) of the total cost of each day up to today.
+        """
+        dates = self.dates()
+        formatted_dates = [datetime.strptime(date, "%Y-%m-%d").strftime("%b-%d") for date in dates]
+        data = [['Total'] + [f"${sum(self.daily_costs[date].values()):.2f}" for date in dates]]
+        return data, ['Date'] + formatted_dates
+
+    def table(self):
+        """
+        Return (data, headers) of each service's daily costs, cheapest first, then Tax and Total rows.
+        """
+        dates = self.dates()
+        formatted_dates = [datetime.strptime(date, "%Y-%m-%d").strftime("%b-%d") for date in dates]
+
+        rows = []
+        tax_row = None
+        for service, total in sorted(self.service_totals.items(), key=lambda item: round(item[1], 2)):
+            row = [service, f"${total:.2f}"] + [f"${self.daily_costs[date].get(service, 0.0):.2f}" for date in dates]
+            if service == 'Tax':
+                tax_row = row
+            else:
+                rows.append(row)
+        if tax_row:
+            rows.append(tax_row)
+
+        daily_totals = [sum(self.daily_costs[date].values()) for date in dates]
+        rows.append(['Total', f"${sum(daily_totals):.2f}"] + [f"${total:.2f}" for total in daily_totals])
+        return rows, ['Service', 'Total'] + formatted_dates
+
+    def summary(self):
+        """
+        Return (data, headers) of the total cost of the period.
+        """
+        return [["Current Month", f"${self.total:.2f}"]], ["Period", "Cost"]
 
 def fit_table_columns(terminal_width, data, headers, mincol, extwidth=3):
     """
@@ -245,9 +277,28 @@ def fit_table_columns(terminal_width, data, headers, mincol, extwidth=3):
 
     return new_data, new_headers
 
+def print_billing_view(costs: CostAggregator, format: str):
+    """
+    Print one of the billing views (detail, daily, table or summary) of aggregated costs.
+    """
+    if format == 'detail':
+        data, headers = costs.detail()
+        print(tabulate(data, headers, tablefmt="plain"))
+    elif format == 'daily':
+        data, headers = costs.daily()
+        print(tabulate(data, headers, tablefmt="plain"))
+    elif format == 'table':
+        data, headers = costs.table()
+        fitted_data, fitted_headers = fit_table_columns(get_terminal_width(), data, headers, mincol=2, extwidth=3)
+        print(tabulate(fitted_data, fitted_headers, tablefmt="presto"))
+    elif format == 'summary':
+        data, headers = costs.summary()
+        print(tabulate(data, headers=headers, tablefmt="plain"))
+
 @app.command()
-def billing(ctx: typer.Context, format: str = typer.Argument("summary")):
-    loggers['debug'].debug(f"Executing {__name__}() subcommand")
+def billing(ctx: typer.Context, format: str = typer.Argument("summary"),
+            refresh: bool = typer.Option(False, "--refresh", help="Fetch the whole month from AWS again instead of using stored costs.")):
+    loggers['debug'].debug("Executing %s() subcommand", __name__)
 
     dry_run = ctx.obj["DRY_RUN"]
     quiet = ctx.obj["QUIET"]
@@ -258,37 +309,22 @@ def billing(ctx: typer.Context, format: str = typer.Argument("summary")):
     current_month_start, current_month_end = format_time_period(now.year, now.month)
 
     # AWS Cost Explorer API parameters
-    granularity = 'DAILY'
     group_by = [{'Type': 'DIMENSION', 'Key': 'SERVICE'}]
 
-    if format == 'detail':
-        current_month_response = get_aws_cost_for_period(ctx, current_month_start, current_month_end, granularity, group_by)
-        if current_month_response is None:
-            print("Failed to retrieve AWS cost data.", file=sys.stderr)
-            sys.exit(EXIT_CODE_AWS_DATA_RETRIEVAL_ERROR)
-        data, headers = detailed_data(current_month_response)
-        print(tabulate(data, headers, tablefmt="plain"))
-    elif format == 'daily':
-        current_month_response = get_aws_cost_for_period(ctx, current_month_start, current_month_end, granularity, group_by)
-        if current_month_response is None:
-            print("Failed to retrieve AWS cost data.", file=sys.stderr)
-            sys.exit(EXIT_CODE_AWS_DATA_RETRIEVAL_ERROR)
-        data, headers = daily_data(current_month_response, now)
-        print(tabulate(data, headers, tablefmt="plain"))
-    elif format == 'table':
-        current_month_response = get_aws_cost_for_period(ctx, current_month_start, current_month_end, granularity, group_by)
-        if current_month_response is None:
-            print("Failed to retrieve AWS cost data.", file=sys.stderr)
-            sys.exit(EXIT_CODE_AWS_DATA_RETRIEVAL_ERROR)
-        data, headers = table_data(current_month_response, now)
-        fitted_data, fitted_headers = fit_table_columns(get_terminal_width(), data, headers, mincol=2, extwidth=3)
-        print(tabulate(fitted_data, fitted_headers, tablefmt="presto"))
-    elif format == 'summary':
-        current_month_response = get_aws_cost_for_period(ctx, current_month_start, current_month_end, granularity, group_by)
-        if current_month_response is None:
-            print("Failed to retrieve AWS cost data.", file=sys.stderr)
-            sys.exit(EXIT_CODE_AWS_DATA_RETRIEVAL_ERROR)
-        summary_data(current_month_response)
+    if format not in BILLING_VIEWS:
+        print(f"Unknown billing format: {format}. Use detail, daily, table or summary.", file=sys.stderr)
+        sys.exit(EXIT_CODE_GENERAL_ERROR)
+
+    # every format is built from the same daily costs, most of which come from the local cost store
+    current_month_response = load_daily_costs(ctx, current_month_start, current_month_end, group_by, refresh)
+    if current_month_response is None:
+        print("Failed to retrieve AWS cost data.", file=sys.stderr)
+        sys.exit(EXIT_CODE_AWS_DATA_RETRIEVAL_ERROR)
+
+    # one pass over the costs builds every view
+    costs = CostAggregator(now).update(current_month_response['ResultsByTime'])
+
+    print_billing_view(costs, format)
 
 if __name__ == "__main__":
     typer.run(billing)
@@ -3,9 +3,12 @@
 import typer
 from utils.logging import get_loggers
 from utils.amazon import get_aws_client
-from SauceData.handler import SauceData
+from SauceData.handler import SauceData, export_value
 from datetime import datetime, timedelta
+import csv
+import sys
 import json
+from contextlib import nullcontext
 from botocore.exceptions import ClientError
 
 # Get the loggers
@@ -13,11 +16,119 @@ loggers = get_loggers()
 
 app = typer.Typer()
 
+# LookupAttributes takes a single attribute, so the first of these filters given (roughly the most
+# selective) is sent to CloudTrail and the rest are checked against each event as it arrives,
+# using the event's top-level fields so the CloudTrailEvent JSON needn't be parsed.
+#   option: (lookup attribute key, matches(event, value))
+EVENT_FILTERS = {
+    "resource": ("ResourceName", lambda event, value: any(resource.get('ResourceName') == value for resource in event.get('Resources', []))),
+    "user": ("Username", lambda event, value: event.get('Username') == value),
+    "event_name": ("EventName", lambda event, value: event.get('EventName') == value),
+    "event_source": ("EventSource", lambda event, value: event.get('EventSource') == value),
+}
+
+# Columns: (header label, value from a LazyEvent).  Only awsRegion, eventType and sourceIPAddress
+# need the CloudTrailEvent JSON.
+EVENT_FIELDS = {
+    'EventId': ('Event ID', lambda event: event.event['EventId']),
+    'Username': ('Username', lambda event: event.event.get('Username')),
+    'EventTime': ('Event Time', lambda event: event.event['EventTime']),
+    'awsRegion': ('Region', lambda event: event.detail.get('awsRegion')),
+    'eventName': ('Event', lambda event: event.event.get('EventName')),
+    'eventSource': ('Source', lambda event: event.event.get('EventSource', '').split('.')[0]),
+    'eventType': ('EventTyp', lambda event: event.detail.get('eventType')),
+    'sourceIPAddress': ('IP', lambda event: event.detail.get('sourceIPAddress')),
+    'accessKeyId': ('Key ID', lambda event: event.event.get('AccessKeyId') or 'N/A'),
+}
+
+class LazyEvent:
+    """
+    A lookup_events event whose CloudTrailEvent JSON is parsed on first use, at most once.
+    """
+    __slots__ = ('event', '_detail')
+
+    def __init__(self, event: dict):
+        self.event = event
+        self._detail = None
+
+    @property
+    def detail(self) -> dict:
+        if self._detail is None:
+            self._detail = json.loads(self.event.get('CloudTrailEvent') or '{}')
+        return self._detail
+
+    def is_service_event(self) -> bool:
+        """
+        True for events where one AWS service called another.  Most events are ruled out by a
+        substring check without parsing the JSON.
+        """
+        if 'AWSService' not in self.event.get('CloudTrailEvent', ''):
+            return False
+        return self.detail.get('userIdentity', {}).get('type') == 'AWSService'
+
 def validate_time_range(start_time: datetime, end_time: datetime):
     """Validate that start_time is before end_time."""
     if start_time >= end_time:
         raise typer.Exit("Start time must be before end time.")
 
+def iter_events(client, start_time: datetime, end_time: datetime, lookup_attributes: list):
+    """
+    Yield events from lookup_events page by page, newest first, following NextToken.
+    """
+    args = {'LookupAttributes': lookup_attributes, 'StartTime': start_time, 'EndTime': end_time, 'MaxResults': 50}
+    while True:
+        response = client.lookup_events(**args)
+        yield from response.get('Events', [])
+        token = response.get('NextToken')
+        if not token:
+            break
+        args['NextToken'] = token
+
+def iter_event_rows(client, start_time: datetime, end_time: datetime, filters: dict, fields: list, limit: int = None):
+    """
+    Yield a row per matching event as pages arrive, newest first, skipping AWS service events.
+
+    Parameters:
+    filters (dict): EVENT_FILTERS option -> value, for the filters given.
+    fields (list): EVENT_FIELDS keys to project into each row.
+    limit (int, optional): Stop, without fetching further pages, after this many rows.
+    """
+    given = [(option, value) for option, value in filters.items() if value]
+    lookup_attributes = []
+    checks = []
+    for index, (option, value) in enumerate(given):
+        key, matches = EVENT_FILTERS[option]
+        if index == 0:
+            lookup_attributes = [{'AttributeKey': key, 'AttributeValue': value}]
+        else:
+            checks.append((matches, value))
+    loggers['debug'].debug("Event lookup attributes: %s, checked locally: %s", lookup_attributes, [option for option, _ in given[1:]])
+
+    extractors = [(field, EVENT_FIELDS[field][1]) for field in fields]
+    count = 0
+    for raw_event in iter_events(client, start_time, end_time, lookup_attributes):
+        if not all(matches(raw_event, value) for matches, value in checks):
+            continue
+        # exclude events for one amazon service communicating with another
+        event = LazyEvent(raw_event)
+        if event.is_service_event():
+            continue
+        yield {field: extract(event) for field, extract in extractors}
+        count += 1
+        if limit and count >= limit:
+            return
+
+def write_event_rows_csv(rows, fields: list, file):
+    """
+    Write event rows to a file as CSV, flushing after each so they appear as pages arrive.
+    """
+    writer = csv.DictWriter(file, fieldnames=[EVENT_FIELDS[field][0] for field in fields])
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({EVENT_FIELDS[field][0]: export_value(value) if isinstance(value, datetime) else value
+                         for field, value in row.items()})
+        file.flush()
+
 @app.command()
 def events(
     ctx: typer.Context,
@@ -29,8 +140,17 @@ def events(
         None,
         help="End time for the events in 'YYYY-MM-DD HH:MM:SS' format. Defaults to now.",
     ),
+    user: str = typer.Option(None, "--user", help="Only events by this user name."),
+    event_name: str = typer.Option(None, "--event-name", help="Only events with this name, e.g. ConsoleLogin."),
+    event_source: str = typer.Option(None, "--event-source", help="Only events from this service, e.g. s3 or s3.amazonaws.com."),
+    resource: str = typer.Option(None, "--resource", help="Only events on the resource with this name."),
+    fields: str = typer.Option(None, "--fields", help=f"Comma-separated columns to show: {', '.join(EVENT_FIELDS)}."),
+    limit: int = typer.Option(None, "--limit", help="Show at most this many events, newest first."),
 ):
-    loggers['debug'].debug(f"Executing {__name__} subcommand")
+    """
+    List CloudTrail management events, newest first, excluding calls between AWS services.
+    """
+    loggers['debug'].debug("Executing %s subcommand", __name__)
 
     dry_run = ctx.obj["DRY_RUN"]
     quiet = ctx.obj["QUIET"]
@@ -46,89 +166,45 @@ def events(
     # Validate time range
     validate_time_range(start_time, end_time)
 
+    fields = [field.strip() for field in fields.split(",")] if fields else list(EVENT_FIELDS)
+    unknown = [field for field in fields if field not in EVENT_FIELDS]
+    if unknown:
+        raise typer.BadParameter(f"Unknown field(s): {', '.join(unknown)}. Use {', '.join(EVENT_FIELDS)}.")
+    if event_source and '.' not in event_source:
+        event_source = f"{event_source}.amazonaws.com"
+    filters = {"resource": resource, "user": user, "event_name": event_name, "event_source": event_source}
+
     # create the SauceData object
-    sauce_data = SauceData( output_format=output )
+    sauce_data = SauceData(data=[], output_format=output)
+    sauce_data.headerlabels = {field: EVENT_FIELDS[field][0] for field in fields}
+    sauce_data.set_formatter('EventTime', lambda event_time: event_time.strftime('%Y-%m-%d %H:%M:%S'))
 
     # create the cloudtrail client
     ctclient = get_aws_client(ctx, 'cloudtrail')
 
-    loggers['debug'].debug(f"Start time: {start_time}, End time: {end_time}")
-
-    try:
-        # Convert start_time and end_time to the string format required by CloudTrail
-        start_time_str = start_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-        end_time_str = end_time.strftime('%Y-%m-%dT%H:%M:%SZ')
-
-        # Fetch CloudTrail events
-        response = ctclient.lookup_events(
-            LookupAttributes=[],
-            StartTime=start_time,
-            EndTime=end_time,
-            MaxResults=50  # Adjust as needed
-        )
-
-        allevents = []
-        # if the response includes the NextToken, fetch the next page of results
-        while 'NextToken' in response:
-            allevents.extend(response['Events'])
-            response = ctclient.lookup_events(
-                LookupAttributes=[],
-                StartTime=start_time,
-                EndTime=end_time,
-                NextToken=response['NextToken'],
-                MaxResults=50  # Adjust as needed
-            )
-        
-        # append the last page of results
-        allevents.extend(response['Events'])
-
-        # parse the event string to json
-        for event in allevents:
-            event['CloudTrailEvent'] = json.loads(event['CloudTrailEvent'])
-
-        # sort by date
-        allevents = sorted(allevents, key=lambda event: event['EventTime'])
+    loggers['debug'].debug("Start time: %s, End time: %s", start_time, end_time)
+
+    rows = iter_event_rows(ctclient, start_time, end_time, filters, fields, limit)
+    with open(ofile, "w", newline="") if ofile else nullcontext(sys.stdout) as out:
+        try:
+            if output == 'csv':
+                # CSV needs no column widths, so rows are written as each page arrives
+                write_event_rows_csv(rows, fields, out)
+                return
+
+            for row in rows:
+                sauce_data.append(row)
+
+        except Exception as e:
+            message = f"An AWS ClientError occurred: {e}" if isinstance(e, ClientError) else f"An unexpected error occurred: {e}"
+            loggers['error'].error(message)
+            typer.echo(message, err=True)
+            if output == 'csv':
+                # the rows written so far are kept; rendering the empty table after them would corrupt the CSV
+                raise typer.Exit(1)
+
+        # print the data
+        typer.echo(sauce_data, file=out)
 
-        # exclude events for one amazon service communicating with another
-        # in short, exclude events where the source and the recipient are both AWS services
-        allevents = [event for event in allevents if not event['CloudTrailEvent']['userIdentity']['type'] == 'AWSService']
-
-
-        for event in allevents:
-            event_data = {
-                'EventId': event['EventId'],
-                'Username': event['Username'],
-                'EventTime': event['EventTime'].strftime('%Y-%m-%d %H:%M:%S'),
-                'awsRegion': event['CloudTrailEvent']['awsRegion'],
-                'eventName': event['CloudTrailEvent']['eventName'],
-                'eventSource': event['CloudTrailEvent']['eventSource'].split('.')[0],
-                'eventType': event['CloudTrailEvent']['eventType'],
-                'sourceIPAddress': event['CloudTrailEvent']['sourceIPAddress'],
-                'accessKeyId': event['CloudTrailEvent']['userIdentity']['accessKeyId'] if 'accessKeyId' in event['CloudTrailEvent']['userIdentity'] else 'N/A'
-            }
-            sauce_data.append(event_data)
-
-            # set headerlabels
-            sauce_data.headerlabels = {
-                'EventId': 'Event ID',
-                'Username': 'Username',
-                'EventTime': 'Event Time',
-                'awsRegion': 'Region',
-                'eventName': 'Event',
-                'eventSource': 'Source',
-                'eventType': 'EventTyp',
-                'sourceIPAddress': 'IP',
-                'accessKeyId': 'Key ID'
-            }
-
-    except ClientError as e:
-        loggers['error'].error(f"An AWS ClientError occurred: {e}")
-    except Exception as e:
-        loggers['error'].error(f"An unexpected error occurred: {e}")
-
-    # print the data
-    typer.echo( sauce_data )
-    
 if __name__ == "__main__":
     typer.run(events)
-
@@ -6,115 +6,209 @@ import boto3
 from utils.utilities import get_terminal_width, fit_table_columns, convert_bytes
 from utils.logging import get_loggers
 from utils.amazon import get_aws_session, get_aws_client
+from utils.concurrency import run_concurrently
+from utils.tapestore import get_tape_store
+from typing import Optional
 from botocore.exceptions import ClientError
 import sys
 from datetime import datetime
 from SauceData.handler import SauceData
 
+# Get the loggers
+loggers = get_loggers()
+
 app = typer.Typer()
 
+# Tapes described per describe_tapes/describe_tape_archives call.  Override with
+# [storagegateway] describe_batch_size in the config
+DEFAULT_DESCRIBE_BATCH_SIZE = 100
+
+TAPE_HEADER_LABELS = {
+    "TapeBarcode": "Tape Barcode",
+    "TapeCreatedDate": "Created Date",
+    "TapeSizeInBytes": "Size in Bytes",
+    "TapeStatus": "Status",
+    "TapeUsedInBytes": "Used Bytes",
+    "PoolId": "Pool ID",
+    "Worm": "WORM",
+    "PoolEntryDate": "Pool Entry Date",
+    "GatewayARN": "Gateway ARN",
+    # kept for the tape inventory and JSON output, too long for tables
+    "TapeARN": None
+}
+
+def iter_tape_infos(client):
+    """
+    Yield every TapeInfo from list_tapes, following Marker until all pages are read.
+    """
+    args = {}
+    while True:
+        response = client.list_tapes(**args)
+        yield from response.get('TapeInfos', [])
+        marker = response.get('Marker')
+        if not marker:
+            break
+        args['Marker'] = marker
+
+def gateway_selected(gateway_arn: str, gateway_arns) -> bool:
+    """
+    Return True if no gateways were asked for, or gateway_arn matches one of them by ARN or gateway ID.
+    """
+    if not gateway_arns:
+        return True
+    return any(gateway_arn == wanted or gateway_arn.split('/')[-1] == wanted for wanted in gateway_arns)
+
+def describe_batch_size(ctx: typer.Context) -> int:
+    """
+    Return the number of tapes per describe call, from [storagegateway] describe_batch_size.
+    """
+    config = ctx.obj.get('CONFIG')
+    if config is None:
+        return DEFAULT_DESCRIBE_BATCH_SIZE
+    return config.getint('storagegateway', 'describe_batch_size', fallback=DEFAULT_DESCRIBE_BATCH_SIZE)
+
+def tape_batches(tape_infos, gateway_arns=None, batch_size: int = DEFAULT_DESCRIBE_BATCH_SIZE) -> list:
+    """
+    Group tapes by gateway into batches for describe_tapes, and archived tapes into batches for
+    describe_tape_archives.
+
+    Archived tapes have no gateway and are always included, whatever gateways were asked for.
+
+    Returns:
+    list: (gateway ARN or None for archived tapes, [tape ARNs]) tuples.
+    """
+    by_gateway = {}
+    for tape_info in tape_infos:
+        gateway_arn = tape_info.get('GatewayARN')
+        if gateway_arn is not None and not gateway_selected(gateway_arn, gateway_arns):
+            continue
+        by_gateway.setdefault(gateway_arn, []).append(tape_info['TapeARN'])
+
+    batches = []
+    for gateway_arn, tape_arns in by_gateway.items():
+        for index in range(0, len(tape_arns), batch_size):
+            batches.append((gateway_arn, tape_arns[index:index + batch_size]))
+    return batches
+
+def tape_row(tape_data: dict, gateway_arn: str = None) -> dict:
+    return {
+        'TapeBarcode': tape_data['TapeBarcode'],
+        'TapeCreatedDate': tape_data['TapeCreatedDate'],
+        'TapeSizeInBytes': tape_data['TapeSizeInBytes'],
+        'TapeStatus': tape_data['TapeStatus'],
+        'TapeUsedInBytes': tape_data.get('TapeUsedInBytes', 0),
+        'PoolId': tape_data.get('PoolId'),
+        'Worm': tape_data.get('Worm'),
+        'PoolEntryDate': tape_data.get('PoolEntryDate'),
+        'GatewayARN': gateway_arn,
+        'TapeARN': tape_data['TapeARN']
+    }
+
+def describe_tape_batch(client, batch: tuple) -> list:
+    """
+    Describe one batch from tape_batches() and return its tape rows.
+
+    Gateway tapes are described with describe_tapes, archived tapes with describe_tape_archives.
+    """
+    gateway_arn, tape_arns = batch
+    if gateway_arn is not None:
+        args = {'GatewayARN': gateway_arn, 'TapeARNs': tape_arns}
+        operation, key = client.describe_tapes, 'Tapes'
+    else:
+        args = {'TapeARNs': tape_arns}
+        operation, key = client.describe_tape_archives, 'TapeArchives'
+
+    rows = []
+    while True:
+        response = operation(**args)
+        rows += [tape_row(tape_data, gateway_arn) for tape_data in response.get(key, [])]
+        marker = response.get('Marker')
+        if not marker:
+            return rows
+        args['Marker'] = marker
+
 def list_tapes(ctx:typer.Context, gateway_arns: str=None) -> SauceData:
-    tapes = SauceData()
-    #headers = ["TapeBarcode", "TapeCreatedDate", "TapeSizeInBytes", "TapeStatus", "TapeUsedInBytes", "PoolId", "Worm", "PoolEntryDate", "GatewayARN"]
+    """
+    List tapes, describing them in batches per gateway.
 
-    #client = boto3.client('storagegateway')
+    Batches run concurrently on a bounded pool and their rows are added to the SauceData on this
+    thread as each batch completes.  Rows are sorted by barcode.
+    """
+    tapes = SauceData(data=[])
     client = get_aws_client(ctx, 'storagegateway')
-    response = client.list_tapes()
-    for tape_info in response['TapeInfos']:
-        tape_arn = tape_info['TapeARN']
-
-        # Process only tapes that have an associated GatewayARN
-        if 'GatewayARN' in tape_info:
-            try:
-                tape_response = client.describe_tapes(GatewayARN=tape_info['GatewayARN'], TapeARNs=[tape_arn])
-                tape_data = tape_response['Tapes'][0]
-                if gateway_arns is None or gateway_arns == [] or tape_info['GatewayARN'] in gateway_arns:
-                    tapes.append({
-                        'TapeBarcode': tape_data['TapeBarcode'],
-                        'TapeCreatedDate': tape_data['TapeCreatedDate'],
-                        'TapeSizeInBytes': tape_data['TapeSizeInBytes'],
-                        'TapeStatus': tape_data['TapeStatus'],
-                        'TapeUsedInBytes': tape_data['TapeUsedInBytes'],
-                        'PoolId': tape_data['PoolId'],
-                        'Worm': tape_data['Worm'],
-                        'PoolEntryDate': tape_data['PoolEntryDate'],
-                        'GatewayARN': tape_info['GatewayARN']
-                    })
-            except ClientError as e:
-                print(f"Failed to retrieve tape details for {tape_arn}: {e}", file=sys.stderr)
-                continue
-        else:
-            try:
-                tape_response = client.describe_tape_archives(TapeARNs=[tape_arn])
-                tape_data = tape_response['TapeArchives'][0]
-                tapes.append({
-                    'TapeBarcode': tape_data['TapeBarcode'],
-                    'TapeCreatedDate': tape_data['TapeCreatedDate'],
-                    'TapeSizeInBytes': tape_data['TapeSizeInBytes'],
-                    'TapeStatus': tape_data['TapeStatus'],
-                    'TapeUsedInBytes': tape_data['TapeUsedInBytes'],
-                    'PoolId': tape_data['PoolId'],
-                    'Worm': tape_data['Worm'],
-                    'PoolEntryDate': tape_data['PoolEntryDate'],
-                    'GatewayARN': None
-                })
-            except ClientError as e:
-                print(f"Failed to retrieve tape archive details for {tape_arn}: {e}", file=sys.stderr)
-                continue
 
-    # build the header labels
-    tapes.headerlabels = {
-        "TapeBarcode": "Tape Barcode",
-        "TapeCreatedDate": "Created Date",
-        "TapeSizeInBytes": "Size in Bytes",
-        "TapeStatus": "Status",
-        "TapeUsedInBytes": "Used Bytes",
-        "PoolId": "Pool ID",
-        "Worm": "WORM",
-        "PoolEntryDate": "Pool Entry Date",
-        "GatewayARN": "Gateway ARN"
-    }
+    batches = tape_batches(iter_tape_infos(client), gateway_arns, describe_batch_size(ctx))
+    loggers['debug'].debug("Describing tapes in %d batches", len(batches))
 
-    return tapes
+    for (gateway_arn, tape_arns), rows, error in run_concurrently(ctx, lambda batch: describe_tape_batch(client, batch), batches):
+        if error is not None:
+            if not isinstance(error, ClientError):
+                raise error
+            kind = f"tape details on {gateway_arn}" if gateway_arn else "tape archive details"
+            print(f"Failed to retrieve {kind} for {len(tape_arns)} tapes starting {tape_arns[0]}: {error}", file=sys.stderr)
+            continue
+        for row in rows:
+            tapes.append(row)
 
-def format_tape_data(data: SauceData, units: str = "GiB"):
-    modified_headers = data.headerlabels.copy()
-    modified_tapes = []
+    tapes.sort_data([('TapeBarcode', 'asc')])
 
-    # Convert TapeCreatedDate and PoolEntryDate to date and time only
-    for tape in data.data:
-        if isinstance(tape['TapeCreatedDate'], str):
-            tape['TapeCreatedDate'] = datetime.fromisoformat(tape['TapeCreatedDate'])
-        tape['TapeCreatedDate'] = tape['TapeCreatedDate'].strftime("%Y-%m-%d %H:%M")  # Format to date and time only
+    # build the header labels
+    tapes.headerlabels = dict(TAPE_HEADER_LABELS)
+
+    return tapes
 
-        if isinstance(tape['PoolEntryDate'], str):
-            tape['PoolEntryDate'] = datetime.fromisoformat(tape['PoolEntryDate'])
-        tape['PoolEntryDate'] = tape['PoolEntryDate'].strftime("%Y-%m-%d %H:%M")  # Format to date and time only
+def list_cached_tapes(ctx: typer.Context, gateway_arns=None, where: str = None) -> SauceData:
+    """
+    List tapes from the local tape inventory, with no AWS calls.
 
-        # convert the GatewayARN to just the gateway ID if defined
-        if tape['GatewayARN'] is not None:
-            tape['GatewayARN'] = tape['GatewayARN'].split('/')[-1]
+    Archived tapes are always included, as in list_tapes().
+    """
+    store = get_tape_store(ctx)
+    try:
+        if store.count() == 0:
+            typer.echo("The tape inventory is empty; run 'sauce tapes sync' first.", err=True)
+            raise typer.Exit(code=1)
+        try:
+            rows = [row for row in store.query(where)
+                    if row['GatewayARN'] is None or gateway_selected(row['GatewayARN'], gateway_arns)]
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+    finally:
+        store.close()
+
+    tapes = SauceData(data=rows)
+    tapes.headerlabels = dict(TAPE_HEADER_LABELS)
+    return tapes
 
-        # Convert TapeSizeInBytes and TapeUsedInBytes to specified units
-        tape['TapeSizeInBytes'] = format(convert_bytes(tape['TapeSizeInBytes'], units), ".1f")
-        tape['TapeUsedInBytes'] = format(convert_bytes(tape['TapeUsedInBytes'], units), ".1f")
+def format_tape_date(value) -> str:
+    # dates are datetimes from AWS and ISO strings from the tape inventory
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.strftime("%Y-%m-%d %H:%M")  # Format to date and time only
 
-        modified_tapes.append(tape)
+def add_tape_formatters(data: SauceData, units: str = "GiB"):
+    """
+    Attach table formatters for tape dates, sizes and gateways.
 
-    # Modify the corresponding header name in headers to reflect the new units
+    Rows keep their raw values, so JSON and CSV output carry exact byte counts, ISO timestamps and
+    full gateway ARNs, and tables only format the cells they show.
+    """
     modified_units = units[0].capitalize() + units[1:-1] + units[-1].capitalize()
-    modified_headers['TapeSizeInBytes'] = modified_headers['TapeSizeInBytes'].replace("Bytes", modified_units)
-    modified_headers['TapeUsedInBytes'] = modified_headers['TapeUsedInBytes'].replace("Bytes", modified_units)
-    modified_headers['GatewayARN'] = "Gateway"
+    size = lambda value: format(convert_bytes(value, units), ".1f")
 
-    data.data = modified_tapes
-    data.headerlabels = modified_headers
-    return True
+    data.set_formatter('TapeCreatedDate', format_tape_date)
+    data.set_formatter('PoolEntryDate', format_tape_date)
+    data.set_formatter('TapeSizeInBytes', size, data.headerlabels['TapeSizeInBytes'].replace("Bytes", modified_units))
+    data.set_formatter('TapeUsedInBytes', size, data.headerlabels['TapeUsedInBytes'].replace("Bytes", modified_units))
+    # convert the GatewayARN to just the gateway ID
+    data.set_formatter('GatewayARN', lambda gateway_arn: gateway_arn.split('/')[-1], "Gateway")
 
 @app.command()
 def listvtltapes(
     ctx: typer.Context,
-    gateway_arns: list[str] = typer.Argument(default=None, help="Zero or more gateway ARNs/IDs to list tapes for.")
+    gateway_arns: list[str] = typer.Argument(default=None, help="Zero or more gateway ARNs/IDs to list tapes for."),
+    cached: bool = typer.Option(False, "--cached", help="List tapes from the local inventory (see 'sauce tapes sync') instead of AWS."),
+    where: Optional[str] = typer.Option(None, "--where", help="Filter the inventory, e.g. 'status=AVAILABLE and used>50GiB' or 'barcode~SYN01*'. Implies --cached.")
 ):
     """
     List tapes in the AWS Tape Gateway Virtual Tape Library.
@@ -123,7 +217,10 @@ def listvtltapes(
     """
 
     # create SauceData object
-    tapedata = list_tapes(ctx, gateway_arns)
+    if cached or where:
+        tapedata = list_cached_tapes(ctx, gateway_arns, where)
+    else:
+        tapedata = list_tapes(ctx, gateway_arns)
 
     # set the output format if OUTPUT is defined in ctx
     if "OUTPUT" in ctx.obj and ctx.obj["OUTPUT"] is not None:
@@ -137,11 +234,8 @@ def listvtltapes(
     #print(tapedata.data)
     #print(tapedata.headers)
 
-    # Display the table
-    #m_headers, m_tapes = format_tape_data(headers, tapes)
-    if not format_tape_data(tapedata):
-        typer.echo("Failed to format tape data.")
-        return
+    # Display the table, formatting only the cells that are shown
+    add_tape_formatters(tapedata)
     #print(tapedata.data)
     #print(tapedata.headers)
     #print(tapedata.headerlabels)
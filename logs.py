@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# logs.py
+# Read and search sauce's own logs, including rotated and compressed segments.
+
+import os
+import re
+import typer
+from collections import deque
+from typing import Optional
+
+from utils.logging import get_loggers, list_log_segments, open_log_segment
+
+# Get the loggers
+loggers = get_loggers()
+
+LOG_FILES = {
+    "cmdline": "cmdline.log",
+    "error": "error.log",
+    "debug": "debug.log",
+    "json": "json.log",
+}
+
+def iter_log_lines(log_dir: str, filename: str, pattern=None):
+    """
+    Yield the lines of a log and all its rotated segments, oldest first.
+
+    Compressed segments are decompressed as a stream, one line at a time, so memory use does not
+    depend on the size of the log.
+
+    Parameters:
+    log_dir (str): The log directory.
+    filename (str): The base log file name, e.g. 'debug.log'.
+    pattern (re.Pattern, optional): Only yield lines matching this pattern.
+    """
+    segments = list_log_segments(log_dir, filename)
+    active = os.path.join(log_dir, filename)
+    if os.path.exists(active):
+        segments.append(active)
+
+    for segment in segments:
+        try:
+            with open_log_segment(segment) as file:
+                for line in file:
+                    if pattern is None or pattern.search(line):
+                        yield line.rstrip("\n")
+        except (OSError, EOFError) as e:
+            # a segment may be rotated or pruned while we read; carry on with the rest
+            loggers['error'].error("Error reading log segment %s: %s", segment, e)
+
+def logs(
+    ctx: typer.Context,
+    log: str = typer.Argument("debug", help="Log to read: cmdline, error, debug or json."),
+    grep: Optional[str] = typer.Option(None, "--grep", "-g", help="Only show lines matching this regular expression."),
+    ignore_case: bool = typer.Option(False, "--ignore-case", "-i", help="Case-insensitive --grep."),
+    tail: int = typer.Option(0, "--tail", help="Only show the last N matching lines."),
+):
+    """
+    Show or search a sauce log across all rotated and compressed segments.
+    """
+    loggers['debug'].debug("Executing logs() subcommand")
+
+    if log not in LOG_FILES:
+        raise typer.BadParameter(f"Unknown log: {log}. Use one of {', '.join(LOG_FILES)}.")
+
+    try:
+        pattern = re.compile(grep, re.IGNORECASE if ignore_case else 0) if grep else None
+    except re.error as e:
+        raise typer.BadParameter(f"Invalid --grep pattern: {e}")
+
+    lines = iter_log_lines(ctx.obj["LOG_DIR"], LOG_FILES[log], pattern)
+    if tail > 0:
+        # only the last N lines are ever held in memory
+        lines = deque(lines, maxlen=tail)
+
+    for line in lines:
+        typer.echo(line)
+
+if __name__ == "__main__":
+    typer.run(logs)
@@ -3,12 +3,16 @@
 import typer
 from utils.utilities import get_terminal_width, fit_table_columns, convert_bytes, convert_size_to_bytes
 from utils.logging import get_loggers
-from utils.amazon import build_arn, get_region_from_arn
+from utils.amazon import build_arn, get_region_from_arn, get_identity, get_aws_session, get_aws_client
+from utils.barcodes import BarcodeAllocator, read_legacy_barcodes
+from utils.concurrency import run_concurrently
+from listvtltapes import iter_tape_infos
 
-import boto3
 import argparse
 import os
 import re
+import sys
+import uuid
 from botocore.exceptions import ClientError, BotoCoreError
 import configparser
 
@@ -20,61 +24,55 @@ MAXERROR = 10
 TAPE_STORAGE_FILE = os.path.expanduser("~/.awstapes")
 DEFAULT_TAPE_POOL = "DEEP_ARCHIVE"
 COUNT_HARD_LIMIT = 10
+# --bulk limits: the most tapes a gateway can hold, and CreateTapes' NumTapesToCreate maximum
+BULK_COUNT_LIMIT = 1500
+CREATE_TAPES_BATCH_SIZE = 10
 
-# Function to read the stored barcodes
-def read_stored_barcodes():
-    if os.path.exists(TAPE_STORAGE_FILE):
-        with open(TAPE_STORAGE_FILE, "r") as file:
-            return [line.strip().split(",") for line in file.readlines()]
-    return []
-
-# Function to write a new barcode to the storage file
-def write_stored_barcode(barcode, region, tape_pool):
-    with open(TAPE_STORAGE_FILE, "a") as file:
-        file.write(f"{barcode},{region},{tape_pool}\n")
-
-# Function to get the list of tapes and update the storage file
-def list_and_update_tapes(client, prefix, region):
-    stored_barcodes = read_stored_barcodes()
-    tapes = client.list_tapes()
-    tape_barcodes = [(tape['TapeBarcode'], tape.get('PoolId', DEFAULT_TAPE_POOL)) for tape in tapes['TapeInfos'] if tape['TapeBarcode'].startswith(prefix)]
-    tape_barcodes += [(barcode, tape_pool) for barcode, stored_region, tape_pool in stored_barcodes if stored_region == region and barcode.startswith(prefix)]
-    updated_barcodes = sorted(set(tape_barcodes))
-
-    # Update the storage file with the fetched tapes
-    for barcode, tape_pool in updated_barcodes:
-        if not any(barcode == b and region == r for b, r, _ in stored_barcodes):
-            write_stored_barcode(barcode, region, tape_pool)
-
-    return updated_barcodes
-
-# Function to identify the next tape in sequence
-def next_tape_in_sequence(last_tape, prefix):
-    if not last_tape:
-        return f"{prefix}000001"
-
-    last_number_hex = last_tape[0][len(prefix):]  # last_tape is now a tuple (barcode, tape_pool)
-    next_number = int(last_number_hex, 16) + 1
-    next_number_hex = f"{next_number:06X}"
-    return f"{prefix}{next_number_hex}"
+def seed_barcodes(allocator, client, prefix, region):
+    """
+    Set the barcode high-water mark for prefix in region from the gateway's tapes and ~/.awstapes.
+    """
+    barcodes = [(info['TapeBarcode'], info.get('PoolId', DEFAULT_TAPE_POOL)) for info in iter_tape_infos(client)
+                if info['TapeBarcode'].startswith(prefix)]
+    barcodes += [(barcode, tape_pool) for barcode, tape_pool in read_legacy_barcodes(TAPE_STORAGE_FILE, region)
+                 if barcode.startswith(prefix)]
+    allocator.seed(prefix, region, barcodes)
+
+def open_allocator(ctx, dry_run=False):
+    on_wait = lambda: print("Waiting for another mktapes run to finish allocating barcodes...", file=sys.stderr)
+    return BarcodeAllocator(ctx.obj["CACHE_DIR"], on_wait=on_wait, dry_run=dry_run)
+
+def resolve_tape_pool(allocator, client, prefix, region, tape_pool, rescan):
+    """
+    Seed the allocator if needed and return the pool for new tapes: that of the last tape in the
+    sequence, if there is one.
+    """
+    high_water = allocator.high_water(prefix, region)
+    if rescan or high_water is None:
+        seed_barcodes(allocator, client, prefix, region)
+        high_water = allocator.high_water(prefix, region)
+    return high_water[1] or tape_pool
+
+def barcode_in_use(error) -> bool:
+    return (isinstance(error, ClientError) and error.response['Error']['Code'] == 'InvalidGatewayRequestException'
+            and 'BarcodeAlreadyInUse' in str(error))
 
 # Function to create tapes
-def create_tapes(client, count, barcode_prefix, gateway_arn, size_in_bytes, tape_pool, dry_run, region):
-    tape_barcodes = list_and_update_tapes(client, barcode_prefix, region)
-    last_tape = tape_barcodes[-1] if tape_barcodes else None
-    last_tape_pool = last_tape[1] if last_tape else tape_pool
-
-    # Create the number of tapes requested
-    for _ in range(count):
-        error_count = 0
-        while error_count < MAXERROR:
-            try:
-                barcode = next_tape_in_sequence(last_tape, barcode_prefix)
-                last_tape = (barcode, last_tape_pool)  # Update the last tape for the next iteration
+def create_tapes(ctx, client, count, barcode_prefix, gateway_arn, size_in_bytes, tape_pool, dry_run, region, rescan=False):
+    with open_allocator(ctx, dry_run) as allocator:
+        last_tape_pool = resolve_tape_pool(allocator, client, barcode_prefix, region, tape_pool, rescan)
 
-                if dry_run:
-                    print(f"Tape to be created: Barcode: {barcode}, Pool: {last_tape_pool}")
-                else:
+        if dry_run:
+            for barcode in allocator.preview(barcode_prefix, region, count):
+                print(f"Tape to be created: Barcode: {barcode}, Pool: {last_tape_pool}")
+            return
+
+        # Create the number of tapes requested
+        for _ in range(count):
+            error_count = 0
+            while error_count < MAXERROR:
+                try:
+                    barcode = allocator.allocate(barcode_prefix, region, last_tape_pool)
                     response = client.create_tape_with_barcode(
                         GatewayARN=gateway_arn,
                         TapeSizeInBytes=size_in_bytes,
@@ -82,28 +80,138 @@ def create_tapes(client, count, barcode_prefix, gateway_arn, size_in_bytes, tape
                         PoolId=last_tape_pool
                     )
                     print(f"Created tape with barcode: {barcode}, Pool: {last_tape_pool}, ARN: {response['TapeARN']}")
-                    write_stored_barcode(barcode, region, last_tape_pool)
-                break
-            except ClientError as e:
-                if e.response['Error']['Code'] == 'InvalidGatewayRequestException' and 'BarcodeAlreadyInUse' in str(e):
-                    print(f"Barcode {barcode} already in use. Trying next barcode.")
-                    error_count += 1
-                    write_stored_barcode(barcode, region, last_tape_pool)  # Record the conflict barcode
-                else:
+                    break
+                except ClientError as e:
+                    if barcode_in_use(e):
+                        # the stored mark is behind the gateway; catch up with its tapes in one scan
+                        # rather than stepping through them one create call at a time.  The barcode
+                        # stays allocated, so the next attempt moves past it even if the scan doesn't
+                        print(f"Barcode {barcode} already in use. Rescanning the gateway's tapes.")
+                        seed_barcodes(allocator, client, barcode_prefix, region)
+                        error_count += 1
+                    else:
+                        raise
+                except BotoCoreError as e:
+                    # Handle other boto core errors
+                    print(f"An unexpected error occurred: {e}")
                     raise
-            except BotoCoreError as e:
-                # Handle other boto core errors
-                print(f"An unexpected error occurred: {e}")
-                raise
+
+def create_tape_batch(client, token, count, prefix, gateway_arn, size_in_bytes, tape_pool):
+    """
+    Create up to CREATE_TAPES_BATCH_SIZE tapes with one CreateTapes call and return their ARNs.
+
+    The client token makes the call idempotent, so retrying a batch after an interruption returns
+    the tapes already created instead of creating more.
+    """
+    response = client.create_tapes(
+        GatewayARN=gateway_arn,
+        TapeSizeInBytes=size_in_bytes,
+        ClientToken=token,
+        NumTapesToCreate=count,
+        TapeBarcodePrefix=prefix,
+        PoolId=tape_pool
+    )
+    return response['TapeARNs']
+
+def create_tapes_bulk(ctx, client, count, barcode_prefix, gateway_arn, size_in_bytes, tape_pool, dry_run, region,
+                      explicit=False, rescan=False):
+    """
+    Create many tapes concurrently, journalling progress so an interrupted run can be resumed.
+
+    By default tapes are created in CreateTapes batches and AWS picks the barcodes after the
+    prefix.  With explicit, sequential barcodes are allocated up front and created with parallel
+    create_tape_with_barcode calls.  Running the same command again resumes an unfinished run.
+    Calls go through the shared storagegateway rate limit.
+    """
+    with open_allocator(ctx, dry_run) as allocator:
+        if explicit:
+            tape_pool = resolve_tape_pool(allocator, client, barcode_prefix, region, tape_pool, rescan)
+        run_id = allocator.find_run(gateway_arn, barcode_prefix, region, tape_pool, size_in_bytes, count, explicit)
+        pending = allocator.pending_items(run_id) if run_id else None
+
+        if dry_run:
+            if pending is not None:
+                print(f"Would resume an earlier run with {sum(tapes for _, tapes in pending)} of {count} tapes left to create")
+            elif explicit:
+                pending = [(barcode, 1) for barcode in allocator.preview(barcode_prefix, region, count)]
+            else:
+                pending = [(f"batch-{start // CREATE_TAPES_BATCH_SIZE}", min(CREATE_TAPES_BATCH_SIZE, count - start))
+                           for start in range(0, count, CREATE_TAPES_BATCH_SIZE)]
+            for item, tapes in pending:
+                if explicit:
+                    print(f"Tape to be created: Barcode: {item}, Pool: {tape_pool}")
+                else:
+                    print(f"CreateTapes call: {tapes} tapes, Prefix: {barcode_prefix}, Pool: {tape_pool}")
+            print(f"{sum(tapes for _, tapes in pending)} tapes in {len(pending)} calls")
+            return
+
+        if run_id:
+            print(f"Resuming an earlier run with {sum(tapes for _, tapes in pending)} of {count} tapes left to create")
+        else:
+            if explicit:
+                items = [(allocator.allocate(barcode_prefix, region, tape_pool), 1) for _ in range(count)]
+            else:
+                # client tokens must be unique per batch and stable across resumes
+                token = uuid.uuid4().hex
+                items = [(f"{token}-{start // CREATE_TAPES_BATCH_SIZE:04d}", min(CREATE_TAPES_BATCH_SIZE, count - start))
+                         for start in range(0, count, CREATE_TAPES_BATCH_SIZE)]
+            run_id = allocator.start_run(gateway_arn, barcode_prefix, region, tape_pool, size_in_bytes, count, explicit, items)
+            pending = items
+
+        if explicit:
+            create = lambda item: [client.create_tape_with_barcode(GatewayARN=gateway_arn, TapeSizeInBytes=size_in_bytes,
+                                                                   TapeBarcode=item[0], PoolId=tape_pool)['TapeARN']]
+        else:
+            create = lambda item: create_tape_batch(client, item[0], item[1], barcode_prefix, gateway_arn, size_in_bytes, tape_pool)
+
+        created = 0
+        rescans = 0
+        while pending:
+            in_use = []
+            for (item, tapes), tape_arns, error in run_concurrently(ctx, create, pending):
+                if error is None:
+                    allocator.complete_item(run_id, item, tape_arns)
+                    created += len(tape_arns)
+                    for tape_arn in tape_arns:
+                        print(f"Created tape {tape_arn.split('/')[-1]}, Pool: {tape_pool}, ARN: {tape_arn}")
+                elif explicit and barcode_in_use(error) and rescans < MAXERROR:
+                    in_use.append(item)
+                elif isinstance(error, (ClientError, BotoCoreError)):
+                    print(f"Failed to create {tapes} tapes ({item}): {error}", file=sys.stderr)
+                else:
+                    raise error
+
+            pending = []
+            if in_use:
+                # one rescan per round moves the mark past every tape the gateway already has
+                rescans += 1
+                print(f"{len(in_use)} barcodes already in use. Rescanning the gateway's tapes.")
+                seed_barcodes(allocator, client, barcode_prefix, region)
+                for item in sorted(in_use):
+                    barcode = allocator.allocate(barcode_prefix, region, tape_pool)
+                    print(f"Barcode {item} already in use. Trying {barcode}.")
+                    allocator.replace_item(run_id, item, barcode)
+                    pending.append((barcode, 1))
+
+        left = allocator.pending_items(run_id)
+        if left:
+            print(f"Created {created} tapes; {sum(tapes for _, tapes in left)} were not created. "
+                  "Run the same command again to resume.", file=sys.stderr)
+        else:
+            allocator.finish_run(run_id)
+            print(f"Created {created} tapes")
 
 @app.command()
 def mktapes(
         ctx: typer.Context,
-        count: int = typer.Option(1, help="Number of tapes to create (max 10)"),
+        count: int = typer.Option(1, help=f"Number of tapes to create (max {COUNT_HARD_LIMIT}, or {BULK_COUNT_LIMIT} with --bulk)"),
         prefix: str = typer.Option(None, help="Barcode prefix (1-4 characters)"),
         gateway_arn: str = typer.Argument(None, help="ARN of the Gateway"),
         pool: str = typer.Option(None, help="Tape pool to use"),
         size_in_bytes: int = typer.Option(None, help="Size of the tape in bytes"),
+        rescan: bool = typer.Option(False, "--rescan", help="Rescan the gateway's tapes before allocating barcodes"),
+        bulk: bool = typer.Option(False, "--bulk", help="Create tapes concurrently in batches; rerun to resume an interrupted run"),
+        explicit_barcodes: bool = typer.Option(False, "--explicit-barcodes", help="With --bulk, allocate sequential barcodes instead of letting AWS pick them"),
     ):
     """
     Interact with AWS Storage Gateway to manage tapes.
@@ -131,8 +239,10 @@ def mktapes(
     if gateway_arn:
         if not gateway_arn.startswith("arn:"):
             if re.match("^sgw-[A-F0-9]{8,}$", gateway_arn):
-                region = get_region_from_arn(ctx.obj["CONFIG"].get("default", "region", fallback="us-east-1"))
-                gateway_arn = build_arn("storagegateway", "gateway", gateway_arn, region=region)
+                region = config.get("default", "region", fallback=None) or get_aws_session(ctx).region_name or "us-east-1"
+                identity = get_identity(ctx)
+                gateway_arn = build_arn("storagegateway", "gateway", gateway_arn, partition=identity["Partition"],
+                                        region=region, account_id=identity["Account"])
             else:
                 raise typer.BadParameter("Gateway ARN or ID is not valid.")
     else:
@@ -159,8 +269,11 @@ def mktapes(
     region = get_region_from_arn(gateway_arn)
 
     # Validate the count
-    if count < 1 or count > COUNT_HARD_LIMIT:
-        raise typer.BadParameter(f"Count must be between 1 and {COUNT_HARD_LIMIT}.")
+    limit = BULK_COUNT_LIMIT if bulk else COUNT_HARD_LIMIT
+    if count < 1 or count > limit:
+        raise typer.BadParameter(f"Count must be between 1 and {limit}.")
+    if bulk and not explicit_barcodes and not re.match("^[A-Z]{1,4}$", prefix):
+        raise typer.BadParameter("CreateTapes needs a prefix of 1-4 letters A-Z; use --explicit-barcodes for other prefixes.")
 
     """
     # Print some debug info and exit
@@ -174,8 +287,12 @@ def mktapes(
     """
     # Create the boto3 client
     try:
-        client = boto3.client('storagegateway', region_name=region)
-        create_tapes(client, count, prefix, gateway_arn, size_in_bytes, tape_pool, dry_run, region)
+        client = get_aws_client(ctx, 'storagegateway', region_name=region)
+        if bulk:
+            create_tapes_bulk(ctx, client, count, prefix, gateway_arn, size_in_bytes, tape_pool, dry_run, region,
+                              explicit_barcodes, rescan)
+        else:
+            create_tapes(ctx, client, count, prefix, gateway_arn, size_in_bytes, tape_pool, dry_run, region, rescan)
     except ClientError as e:
         typer.echo(f"Error connecting to AWS: {e}", err=True)
     except BotoCoreError as e:
@@ -7,8 +7,16 @@ from boto3.session import Session
 from SauceData.handler import SauceData
 from typing import Optional
 from utils.amazon import get_aws_session, get_aws_client
+from billing import load_daily_costs, fetch_stale_costs
+from billing import CostAggregator, print_billing_view, BILLING_VIEWS
+from utils.amazon import get_identity
+from utils.coststore import get_cost_store, dimension_name
+from utils.cur import CUR_COLUMNS, find_cur_files, aggregate_cur_files
+from utils.anomalies import detect_anomalies, DEFAULT_ALPHA, DEFAULT_THRESHOLD, DEFAULT_MIN_AMOUNT
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import calendar
+import sys
 
 
 from utils.utilities import get_last_day_of_month, format_time_period
@@ -19,6 +27,19 @@ from babel import Locale
 
 app = typer.Typer(help="New AWS billing commands.")
 
+SERVICE_GROUP_BY = [{'Type': 'DIMENSION', 'Key': 'SERVICE'}]
+
+# Cost Explorer dimensions accepted by drill --by, and their column labels
+DRILL_DIMENSIONS = {
+    'service': ('SERVICE', 'Service'),
+    'usage-type': ('USAGE_TYPE', 'Usage Type'),
+    'account': ('LINKED_ACCOUNT', 'Account'),
+    'region': ('REGION', 'Region'),
+    'operation': ('OPERATION', 'Operation'),
+    'instance-type': ('INSTANCE_TYPE', 'Instance Type'),
+    'az': ('AZ', 'Availability Zone'),
+}
+
 
 
 ### Utiulity functions
@@ -33,7 +54,7 @@ def fetch_current_billing(ce_client, start_date, end_date, granularity='MONTHLY'
         currency = response['ResultsByTime'][0]['Total']['UnblendedCost'].get('Unit', 'USD')  # Default to USD
         return amount, currency
     except Exception as e:
-        logging.getLogger('newbilling').error(f"Error fetching current billing: {e}")
+        logging.getLogger('newbilling').error("Error fetching current billing: %s", e)
         raise
 
 def fetch_cost_forecast(ce_client, start_date, end_date, granularity='MONTHLY'):
@@ -47,7 +68,7 @@ def fetch_cost_forecast(ce_client, start_date, end_date, granularity='MONTHLY'):
         currency = forecast['Total'].get('Unit', 'USD')  # Default to USD
         return amount, currency
     except Exception as e:
-        logging.getLogger('newbilling').error(f"Error fetching cost forecast: {e}")
+        logging.getLogger('newbilling').error("Error fetching cost forecast: %s", e)
         raise
 
 def format_amount_with_currency(amount: float, currency_code: str, locale: str = 'en_US') -> str:
@@ -65,40 +86,28 @@ def format_amount_with_currency(amount: float, currency_code: str, locale: str =
     try:
         return format_currency(amount, currency_code, locale=locale)
     except Exception as e:
-        logging.getLogger('newbilling').warning(f"Failed to format currency: {e}. Falling back to default formatting.")
+        logging.getLogger('newbilling').warning("Failed to format currency: %s. Falling back to default formatting.", e)
         # Fallback to a simple format if Babel fails (e.g., unknown currency code)
         return f"{currency_code} {amount:,.2f}"
 
-def usage_by_service(ce_client, start_date: str, end_date: str) -> dict:
+def group_usage_by_service(results_by_time: list) -> dict:
     """
-    Fetches the usage and cost data grouped by service for a given time range.
+    Regroup a daily Cost Explorer ResultsByTime list grouped by SERVICE into per-service daily costs.
 
     Args:
-        ce_client: The AWS Cost Explorer client.
-        start_date (str): The start date for the query (inclusive), in 'YYYY-MM-DD' format.
-        end_date (str): The end date for the query (inclusive), in 'YYYY-MM-DD' format.
+        results_by_time (iterable): ResultsByTime entries, from AWS or the local cost store.
 
     Returns:
         dict: A dictionary with service names as keys and their respective costs per day as values.
     """
-    try:
-        response = ce_client.get_cost_and_usage(
-            TimePeriod={'Start': start_date, 'End': end_date},
-            Granularity='DAILY',
-            Metrics=['UnblendedCost'],
-            GroupBy=[{'Type': 'DIMENSION', 'Key': 'SERVICE'}]
-        )
-        service_data = {}
-        for result in response['ResultsByTime']:
-            date = result['TimePeriod']['Start']
-            for group in result['Groups']:
-                service_name = group['Keys'][0]
-                amount = group['Metrics']['UnblendedCost']['Amount']
-                service_data.setdefault(service_name, []).append({'Date': date, 'Amount': amount})
-        return service_data
-    except Exception as e:
-        logging.getLogger('newbilling').error(f"Error fetching usage by service: {e}")
-        return {}
+    service_data = {}
+    for result in results_by_time:
+        date = result['TimePeriod']['Start']
+        for group in result['Groups']:
+            service_name = group['Keys'][0]
+            amount = group['Metrics']['UnblendedCost']['Amount']
+            service_data.setdefault(service_name, []).append({'Date': date, 'Amount': amount})
+    return service_data
 
 def prefill_date_headers(start_date_str: str, end_date_str: str) -> list:
     """
@@ -137,20 +146,47 @@ def get_dates():
     
     return start_of_month, today, tomorrow, end_of_month
 
+def month_periods(months: int, today: datetime = None) -> list:
+    """
+    Return (start, end) dates for the last `months` calendar months, oldest first, ending with the
+    current month.  End dates are exclusive, and the current month ends tomorrow.
+
+    Args:
+        months (int): The number of months, including the current one.
+        today (datetime, optional): Override the current date.
+
+    Returns:
+        list: (start, end) pairs in 'YYYY-MM-DD' format.
+    """
+    today = today or datetime.now()
+    periods = []
+    year, month = today.year, today.month
+    for _ in range(months):
+        start = datetime(year, month, 1)
+        end = start + timedelta(days=calendar.monthrange(year, month)[1])
+        periods.append((start.strftime('%Y-%m-%d'), min(end, today + timedelta(days=1)).strftime('%Y-%m-%d')))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return periods[::-1]
+
 ###
 ### Subcommands
 ###
 
 @app.command()
-def mtd(ctx: typer.Context):
+def mtd(ctx: typer.Context,
+        refresh: bool = typer.Option(False, "--refresh", help="Fetch the whole month from AWS again instead of using stored costs.")):
     """
     Get the month-to-date billing summary grouped by service.
     """
-    ce_client = get_aws_client(ctx, 'ce')
     start_of_month, today, tomorrow, _ = get_dates()
 
-    # Fetch usage by service. Dates are specified in iso format
-    service_usage = usage_by_service(ce_client, start_of_month.strftime('%Y-%m-%d'), tomorrow.strftime('%Y-%m-%d'))
+    # Fetch usage by service, only going to AWS for days the cost store lacks. Dates are specified in iso format
+    response = load_daily_costs(ctx, start_of_month.strftime('%Y-%m-%d'), tomorrow.strftime('%Y-%m-%d'),
+                                SERVICE_GROUP_BY, refresh)
+    if response is None:
+        logging.getLogger('newbilling').error("Error fetching usage by service")
+        response = {'ResultsByTime': []}
+    service_usage = group_usage_by_service(response['ResultsByTime'])
 
     # Create a SauceData object and pre-fill headers with dates in DD-MMM format
     date_headers = [start_of_month + timedelta(days=x) for x in range((today - start_of_month).days + 1)]
@@ -191,7 +227,8 @@ def mtd(ctx: typer.Context):
     print(sauce_data)
 
 @app.command()
-def summary(ctx: typer.Context):
+def summary(ctx: typer.Context,
+            refresh: bool = typer.Option(False, "--refresh", help="Fetch the whole month from AWS again instead of using stored costs.")):
     ce_client = get_aws_client(ctx, 'ce')
     
     # Current date considerations
@@ -210,10 +247,17 @@ def summary(ctx: typer.Context):
 
     # Check if adjustment was necessary and log/inform accordingly
     if forecast_start_date > today:
-        logging.getLogger('newbilling').info(f"Adjusted forecast start date to {forecast_start_date_str} based on AWS's earliest supported date.")
+        logging.getLogger('newbilling').info("Adjusted forecast start date to %s based on AWS's earliest supported date.", forecast_start_date_str)
     
     # Fetch the forecast and current billing including currency
-    current_billing, current_currency = fetch_current_billing(ce_client, start_of_month, today.strftime('%Y-%m-%d'))
+    # current spend comes from the daily costs in the cost store; the forecast changes too often to store
+    response = load_daily_costs(ctx, start_of_month, today.strftime('%Y-%m-%d'), SERVICE_GROUP_BY, refresh)
+    if response is None:
+        current_billing, current_currency = fetch_current_billing(ce_client, start_of_month, today.strftime('%Y-%m-%d'))
+    else:
+        groups = [group for result in response['ResultsByTime'] for group in result['Groups']]
+        current_billing = sum(float(group['Metrics']['UnblendedCost']['Amount']) for group in groups)
+        current_currency = groups[0]['Metrics']['UnblendedCost']['Unit'] if groups else 'USD'
     cost_forecast, forecast_currency = fetch_cost_forecast(ce_client, forecast_start_date_str, forecast_end_date_str)
     
     # Use the utility function to format the output with the correct currency symbol
@@ -223,6 +267,311 @@ def summary(ctx: typer.Context):
     print(f"Current Spend: {current_spend_formatted}, Estimated Monthly Spend: {estimated_monthly_spend_formatted}")
 
 
+@app.command()
+def history(ctx: typer.Context,
+            months: int = typer.Option(13, "--months", help="Number of months to show, including the current one."),
+            refresh: bool = typer.Option(False, "--refresh", help="Fetch every month from AWS again instead of using stored costs.")):
+    """
+    Show cost per service per month for the last N months.
+    """
+    if months < 1:
+        raise typer.BadParameter("--months must be at least 1.")
+
+    periods = month_periods(months)
+    account = get_identity(ctx)['Account']
+    dimension = dimension_name(SERVICE_GROUP_BY)
+
+    # months missing from the cost store are fetched concurrently, one request per month
+    store = get_cost_store(ctx)
+    try:
+        if not fetch_stale_costs(ctx, store, account, periods, SERVICE_GROUP_BY, refresh):
+            logging.getLogger('newbilling').error("Some months could not be fetched; their costs may be incomplete")
+
+        month_costs = {}    # service -> {month: amount}
+        currency = 'USD'
+        for day, keys, amount, unit in store.rows(account, dimension, periods[0][0], periods[-1][1]):
+            month = datetime.strptime(day, '%Y-%m-%d').strftime('%b-%Y')
+            service = month_costs.setdefault(keys[0], {})
+            service[month] = service.get(month, 0.0) + amount
+            currency = unit
+    finally:
+        store.close()
+
+    month_headers = [datetime.strptime(start, '%Y-%m-%d').strftime('%b-%Y') for start, _ in periods]
+    mylocale = ctx.obj['LOCALE'] or 'en_US'
+
+    def format_row(label, costs):
+        row = {'Service': label, 'Total': format_amount_with_currency(sum(costs.values()), currency, mylocale)}
+        for month in month_headers:
+            row[month] = format_amount_with_currency(costs.get(month, 0.0), currency, mylocale)
+        return row
+
+    sauce_data = SauceData(data=[])
+    # newest month first, so the oldest months are the ones dropped on narrow terminals
+    sauce_data.headers = ['Service', 'Total'] + month_headers[::-1]
+    totals = {}
+    for service, costs in sorted(month_costs.items(), key=lambda item: sum(item[1].values())):
+        sauce_data.append(format_row(service, costs))
+        for month, amount in costs.items():
+            totals[month] = totals.get(month, 0.0) + amount
+    sauce_data.append(format_row('Total', totals))
+
+    sauce_data.output_format = ctx.obj['OUTPUT']
+    print(sauce_data)
+
+@app.command()
+def dashboard(ctx: typer.Context,
+              refresh: bool = typer.Option(False, "--refresh", help="Fetch both months from AWS again instead of using stored costs.")):
+    """
+    Show month-to-date spend, the forecast and each service's change from the same period last month.
+    """
+    today = datetime.now()
+    start_of_month = today.replace(day=1)
+    days_elapsed = (today - start_of_month).days + 1
+    previous_start = (start_of_month - timedelta(days=1)).replace(day=1)
+    previous_end = min(previous_start + timedelta(days=days_elapsed), start_of_month)
+    next_month = start_of_month + timedelta(days=calendar.monthrange(today.year, today.month)[1])
+
+    current_period = (start_of_month.strftime('%Y-%m-%d'), (today + timedelta(days=1)).strftime('%Y-%m-%d'))
+    previous_period = (previous_start.strftime('%Y-%m-%d'), previous_end.strftime('%Y-%m-%d'))
+
+    ce_client = get_aws_client(ctx, 'ce')
+    account = get_identity(ctx)['Account']
+    dimension = dimension_name(SERVICE_GROUP_BY)
+
+    # the forecast runs in the background while the stale days of both months are fetched
+    # concurrently, so the whole dashboard takes as long as the slowest Cost Explorer call
+    store = get_cost_store(ctx)
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="sauce-forecast") as executor:
+            forecast_future = executor.submit(fetch_cost_forecast, ce_client, today.strftime('%Y-%m-%d'), next_month.strftime('%Y-%m-%d'))
+            if not fetch_stale_costs(ctx, store, account, [current_period, previous_period], SERVICE_GROUP_BY, refresh):
+                logging.getLogger('newbilling').error("Some costs could not be fetched; the dashboard may be incomplete")
+            try:
+                forecast, _ = forecast_future.result()
+                forecast = float(forecast)
+            except Exception:
+                # already logged by fetch_cost_forecast; the rest of the dashboard is still useful
+                forecast = None
+
+        currency = 'USD'
+        costs = {}  # service -> [month to date, same period last month]
+        for column, (start, end) in enumerate((current_period, previous_period)):
+            for _, keys, amount, unit in store.rows(account, dimension, start, end):
+                costs.setdefault(keys[0], [0.0, 0.0])[column] += amount
+                currency = unit
+    finally:
+        store.close()
+
+    mylocale = ctx.obj['LOCALE'] or 'en_US'
+
+    def format_row(label, current, previous):
+        change = current - previous
+        return {
+            'Service': label,
+            'Month to Date': format_amount_with_currency(current, currency, mylocale),
+            'Last Month': format_amount_with_currency(previous, currency, mylocale),
+            'Change': format_amount_with_currency(change, currency, mylocale),
+            'Change %': f"{change / previous * 100:+.1f}%" if previous else "n/a"
+        }
+
+    sauce_data = SauceData(data=[])
+    sauce_data.headers = ['Service', 'Month to Date', 'Last Month', 'Change', 'Change %']
+    for service, (current, previous) in sorted(costs.items(), key=lambda item: item[1][0]):
+        sauce_data.append(format_row(service, current, previous))
+    current_total = sum(current for current, _ in costs.values())
+    previous_total = sum(previous for _, previous in costs.values())
+    sauce_data.append(format_row('Total', current_total, previous_total))
+
+    sauce_data.output_format = ctx.obj['OUTPUT']
+    if sauce_data.output_format == 'table':
+        forecast_formatted = format_amount_with_currency(forecast, currency, mylocale) if forecast is not None else "unavailable"
+        print(f"Month to Date: {format_amount_with_currency(current_total, currency, mylocale)}, "
+              f"Estimated Monthly Spend: {forecast_formatted}, "
+              f"Last Month to {previous_end - timedelta(days=1):%d-%b}: {format_amount_with_currency(previous_total, currency, mylocale)}")
+    print(sauce_data)
+
+def drill_level(costs: SauceData, columns: list, currency: str, mylocale: str) -> SauceData:
+    """
+    Sum stored costs by the given columns and return them formatted, most expensive first, with a Total row.
+    """
+    level = costs.aggregate(columns, ['Cost'])
+    level.data.sort(key=lambda row: row['Cost'], reverse=True)
+    total = sum(row['Cost'] for row in level.data)
+    for row in level.data:
+        row['Cost'] = format_amount_with_currency(row['Cost'], currency, mylocale)
+    level.append({columns[-1]: 'Total', 'Cost': format_amount_with_currency(total, currency, mylocale)})
+    return level
+
+@app.command()
+def drill(ctx: typer.Context,
+          value: Optional[str] = typer.Argument(None, help="Break this value of the first dimension down by the second."),
+          by: str = typer.Option("service,usage-type", "--by", help=f"Two dimensions, from: {', '.join(DRILL_DIMENSIONS)}."),
+          days: int = typer.Option(0, "--days", help="Cover the last N days instead of the month to date."),
+          interactive: bool = typer.Option(False, "--interactive", "-i", help="Pick values to drill into from a prompt."),
+          refresh: bool = typer.Option(False, "--refresh", help="Fetch the period from AWS again instead of using stored costs.")):
+    """
+    Break costs down by two dimensions, e.g. service then usage type, or account then service.
+
+    Costs are fetched once grouped by both dimensions and kept in the cost store, so every
+    drill-down after that is answered locally.
+    """
+    names = [name.strip() for name in by.split(',')]
+    if len(names) != 2 or any(name not in DRILL_DIMENSIONS for name in names):
+        raise typer.BadParameter(f"--by takes two of: {', '.join(DRILL_DIMENSIONS)}")
+    (first_key, first_label), (second_key, second_label) = (DRILL_DIMENSIONS[name] for name in names)
+    group_by = [{'Type': 'DIMENSION', 'Key': first_key}, {'Type': 'DIMENSION', 'Key': second_key}]
+
+    today = datetime.now()
+    start = today - timedelta(days=days - 1) if days > 0 else today.replace(day=1)
+    period = (start.strftime('%Y-%m-%d'), (today + timedelta(days=1)).strftime('%Y-%m-%d'))
+
+    account = get_identity(ctx)['Account']
+    store = get_cost_store(ctx)
+    try:
+        if not fetch_stale_costs(ctx, store, account, [period], group_by, refresh):
+            logging.getLogger('newbilling').error("Costs could not be fetched; showing stored costs only")
+
+        costs = SauceData(data=[], output_format=ctx.obj['OUTPUT'])
+        currency = 'USD'
+        for _, keys, amount, unit in store.rows(account, dimension_name(group_by), *period):
+            costs.append({first_label: keys[0], second_label: keys[1], 'Cost': amount})
+            currency = unit
+    finally:
+        store.close()
+
+    mylocale = ctx.obj['LOCALE'] or 'en_US'
+    values = {row[first_label] for row in costs.data}
+
+    def show(selected):
+        if selected is None:
+            print(drill_level(costs, [first_label], currency, mylocale))
+            return
+        if selected not in values:
+            typer.echo(f"No {first_label.lower()} named {selected} in this period.", err=True)
+            return
+        detail = costs.aggregate([first_label, second_label], ['Cost'])
+        detail.filter_data([lambda row: row[first_label] == selected])
+        print(drill_level(detail, [second_label], currency, mylocale))
+
+    show(value)
+    if not interactive:
+        return
+
+    # every answer below comes from the costs already in memory; no more AWS calls are made
+    while True:
+        selected = typer.prompt(f"\n{first_label} to drill into (blank to quit)", default="", show_default=False).strip()
+        if not selected:
+            break
+        show(selected)
+
+@app.command()
+def cur(ctx: typer.Context,
+        path: str = typer.Argument(..., help="A CUR .csv or .csv.gz file, or a directory of them; report manifests select the current version."),
+        by: str = typer.Option("service", "--by", help=f"Comma-separated columns to group by: {', '.join(CUR_COLUMNS)}, tag:KEY or a raw CUR column."),
+        view: Optional[str] = typer.Option(None, "--view", help=f"Print a billing view instead: {', '.join(BILLING_VIEWS)}."),
+        workers: int = typer.Option(0, "--workers", help="Processes used to read files in parallel (default: CPU count).")):
+    """
+    Aggregate local Cost and Usage Report files, with no Cost Explorer calls.
+    """
+    try:
+        files = find_cur_files(path)
+    except ValueError as e:
+        print(f"Error reading CUR manifest: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not files:
+        print(f"No CUR files (.csv or .csv.gz) found at {path}", file=sys.stderr)
+        sys.exit(1)
+    if view is not None and view not in BILLING_VIEWS:
+        raise typer.BadParameter(f"--view must be one of: {', '.join(BILLING_VIEWS)}")
+
+    columns = ['date', 'service'] if view else [column.strip() for column in by.split(',') if column.strip()]
+    logging.getLogger('newbilling').debug("Aggregating %d CUR files by %s", len(files), columns)
+    try:
+        totals, currency, count = aggregate_cur_files(files, columns, workers or None)
+    except ValueError as e:
+        print(f"Error reading CUR files: {e}", file=sys.stderr)
+        sys.exit(1)
+    logging.getLogger('newbilling').debug("Read %d CUR line items", count)
+
+    if view:
+        # shape the totals like Cost Explorer's daily results so the billing views work unchanged
+        results = {}
+        for (day, service), cost in totals.items():
+            results.setdefault(day, []).append({'Keys': [service], 'Metrics': {'UnblendedCost': {'Amount': str(cost)}}})
+        last_day = datetime.strptime(max(results), '%Y-%m-%d') if results else datetime.now()
+        costs = CostAggregator(last_day).update({'TimePeriod': {'Start': day}, 'Groups': groups} for day, groups in results.items())
+        print_billing_view(costs, view)
+        return
+
+    rows = SauceData(data=[], output_format=ctx.obj['OUTPUT'])
+    for key, cost in totals.items():
+        rows.append({**dict(zip(columns, key)), 'Cost': cost})
+    print(drill_level(rows, columns, currency or 'USD', ctx.obj['LOCALE'] or 'en_US'))
+
+@app.command()
+def anomalies(ctx: typer.Context,
+              days: int = typer.Option(7, "--days", help="Report anomalies from the last N days."),
+              history_days: int = typer.Option(90, "--history-days", help="Days of history to fetch for the baselines."),
+              threshold: float = typer.Option(None, "--threshold", help=f"Deviations above the baseline to flag (default: {DEFAULT_THRESHOLD})."),
+              min_amount: float = typer.Option(None, "--min-amount", help=f"Smallest increase over the baseline to flag (default: {DEFAULT_MIN_AMOUNT})."),
+              all_accounts: bool = typer.Option(False, "--all-accounts", help="Check every account in the cost store, without calling AWS.")):
+    """
+    Flag days where a service cost much more than its recent baseline.
+
+    Baselines are exponentially weighted averages of each service's daily cost, kept in the cost
+    store and updated with only the days added since the last run.
+    """
+    config = ctx.obj['CONFIG']
+    alpha = config.getfloat('anomalies', 'alpha', fallback=DEFAULT_ALPHA)
+    threshold = threshold if threshold is not None else config.getfloat('anomalies', 'threshold', fallback=DEFAULT_THRESHOLD)
+    min_amount = min_amount if min_amount is not None else config.getfloat('anomalies', 'min_amount', fallback=DEFAULT_MIN_AMOUNT)
+
+    today = datetime.now()
+    report_start = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    dimension = dimension_name(SERVICE_GROUP_BY)
+
+    store = get_cost_store(ctx)
+    try:
+        if all_accounts:
+            accounts = store.accounts(dimension)
+        else:
+            # only the days the store lacks are fetched, normally just the last few
+            accounts = [get_identity(ctx)['Account']]
+            period = ((today - timedelta(days=history_days)).strftime('%Y-%m-%d'), (today + timedelta(days=1)).strftime('%Y-%m-%d'))
+            if not fetch_stale_costs(ctx, store, accounts[0], [period], SERVICE_GROUP_BY):
+                logging.getLogger('newbilling').error("Costs could not be fetched; checking stored costs only")
+
+        sauce_data = SauceData(data=[], output_format=ctx.obj['OUTPUT'])
+        mylocale = ctx.obj['LOCALE'] or 'en_US'
+        for account in accounts:
+            currency = store.unit(account, dimension)
+            found = detect_anomalies(store, account, dimension, today.date(), alpha, threshold, min_amount)
+            # anomalies on final days found by earlier runs are kept in the store
+            reported = {(day, key) for day, key, *_ in found}
+            earlier = [(*anomaly, True) for anomaly in store.anomalies(account, dimension, report_start)
+                       if (anomaly[0], anomaly[1]) not in reported]
+            for day, key, amount, baseline, score, final in sorted(earlier + found):
+                if day < report_start:
+                    continue
+                sauce_data.append({
+                    **({'Account': account} if all_accounts else {}),
+                    'Date': day,
+                    'Service': key,
+                    'Cost': format_amount_with_currency(amount, currency, mylocale),
+                    'Baseline': format_amount_with_currency(baseline, currency, mylocale),
+                    'Deviations': f"{score:.1f}",
+                    'Status': 'final' if final else 'provisional'
+                })
+    finally:
+        store.close()
+
+    if not sauce_data.data:
+        if not ctx.obj['QUIET']:
+            print(f"No anomalies in the last {days} days.")
+        return
+    print(sauce_data)
+
 @app.command()
 def newbilling (
 #    start_date: str = typer.Option(..., help="Start date in 'YYYY-MM-DD' format"),
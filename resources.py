@@ -2,7 +2,7 @@
 
 import typer
 from utils.logging import get_loggers
-from utils.amazon import get_aws_client
+from utils.amazon import get_aws_client, get_identity, build_arn
 from SauceData.handler import SauceData
 
 app = typer.Typer()
@@ -12,6 +12,9 @@ loggers = get_loggers()
 def resources(ctx: typer.Context):
     resources = []
 
+    # resolve the account once; ARNs below are built without further STS calls
+    identity = get_identity(ctx)
+
     # EC2 Instances
     ec2_client = get_aws_client(ctx, 'ec2')
     instances = ec2_client.describe_instances()
@@ -21,7 +24,8 @@ def resources(ctx: typer.Context):
                 'Service': 'EC2',
                 'Name': instance.get('InstanceId'),
                 'Region': ec2_client.meta.region_name,
-                'ARN': f"arn:aws:ec2:{ec2_client.meta.region_name}:{ctx.obj['ACCOUNT_ID']}:instance/{instance.get('InstanceId')}"
+                'ARN': build_arn('ec2', 'instance', instance.get('InstanceId'), partition=identity['Partition'],
+                                 region=ec2_client.meta.region_name, account_id=identity['Account'])
             })
 
     # S3 Buckets
@@ -33,7 +37,7 @@ def resources(ctx: typer.Context):
             'Name': bucket['Name'],
             #'Region': 'Global',  # S3 buckets are global, but they are hosted in specific regions
             'Region': buckets.get('LocationConstraint', 'us-east-1'),  # S3 buckets are global, but they are hosted in specific regions
-            'ARN': f"arn:aws:s3:::{bucket['Name']}"
+            'ARN': f"arn:{identity['Partition']}:s3:::{bucket['Name']}"
         })
 
     # IAM Roles
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
+import time
+# process start, used by --profile-cpu/--profile-mem to report time spent on imports
+STARTED = time.perf_counter()
+
 import os
 import sys
 import typer
 import configparser
 from pathlib import Path
 import logging
-from utils.logging import setup_logging
+from utils.logging import setup_logging, AwsResponseLogger
+from utils.logging import DEFAULT_MAX_BYTES, DEFAULT_COMPRESSION, DEFAULT_RETAIN_BYTES, DEFAULT_RETAIN_DAYS
+from utils.stats import ApiStats
+from utils.profiling import CommandProfiler
 from typing import Optional
 from typing import Optional
-from utils.amazon import get_aws_session
+from utils.amazon import get_max_workers, AwsRecorder, AwsReplayer
+from utils.concurrency import AwsRateLimits
 import locale
 
 # subcommands
@@ -23,9 +31,11 @@ from sgstatus import sgstatus
 from status import status
 from updatemyip import updatemyip
 from events import events
+from logs import logs
 
 # newbilling has its own subcommands and is imported as a separate app
 from newbilling import app as newbilling_app
+from tapes import app as tapes_app
 
 #from utils.output_handler import handle_output  # You will create this module and function
 
@@ -57,7 +67,14 @@ def main(
     force: bool = typer.Option(False, "--force", "-f", help="Force update even if not recommended."),
     output_format: str = typer.Option("table", "--output", help="Output format (default: table)."),
     output_file: Optional[str] = typer.Option(None, "--output-file", "-o", help="Output file name (default: STDOUT)."),
-    aws_profile: Optional[str] = typer.Option("default", "--profile", help="AWS CLI profile name (default: default).")
+    aws_profile: Optional[str] = typer.Option("default", "--profile", help="AWS CLI profile name (default: default)."),
+    record_dir: Optional[str] = typer.Option(None, "--record", help="Record every AWS call and response as fixtures in this directory."),
+    replay_dir: Optional[str] = typer.Option(None, "--replay", help="Serve AWS calls from fixtures in this directory instead of AWS."),
+    replay_latency: float = typer.Option(0, "--replay-latency", help="Synthetic latency in milliseconds added to each replayed call."),
+    stats: bool = typer.Option(False, "--stats", help="Report per-operation AWS call counts and latencies when the command finishes."),
+    stats_format: str = typer.Option("table", "--stats-format", help="Stats report format: table (to stderr) or json (to the json log)."),
+    profile_cpu: bool = typer.Option(False, "--profile-cpu", help="Profile the subcommand, including its worker threads, with cProfile and write the report to the log directory."),
+    profile_mem: bool = typer.Option(False, "--profile-mem", help="Trace the subcommand's allocations and write the top sites to the log directory.")
 ):
     ctx.ensure_object(dict)
 
@@ -65,33 +82,82 @@ def main(
     config = read_config(config_file)
     ctx.obj["CONFIG"] = config
 
-    # set up boto3 session
-    ctx.obj["AWS_SESSION"] = get_aws_session(ctx) 
+    # AWS call recording/replay.  These hook the session, so must be set before it is built
+    if record_dir and replay_dir:
+        raise typer.BadParameter("--record and --replay cannot be used together.")
+    ctx.obj["AWS_HOOKS"] = []
+    ctx.obj["AWS_REPLAY"] = None
+    if record_dir:
+        ctx.obj["AWS_HOOKS"].append(AwsRecorder(record_dir))
+    if replay_dir:
+        try:
+            ctx.obj["AWS_REPLAY"] = AwsReplayer(replay_dir, latency_ms=replay_latency)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+        ctx.obj["AWS_HOOKS"].append(ctx.obj["AWS_REPLAY"])
+
+    # raw response capture to the json log.  Also ahead of the replayer, for the same reason
+    if config.getboolean('logging', 'json_responses', fallback=False):
+        ctx.obj["AWS_HOOKS"].insert(0, AwsResponseLogger(
+            sample_rate=config.getfloat('logging', 'json_sample_rate', fallback=1.0),
+            max_bytes=config.getint('logging', 'json_max_bytes', fallback=65536)
+        ))
+
+    # call statistics.  Registered ahead of the replayer, which answers before-call itself
+    ctx.obj["STATS"] = None
+    if stats:
+        if stats_format not in ("table", "json"):
+            raise typer.BadParameter("--stats-format must be table or json.")
+        ctx.obj["STATS"] = ApiStats()
+        ctx.obj["AWS_HOOKS"].insert(0, ctx.obj["STATS"])
+        ctx.call_on_close(lambda: ctx.obj["STATS"].report(stats_format))
+
+    # per-service request rates shared by all threads.  First, so waiting for the limiter is not
+    # counted as call latency, and ahead of the replayer so replays are paced too
+    ctx.obj["AWS_HOOKS"].insert(0, AwsRateLimits.from_config(config))
+
+    # the boto3 session is built by get_aws_session() on first use, so commands that never touch
+    # AWS (logs, seskey, ...) work without a profile
+    ctx.obj["PROFILE"] = aws_profile
+    ctx.obj["MAX_WORKERS"] = get_max_workers(ctx)
 
     # Determine log directory and initialize logging
     log_dir = logdir or config.get('logging', 'logdir', fallback=os.path.join(Path.home(), '.saucelogs'))
-    # Initialize logging
-    setup_logging(log_dir)
+    # Initialize logging.  Setting [logging] debug_level above DEBUG turns debug logging off
+    debug_level = logging.getLevelName(config.get('logging', 'debug_level', fallback='DEBUG').upper())
+    setup_logging(log_dir, debug_level=debug_level if isinstance(debug_level, int) else logging.DEBUG,
+                  max_bytes=config.getint('logging', 'max_bytes', fallback=DEFAULT_MAX_BYTES),
+                  compression=config.get('logging', 'compress', fallback=DEFAULT_COMPRESSION),
+                  retain_bytes=config.getint('logging', 'retain_bytes', fallback=DEFAULT_RETAIN_BYTES),
+                  retain_days=config.getint('logging', 'retain_days', fallback=DEFAULT_RETAIN_DAYS))
 
     # Get the specific logger configured for command line logging
     cmdline_logger = logging.getLogger('cmdline')
 
     # Log the command line arguments using the specific logger
-    cmdline_logger.info('Command Line: ' + ' '.join(sys.argv))
+    command_line = ' '.join(sys.argv)
+    cmdline_logger.info('Command Line: %s', command_line)
 
     mylocale = config.get('general', 'locale', fallback=None)
     if not mylocale:
         mylocale = locale.getdefaultlocale()[0] or 'en_US'
 
     ctx.obj["LOG_DIR"] = log_dir
+    ctx.obj["CACHE_DIR"] = config.get('general', 'cachedir', fallback=os.path.join(log_dir, 'cache'))
     ctx.obj["DRY_RUN"] = dry_run
     ctx.obj["QUIET"] = quiet
     ctx.obj["FORCE"] = force
     ctx.obj["OUTPUT"] = output_format
     ctx.obj["OFILE"] = output_file
-    ctx.obj["PROFILE"] = aws_profile
     ctx.obj["LOCALE"] = mylocale
 
+    # profiling starts last so it covers only the subcommand
+    if profile_cpu or profile_mem:
+        profiler = CommandProfiler(log_dir, ctx.invoked_subcommand, command_line, cpu=profile_cpu, mem=profile_mem,
+                                   startup_seconds=time.perf_counter() - STARTED)
+        ctx.call_on_close(profiler.stop)
+        profiler.start()
+
 app.command()(seskey)
 app.command()(updatemyip)
 app.command()(configure)
@@ -102,9 +168,11 @@ app.command()(resources)
 app.command()(status)
 app.command()(sgstatus)
 app.command()(events)
+app.command()(logs)
 
 # again, newbilling has its own subcommands and is imported as a separate app
 app.add_typer(newbilling_app, name="newbilling")
+app.add_typer(tapes_app, name="tapes")
 
 
 if __name__ == "__main__":
@@ -1,19 +1,234 @@
 #!/usr/bin/env python3
 
+import sys
 import typer
 import json
 import boto3
 from tabulate import tabulate
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
+from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError, BotoCoreError
 from utils.logging import get_loggers
 from utils.amazon import get_aws_session, get_aws_client
+from utils.concurrency import run_concurrently
+from utils.utilities import convert_bytes
+from utils.metrics import get_metric_data, metric_window, sparkline
+from utils.responsecache import get_response_cache
+from datetime import datetime
 from SauceData.handler import SauceData
 
 # Get the loggers
 loggers = get_loggers()
 
-def sgstatus(ctx: typer.Context):
-    loggers['debug'].debug(f"Executing {__name__} subcommand")
+# Detail calls made for each gateway type, on top of describe_gateway_information.  Calls that
+# don't apply to a type fail, so only the ones that do are made.
+GATEWAY_DETAIL_CALLS = {
+    "CACHED": ["describe_cache", "describe_upload_buffer"],
+    "STORED": ["describe_upload_buffer"],
+    "VTL": ["describe_cache", "describe_upload_buffer", "describe_vtl_devices"],
+    "VTL_SNOW": ["describe_cache", "describe_upload_buffer", "describe_vtl_devices"],
+    "FILE_S3": ["describe_cache"],
+    "FILE_FSX_SMB": ["describe_cache"],
+}
+
+# CloudWatch metrics for --metrics: (metric name, statistic)
+GATEWAY_METRICS = [
+    ("CacheHitPercent", "Average"),
+    ("UploadBufferPercentUsed", "Maximum"),
+    ("CloudBytesUploaded", "Sum"),
+    ("CloudBytesDownloaded", "Sum"),
+]
+METRIC_HEADER_LABELS = {
+    "CacheHitPercentAverage": "Hit % avg",
+    "CacheHitTrend": "Hit trend",
+    "UploadBufferPercentMax": "Buffer % max",
+    "UploadBufferTrend": "Buffer trend",
+    "CloudUploadMiBps": "Up MiB/s",
+    "CloudUploadTrend": "Up trend",
+    "CloudDownloadMiBps": "Down MiB/s",
+    "CloudDownloadTrend": "Down trend",
+}
+DEFAULT_METRICS_PERIOD = 300
+DEFAULT_METRICS_CACHE_TTL = 300
+
+def iter_gateways(client):
+    """
+    Yield every gateway from list_gateways, following Marker until all pages are read.
+    """
+    args = {}
+    while True:
+        response = client.list_gateways(**args)
+        yield from response.get('Gateways', [])
+        marker = response.get('Marker')
+        if not marker:
+            break
+        args['Marker'] = marker
+
+def describe_vtl_devices(client, gateway_arn: str) -> dict:
+    """
+    Return describe_vtl_devices for a gateway with the devices of every page.
+    """
+    devices = []
+    args = {'GatewayARN': gateway_arn}
+    while True:
+        response = client.describe_vtl_devices(**args)
+        devices += response.get('VTLDevices', [])
+        marker = response.get('Marker')
+        if not marker:
+            break
+        args['Marker'] = marker
+    return {'GatewayARN': gateway_arn, 'VTLDevices': devices}
+
+def describe_gateway_detail(client, call: tuple) -> dict:
+    """
+    Make one detail call, given as (gateway ARN, operation name).
+    """
+    gateway_arn, operation = call
+    if operation == "describe_vtl_devices":
+        return describe_vtl_devices(client, gateway_arn)
+    return getattr(client, operation)(GatewayARN=gateway_arn)
+
+def percentage(value) -> str:
+    return None if value is None else format(value, ".1f")
+
+def gigabytes(value) -> str:
+    return None if value is None else format(convert_bytes(value, "GiB"), ".1f")
+
+def gateway_detail_fields(operation: str, response: dict) -> dict:
+    """
+    Return the row fields taken from one detail call's response.
+    """
+    if operation == "describe_gateway_information":
+        return {
+            'GatewayState': response.get('GatewayState'),
+            'GatewayNetworkInterfaces': ", ".join(interface['Ipv4Address'] for interface in response.get('GatewayNetworkInterfaces', [])
+                                                  if interface.get('Ipv4Address')),
+            'EndpointType': response.get('EndpointType'),
+        }
+    if operation == "describe_cache":
+        return {
+            'CacheAllocatedInBytes': gigabytes(response.get('CacheAllocatedInBytes')),
+            'CacheUsedPercentage': percentage(response.get('CacheUsedPercentage')),
+            'CacheDirtyPercentage': percentage(response.get('CacheDirtyPercentage')),
+            'CacheHitPercentage': percentage(response.get('CacheHitPercentage')),
+        }
+    if operation == "describe_upload_buffer":
+        allocated = response.get('UploadBufferAllocatedInBytes')
+        used = response.get('UploadBufferUsedInBytes')
+        return {
+            'UploadBufferAllocatedInBytes': gigabytes(allocated),
+            'UploadBufferUsedPercentage': percentage(100 * used / allocated) if allocated and used is not None else None,
+        }
+    if operation == "describe_vtl_devices":
+        return {'VTLDevices': len(response['VTLDevices'])}
+    return {}
+
+def describe_gateways(ctx: typer.Context, client, gateways: list, rows: dict) -> dict:
+    """
+    Make every gateway's detail calls concurrently, one pool item per call, and merge the results
+    into rows ({gateway ARN: row}).
+
+    A failed call only leaves its own fields empty, so one stopped gateway doesn't blank the others.
+
+    Returns:
+    dict: {gateway ARN: [(operation, error), ...]} for the calls that failed.
+    """
+    calls = [(gateway['GatewayARN'], operation) for gateway in gateways
+             for operation in ["describe_gateway_information"] + GATEWAY_DETAIL_CALLS.get(gateway.get('GatewayType'), [])]
+    loggers['debug'].debug("Describing %d gateways with %d calls", len(gateways), len(calls))
+
+    failures = {}
+    for (gateway_arn, operation), response, error in run_concurrently(ctx, lambda call: describe_gateway_detail(client, call), calls):
+        if error is not None:
+            # stopped or disconnected gateways fail their detail calls; report them per gateway
+            if not isinstance(error, (ClientError, BotoCoreError)):
+                raise error
+            failures.setdefault(gateway_arn, []).append((operation, error))
+            continue
+        rows[gateway_arn].update(gateway_detail_fields(operation, response))
+    return failures
+
+def gateway_metric_queries(gateways: list, period: int) -> list:
+    """
+    Return a GetMetricData query for every gateway and GATEWAY_METRICS entry, with Ids g<gateway>m<metric>.
+    """
+    return [{
+        'Id': f"g{gateway_index}m{metric_index}",
+        'MetricStat': {
+            'Metric': {
+                'Namespace': 'AWS/StorageGateway',
+                'MetricName': metric,
+                'Dimensions': [{'Name': 'GatewayId', 'Value': gateway['GatewayId']},
+                               {'Name': 'GatewayName', 'Value': gateway['GatewayName']}]
+            },
+            'Period': period,
+            'Stat': statistic
+        },
+        'ReturnData': True
+    } for gateway_index, gateway in enumerate(gateways) for metric_index, (metric, statistic) in enumerate(GATEWAY_METRICS)]
+
+def gateway_metric_fields(points: list, start: datetime, end: datetime) -> dict:
+    """
+    Summarise one gateway's metrics, given its (timestamp, value) points in GATEWAY_METRICS order.
+    """
+    hit, buffer, uploaded, downloaded = points
+    seconds = (end - start).total_seconds()
+    mebibytes_per_second = lambda values: format(convert_bytes(sum(value for _, value in values) / seconds, "MiB"), ".2f")
+    return {
+        'CacheHitPercentAverage': percentage(sum(value for _, value in hit) / len(hit)) if hit else None,
+        'CacheHitTrend': sparkline(hit, start, end, low=0, high=100),
+        'UploadBufferPercentMax': percentage(max(value for _, value in buffer)) if buffer else None,
+        'UploadBufferTrend': sparkline(buffer, start, end, low=0, high=100),
+        'CloudUploadMiBps': mebibytes_per_second(uploaded),
+        'CloudUploadTrend': sparkline(uploaded, start, end, low=0),
+        'CloudDownloadMiBps': mebibytes_per_second(downloaded),
+        'CloudDownloadTrend': sparkline(downloaded, start, end, low=0),
+    }
+
+def get_gateway_metrics(ctx: typer.Context, gateways: list, hours: int) -> dict:
+    """
+    Fetch GATEWAY_METRICS for the last hours for every gateway, in as few GetMetricData calls as
+    possible, and return {gateway ARN: row fields}.
+
+    Results are kept in the response cache for [sgstatus] metrics_cache_ttl seconds.
+    """
+    config = ctx.obj.get("CONFIG")
+    period = config.getint('sgstatus', 'metrics_period', fallback=DEFAULT_METRICS_PERIOD) if config else DEFAULT_METRICS_PERIOD
+    ttl = config.getint('sgstatus', 'metrics_cache_ttl', fallback=DEFAULT_METRICS_CACHE_TTL) if config else DEFAULT_METRICS_CACHE_TTL
+
+    start, end = metric_window(hours, period)
+    queries = gateway_metric_queries(gateways, period)
+    client = get_aws_client(ctx, 'cloudwatch')
+    params = {'region': client.meta.region_name, 'queries': queries, 'start': start, 'end': end}
+
+    cache = get_response_cache(ctx)
+    try:
+        cached = cache.get('cloudwatch-metrics', params) if cache else None
+        if cached is None:
+            results = get_metric_data(client, queries, start, end)
+            loggers['debug'].debug("Fetched %d gateway metrics", len(queries))
+            if cache:
+                cache.put('cloudwatch-metrics', params,
+                          {query_id: [(timestamp.isoformat(), value) for timestamp, value in points]
+                           for query_id, points in results.items()}, ttl)
+        else:
+            results = {query_id: [(datetime.fromisoformat(timestamp), value) for timestamp, value in points]
+                       for query_id, points in cached.items()}
+    finally:
+        if cache:
+            cache.close()
+
+    return {gateway['GatewayARN']: gateway_metric_fields(
+                [results[f"g{gateway_index}m{metric_index}"] for metric_index in range(len(GATEWAY_METRICS))], start, end)
+            for gateway_index, gateway in enumerate(gateways)}
+
+def sgstatus(
+        ctx: typer.Context,
+        metrics: bool = typer.Option(False, "--metrics", help="Add cache hit rate, upload buffer and throughput from CloudWatch"),
+        metrics_hours: int = typer.Option(3, "--metrics-hours", help="Hours of CloudWatch metrics to summarise"),
+    ):
+    """
+    Show the status of the region's storage gateways.
+    """
+    loggers['debug'].debug("Executing %s subcommand", __name__)
 
     # Create a SauceData object
     gwdata = SauceData()
@@ -27,13 +242,7 @@ def sgstatus(ctx: typer.Context):
         sgclient = get_aws_client(ctx, 'storagegateway')
 
         # Get a list of all storage gateways
-        response = sgclient.list_gateways()
-
-        # pretty print the response
-        # print(json.dumps(response, indent=2))
-        
-        # Extract the list of storage gateways
-        gateways = response['Gateways']
+        gateways = list(iter_gateways(sgclient))
         gwdata.headerlabels = {
             "GatewayId": "ID",
             "GatewayARN": None,
@@ -42,32 +251,37 @@ def sgstatus(ctx: typer.Context):
             "GatewayName": "Name",
             "HostEnvironment": "Environment",
             "SoftwareVersion": "Version",
+            "GatewayState": "State",
+            "GatewayNetworkInterfaces": "Network",
+            "EndpointType": "Endpoint",
+            "CacheAllocatedInBytes": "Cache GiB",
+            "CacheUsedPercentage": "Cache %",
+            "CacheDirtyPercentage": "Dirty %",
+            "CacheHitPercentage": "Hit %",
+            "UploadBufferAllocatedInBytes": "Buffer GiB",
+            "UploadBufferUsedPercentage": "Buffer %",
+            "VTLDevices": "Devices",
         }
+        if metrics:
+            gwdata.headerlabels.update(METRIC_HEADER_LABELS)
+
+        # every row gets every column, so the table keeps its layout when some calls fail
+        rows = {gateway['GatewayARN']: {**dict.fromkeys(gwdata.headerlabels), **gateway} for gateway in gateways}
+
+        failures = describe_gateways(ctx, sgclient, gateways, rows)
+        for gateway_arn, errors in failures.items():
+            operations = ", ".join(operation for operation, _ in errors)
+            print(f"Failed to get {operations} for {gateway_arn.split('/')[-1]}: {errors[0][1]}", file=sys.stderr)
+
+        if metrics and gateways:
+            try:
+                for gateway_arn, fields in get_gateway_metrics(ctx, gateways, metrics_hours).items():
+                    rows[gateway_arn].update(fields)
+            except (ClientError, BotoCoreError) as e:
+                print(f"Failed to get gateway metrics: {e}", file=sys.stderr)
 
-        # Iterate over each storage gateway
         for gateway in gateways:
-            # Get the gateway ARN
-            gateway_arn = gateway['GatewayARN']
-
-            # Describe the gateway information
-            gateway_info = sgclient.describe_gateway_information(GatewayARN=gateway_arn)
-
-            # print(json.dumps(gateway_info, indent=2))
-
-            # Extract the required data from gateway and gateway_info
-            #data = {
-            gwdata.append(gateway)
-            """
-            gwdata.append({
-                'Id': gateway['GatewayId'],
-                'Name': gateway['GatewayName'],
-                'OpState': gateway['GatewayOperationalState'],
-                'State': gateway_info['GatewayState'],
-                'Network': ', '.join([interface['Ipv4Address'] for interface in gateway_info['GatewayNetworkInterfaces']]),  # Fix: Corrected syntax error and joined the IP addresses
-                'Type': gateway_info['GatewayType'],
-                'Endpoint Type': gateway_info['EndpointType']
-            })
-            """
+            gwdata.append(rows[gateway['GatewayARN']])
 
     except NoCredentialsError:
         typer.echo("No AWS credentials found. Please configure them properly.")
@@ -76,9 +290,6 @@ def sgstatus(ctx: typer.Context):
     except ClientError as e:
         typer.echo(f"AWS Connection Error: {e}")
 
-    #headers_dict = dict(zip(headers, headers))
-    #print(tabulate(gwdata, headers_dict, tablefmt="presto"))
-    #print (json.dumps(gwdata.headers, indent=2  ))
     print(gwdata)
 
 if __name__ == "__main__":
@@ -5,20 +5,20 @@ import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
 from utils.logging import get_loggers
 from utils.network import get_public_ip
+from utils.amazon import get_aws_client, get_identity
 
 # Get the loggers
 loggers = get_loggers()
 
 def status(ctx: typer.Context):
-    loggers['debug'].debug(f"Executing {__name__} subcommand")
+    loggers['debug'].debug("Executing %s subcommand", __name__)
 
     try:
         # Initialize boto3 clients
-        sts_client = boto3.client('sts')
-        cw_client = boto3.client('cloudwatch')  # CloudWatch client for alarms
+        cw_client = get_aws_client(ctx, 'cloudwatch')  # CloudWatch client for alarms
 
         # Get caller identity to verify AWS credentials
-        identity = sts_client.get_caller_identity()
+        identity = get_identity(ctx)
 
         # Get CloudWatch alarms status
         alarms_response = cw_client.describe_alarms()
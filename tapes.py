@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+
+# tapes.py
+# Tape inventory commands.  The inventory is a local SQLite index of the VTL, see utils/tapestore.py.
+
+import re
+import sys
+import time
+import typer
+from botocore.exceptions import ClientError, BotoCoreError
+
+from typing import List, Optional
+
+from utils.logging import get_loggers
+from utils.amazon import get_aws_client, get_identity, build_arn
+from utils.concurrency import run_concurrently
+from utils.tapestore import get_tape_store, to_iso
+from utils.utilities import convert_bytes
+from listvtltapes import iter_tape_infos, tape_batches, describe_tape_batch, describe_batch_size
+from SauceData.handler import SauceData
+
+app = typer.Typer(help="VTL tape inventory commands.")
+
+# Get the loggers
+loggers = get_loggers()
+
+# tapes report --by fields and the tape row keys they group on
+REPORT_FIELDS = {
+    "pool": "PoolId",
+    "gateway": "GatewayARN",
+    "status": "TapeStatus",
+}
+
+# tapes retrieve polls every pending tape once per round, waiting longer after each round
+RETRIEVE_POLL_INITIAL_DELAY = 15
+RETRIEVE_POLL_MAX_DELAY = 600
+RETRIEVE_DONE_STATUSES = {"RETRIEVED"}
+RETRIEVE_FAILED_STATUSES = {"IRRECOVERABLE"}
+RETRIEVE_ACTIVE_STATUSES = {"RETRIEVING"}
+# give up on a tape after this many rounds without headway, and on all of them after the timeout
+RETRIEVE_POLL_MAX_STALLED_ROUNDS = 5
+RETRIEVE_POLL_TIMEOUT = 24 * 3600
+
+class TapeUtilization:
+    """
+    Running totals of tape count, empty tapes, size and use per group of tapes.
+
+    Memory grows with the number of groups, not tapes, so rows can be streamed through add() and
+    partial totals from concurrent workers combined with merge().
+    """
+    def __init__(self, by: list):
+        self.by = by
+        self.groups = {}
+
+    def group_key(self, row: dict) -> tuple:
+        key = []
+        for field in self.by:
+            value = row[REPORT_FIELDS[field]]
+            if field == "gateway":
+                value = value.split('/')[-1] if value else "(archive)"
+            key.append(value or "")
+        return tuple(key)
+
+    def add(self, row: dict):
+        totals = self.groups.setdefault(self.group_key(row), [0, 0, 0, 0])
+        used = row['TapeUsedInBytes'] or 0
+        totals[0] += 1
+        totals[1] += used == 0
+        totals[2] += row['TapeSizeInBytes'] or 0
+        totals[3] += used
+
+    def merge(self, other: "TapeUtilization"):
+        for key, other_totals in other.groups.items():
+            totals = self.groups.setdefault(key, [0, 0, 0, 0])
+            for index, value in enumerate(other_totals):
+                totals[index] += value
+
+    def report(self, units: str = "TiB") -> SauceData:
+        """
+        Return one row per group, sorted, plus a total row when there is more than one group.
+        """
+        rows = [(dict(zip(self.by, key)), totals) for key, totals in sorted(self.groups.items())]
+        if len(rows) > 1:
+            rows.append(({field: "Total" if index == 0 else "" for index, field in enumerate(self.by)},
+                         [sum(totals[index] for totals in self.groups.values()) for index in range(4)]))
+
+        data = SauceData(data=[])
+        for labels, (count, empty, size, used) in rows:
+            data.append({
+                **labels,
+                'Tapes': count,
+                'Empty': empty,
+                'Size': format(convert_bytes(size, units), ".1f"),
+                'Used': format(convert_bytes(used, units), ".1f"),
+                'Utilization': format(100 * used / size, ".1f") if size else "",
+                'Unused': format(convert_bytes(size - used, units), ".1f"),
+            })
+        data.headerlabels = {**{field: field.capitalize() for field in self.by}, 'Tapes': "Tapes", 'Empty': "Empty",
+                             'Size': f"Size {units}", 'Used': f"Used {units}", 'Utilization': "Used %",
+                             'Unused': f"Unused {units}"}
+        return data
+
+def summarize_tape_batch(client, batch: tuple, by: list) -> TapeUtilization:
+    """
+    Describe one batch from tape_batches() and return its totals, so only totals are kept per batch.
+    """
+    totals = TapeUtilization(by)
+    for row in describe_tape_batch(client, batch):
+        totals.add(row)
+    return totals
+
+def sync_tapes(ctx: typer.Context, store, full: bool = False) -> dict:
+    """
+    Bring the tape inventory up to date with the region's VTL.
+
+    list_tapes is cheap and returns each tape's status, pool entry date and gateway.  Only tapes
+    where one of those differs from the inventory are described again; tapes no longer listed
+    are removed.
+
+    Parameters:
+    store (TapeStore): The open tape inventory.
+    full (bool): Describe every tape, not only changed ones.
+
+    Returns:
+    dict: Counts of new, changed, removed, unchanged and failed tapes.
+    """
+    client = get_aws_client(ctx, 'storagegateway')
+    region = client.meta.region_name
+    known = store.states()
+
+    counts = {'new': 0, 'changed': 0, 'removed': 0, 'unchanged': 0, 'failed': 0}
+    listed = set()
+    stale = []
+    for tape_info in iter_tape_infos(client):
+        arn = tape_info['TapeARN']
+        listed.add(arn)
+        state = (tape_info.get('TapeStatus'), to_iso(tape_info.get('PoolEntryDate')), tape_info.get('GatewayARN'))
+        if arn not in known:
+            counts['new'] += 1
+            stale.append(tape_info)
+        elif full or known[arn] != state:
+            counts['changed'] += 1
+            stale.append(tape_info)
+        else:
+            counts['unchanged'] += 1
+
+    # the inventory can hold several regions; only this region's tapes can have disappeared
+    removed = [arn for arn in known if arn.split(':')[3] == region and arn not in listed]
+    store.delete(removed)
+    counts['removed'] = len(removed)
+
+    batches = tape_batches(stale, batch_size=describe_batch_size(ctx))
+    loggers['debug'].debug("Tape sync: describing %d tapes in %d batches", len(stale), len(batches))
+    for (gateway_arn, tape_arns), rows, error in run_concurrently(ctx, lambda batch: describe_tape_batch(client, batch), batches):
+        if error is not None:
+            if not isinstance(error, ClientError):
+                raise error
+            print(f"Failed to describe {len(tape_arns)} tapes starting {tape_arns[0]}: {error}", file=sys.stderr)
+            counts['failed'] += len(tape_arns)
+            continue
+        # written as each batch arrives, so an interrupted sync keeps its progress
+        store.upsert(rows)
+
+    return counts
+
+def archived_tapes(ctx: typer.Context, client, barcodes: list = None, where: str = None) -> list:
+    """
+    Return tape rows for the archived tapes to retrieve.
+
+    With where, tapes come from the inventory.  Otherwise barcodes are looked up in the live
+    listing and described as list_tapes() would, so each row has its size and use.
+    """
+    if where:
+        store = get_tape_store(ctx)
+        try:
+            rows = list(store.query(where))
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+        finally:
+            store.close()
+    else:
+        wanted = set(barcodes)
+        infos = [tape_info for tape_info in iter_tape_infos(client) if tape_info['TapeBarcode'] in wanted]
+        missing = wanted - {tape_info['TapeBarcode'] for tape_info in infos}
+        if missing:
+            print(f"Tapes not found: {', '.join(sorted(missing))}", file=sys.stderr)
+
+        rows = []
+        for (gateway_arn, tape_arns), batch_rows, error in run_concurrently(ctx, lambda batch: describe_tape_batch(client, batch),
+                                                                            tape_batches(infos, batch_size=describe_batch_size(ctx))):
+            if error is not None:
+                if not isinstance(error, ClientError):
+                    raise error
+                print(f"Failed to describe {len(tape_arns)} tapes starting {tape_arns[0]}: {error}", file=sys.stderr)
+                continue
+            rows += batch_rows
+
+    skipped = sorted(row['TapeBarcode'] for row in rows if row['TapeStatus'] != "ARCHIVED")
+    if skipped:
+        print(f"Skipping tapes that are not archived: {', '.join(skipped)}", file=sys.stderr)
+    return sorted((row for row in rows if row['TapeStatus'] == "ARCHIVED"), key=lambda row: row['TapeBarcode'])
+
+def describe_retrievals(client, gateway_arn: str, tape_arns: list) -> dict:
+    """
+    Return {tape ARN: (status, progress %)} for tapes being retrieved to a gateway.
+
+    Tapes the gateway doesn't list yet are left out.
+    """
+    states = {}
+    args = {'GatewayARN': gateway_arn, 'TapeARNs': tape_arns}
+    while True:
+        response = client.describe_tapes(**args)
+        for tape in response.get('Tapes', []):
+            states[tape['TapeARN']] = (tape['TapeStatus'], tape.get('Progress'))
+        marker = response.get('Marker')
+        if not marker:
+            return states
+        args['Marker'] = marker
+
+def format_duration(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    return f"{minutes // 60}h{minutes % 60:02d}m"
+
+def poll_retrievals(ctx: typer.Context, client, gateway_arn: str, tapes: list, sleep=time.sleep, clock=time.monotonic,
+                    initial_delay: float = RETRIEVE_POLL_INITIAL_DELAY, max_delay: float = RETRIEVE_POLL_MAX_DELAY,
+                    timeout: float = RETRIEVE_POLL_TIMEOUT, max_stalled_rounds: int = RETRIEVE_POLL_MAX_STALLED_ROUNDS) -> dict:
+    """
+    Wait for retrievals to finish, polling every pending tape in one loop.
+
+    Each round describes the pending tapes in concurrent batches, reports progress, throughput
+    and ETA, then waits; the wait doubles after every round up to max_delay.
+
+    A tape fails once it has gone max_stalled_rounds rounds in a row without being listed by the
+    gateway, without its describe call succeeding, or stuck in a status that isn't a retrieval in
+    progress (e.g. still ARCHIVED).  Tapes still pending after timeout seconds fail as TIMED_OUT.
+
+    Parameters:
+    gateway_arn (str): The gateway the tapes are retrieved to.
+    tapes (list): Tape rows with TapeARN, TapeBarcode and TapeUsedInBytes.
+    sleep, clock: time.sleep and time.monotonic, replaceable for testing.
+
+    Returns:
+    dict: {tape ARN: final status} for every tape.  Anything outside RETRIEVE_DONE_STATUSES failed.
+    """
+    quiet = ctx.obj.get('QUIET')
+    sizes = {tape['TapeARN']: tape['TapeUsedInBytes'] or 0 for tape in tapes}
+    barcodes = {tape['TapeARN']: tape['TapeBarcode'] for tape in tapes}
+    pending = set(sizes)
+    finished = {}
+    # consecutive rounds each pending tape has made no headway, and what it looked like last round
+    stalled = dict.fromkeys(sizes, 0)
+    last_seen = {}
+    started = clock()
+    delay = initial_delay
+
+    def fail(tape_arn, status, reason):
+        finished[tape_arn] = status
+        pending.discard(tape_arn)
+        print(f"Tape {barcodes[tape_arn]} could not be retrieved: {reason}", file=sys.stderr)
+
+    while pending:
+        sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+        batch_size = describe_batch_size(ctx)
+        ordered = sorted(pending)
+        batches = [ordered[index:index + batch_size] for index in range(0, len(ordered), batch_size)]
+        seen = {}
+        progress = {}
+        for tape_arns, states, error in run_concurrently(ctx, lambda batch: describe_retrievals(client, gateway_arn, batch), batches):
+            if error is not None:
+                if not isinstance(error, (ClientError, BotoCoreError)):
+                    raise error
+                # try again next round; these tapes count as stalled until a check succeeds
+                print(f"Failed to check {len(tape_arns)} tapes: {error}", file=sys.stderr)
+                continue
+            seen.update(states)
+
+        for tape_arn in sorted(pending):
+            state = seen.get(tape_arn)
+            status, percent = state if state else (None, None)
+            if status in RETRIEVE_DONE_STATUSES:
+                finished[tape_arn] = status
+                pending.discard(tape_arn)
+                continue
+            if status in RETRIEVE_FAILED_STATUSES:
+                fail(tape_arn, status, status)
+                continue
+            if percent is not None:
+                progress[tape_arn] = percent
+
+            # a retrieval in progress may sit at the same percentage for hours; only the timeout ends it
+            if status in RETRIEVE_ACTIVE_STATUSES or (state is not None and state != last_seen.get(tape_arn)):
+                stalled[tape_arn] = 0
+            else:
+                stalled[tape_arn] += 1
+            last_seen[tape_arn] = state
+            if stalled[tape_arn] >= max_stalled_rounds:
+                reason = (f"still {status} after {max_stalled_rounds} checks" if status
+                          else f"not found on the gateway or not checked in {max_stalled_rounds} rounds")
+                fail(tape_arn, status or "NOT_FOUND", reason)
+
+        if pending and clock() - started >= timeout:
+            for tape_arn in sorted(pending):
+                fail(tape_arn, "TIMED_OUT", f"still pending after {format_duration(timeout)}")
+
+        retrieved = {tape_arn for tape_arn, status in finished.items() if status in RETRIEVE_DONE_STATUSES}
+        failed = len(finished) - len(retrieved)
+        total_bytes = sum(size for tape_arn, size in sizes.items() if tape_arn in pending or tape_arn in retrieved)
+        done_bytes = sum(sizes[tape_arn] for tape_arn in retrieved)
+        done_bytes += sum(sizes[tape_arn] * percent / 100 for tape_arn, percent in progress.items() if tape_arn in pending)
+        elapsed = clock() - started
+        rate = done_bytes / elapsed if elapsed > 0 else 0
+        eta = format_duration((total_bytes - done_bytes) / rate) if rate > 0 else "unknown"
+        if not quiet:
+            typer.echo(f"{len(retrieved)}/{len(sizes) - failed} tapes retrieved{f' ({failed} failed)' if failed else ''}, "
+                       f"{convert_bytes(done_bytes, 'GiB'):.1f} of {convert_bytes(total_bytes, 'GiB'):.1f} GiB, "
+                       f"{convert_bytes(rate * 3600, 'GiB'):.1f} GiB/h, ETA {eta if pending else 'done'}")
+
+    return finished
+
+def resolve_gateway_arn(ctx: typer.Context, client, gateway: str) -> str:
+    """
+    Return the ARN of a gateway given as an ARN or a gateway ID in the client's region.
+    """
+    if gateway.startswith("arn:"):
+        return gateway
+    if not re.match("^sgw-[A-F0-9]{8,}$", gateway):
+        raise typer.BadParameter("Gateway ARN or ID is not valid.")
+    identity = get_identity(ctx)
+    return build_arn("storagegateway", "gateway", gateway, partition=identity["Partition"],
+                     region=client.meta.region_name, account_id=identity["Account"])
+
+@app.command()
+def sync(ctx: typer.Context,
+         full: bool = typer.Option(False, "--full", help="Describe every tape again, not only changed ones.")):
+    """
+    Update the local tape inventory, describing only tapes that changed since the last sync.
+    """
+    loggers['debug'].debug("Executing tapes sync subcommand")
+
+    store = get_tape_store(ctx)
+    try:
+        counts = sync_tapes(ctx, store, full)
+        total = store.count()
+    finally:
+        store.close()
+
+    if not ctx.obj['QUIET']:
+        typer.echo(f"{total} tapes in inventory: {counts['new']} new, {counts['changed']} changed, "
+                   f"{counts['removed']} removed, {counts['unchanged']} unchanged")
+    if counts['failed']:
+        typer.echo(f"{counts['failed']} tapes could not be described; run sync again to retry.", err=True)
+        raise typer.Exit(code=1)
+
+@app.command()
+def retrieve(ctx: typer.Context,
+             barcodes: List[str] = typer.Argument(None, help="Barcodes of archived tapes to retrieve."),
+             gateway: Optional[str] = typer.Option(None, "--gateway", help="Gateway ARN or ID to retrieve to (default: default_gateway_arn in the mktapes config section)."),
+             where: Optional[str] = typer.Option(None, "--where", help="Retrieve archived inventory tapes matching, e.g. 'barcode~SYN01*'."),
+             wait: bool = typer.Option(True, "--wait/--no-wait", help="Wait for the retrievals to finish, reporting progress."),
+             timeout: float = typer.Option(RETRIEVE_POLL_TIMEOUT / 3600, "--timeout", help="Hours to wait before giving up on tapes still being retrieved.")):
+    """
+    Retrieve archived tapes to a gateway, concurrently, and wait for them to be available.
+    """
+    loggers['debug'].debug("Executing tapes retrieve subcommand")
+
+    if not barcodes and not where:
+        raise typer.BadParameter("Give barcodes or --where.")
+    config = ctx.obj.get('CONFIG')
+    gateway = gateway or (config.get('mktapes', 'default_gateway_arn', fallback=None) if config else None)
+    if not gateway:
+        raise typer.BadParameter("Gateway ARN or ID is required.")
+
+    client = get_aws_client(ctx, 'storagegateway')
+    gateway_arn = resolve_gateway_arn(ctx, client, gateway)
+    tapes = archived_tapes(ctx, client, barcodes, where)
+    if not tapes:
+        typer.echo("No archived tapes to retrieve.", err=True)
+        raise typer.Exit(code=1)
+
+    if ctx.obj.get('DRY_RUN'):
+        for tape in tapes:
+            typer.echo(f"Tape to be retrieved: Barcode: {tape['TapeBarcode']}, Gateway: {gateway_arn.split('/')[-1]}")
+        return
+
+    # the storagegateway rate limit paces these however many workers there are
+    started = []
+    retrieve_tape = lambda tape: client.retrieve_tape_archive(TapeARN=tape['TapeARN'], GatewayARN=gateway_arn)
+    for tape, _, error in run_concurrently(ctx, retrieve_tape, tapes):
+        if error is not None:
+            if not isinstance(error, (ClientError, BotoCoreError)):
+                raise error
+            print(f"Failed to retrieve tape {tape['TapeBarcode']}: {error}", file=sys.stderr)
+            continue
+        started.append(tape)
+
+    if not ctx.obj.get('QUIET'):
+        typer.echo(f"Retrieving {len(started)} of {len(tapes)} tapes to {gateway_arn.split('/')[-1]}")
+    if started and wait:
+        finished = poll_retrievals(ctx, client, gateway_arn, started, timeout=timeout * 3600)
+        if any(status not in RETRIEVE_DONE_STATUSES for status in finished.values()):
+            raise typer.Exit(code=1)
+    if len(started) < len(tapes):
+        raise typer.Exit(code=1)
+
+@app.command()
+def report(ctx: typer.Context,
+           by: str = typer.Option("pool,status", "--by", help=f"Comma-separated fields to group by: {', '.join(REPORT_FIELDS)}."),
+           units: str = typer.Option("TiB", "--units", help="Units for sizes, e.g. GiB, TiB."),
+           cached: bool = typer.Option(False, "--cached", help="Report on the local inventory (see 'sauce tapes sync') instead of AWS."),
+           where: Optional[str] = typer.Option(None, "--where", help="Only count inventory tapes matching, e.g. 'pool=GLACIER'. Implies --cached.")):
+    """
+    Report tape capacity and utilization by pool, gateway and status.
+
+    Tapes are counted as they are described, or read from the inventory, in a single pass; only
+    the totals per group are kept.
+    """
+    loggers['debug'].debug("Executing tapes report subcommand")
+
+    fields = [field.strip().lower() for field in by.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in REPORT_FIELDS]
+    if unknown or not fields:
+        raise typer.BadParameter(f"Unknown --by field(s): {', '.join(unknown)}. Use {', '.join(REPORT_FIELDS)}.")
+    try:
+        convert_bytes(0, units)
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+
+    totals = TapeUtilization(fields)
+    failed = 0
+    if cached or where:
+        store = get_tape_store(ctx)
+        try:
+            for row in store.query(where):
+                totals.add(row)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+        finally:
+            store.close()
+    else:
+        client = get_aws_client(ctx, 'storagegateway')
+        batches = tape_batches(iter_tape_infos(client), batch_size=describe_batch_size(ctx))
+        for (gateway_arn, tape_arns), batch_totals, error in run_concurrently(ctx, lambda batch: summarize_tape_batch(client, batch, fields), batches):
+            if error is not None:
+                if not isinstance(error, ClientError):
+                    raise error
+                print(f"Failed to describe {len(tape_arns)} tapes starting {tape_arns[0]}: {error}", file=sys.stderr)
+                failed += len(tape_arns)
+                continue
+            totals.merge(batch_totals)
+
+    data = totals.report(units)
+    if ctx.obj.get("OUTPUT"):
+        data.output_format = ctx.obj["OUTPUT"]
+    typer.echo(data)
+    if failed:
+        typer.echo(f"{failed} tapes could not be described and are not counted.", err=True)
+        raise typer.Exit(code=1)
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import unittest
+from datetime import datetime
+
+from billing import CostAggregator
+
+def ce_day(day, groups):
+    """
+    Build one Cost Explorer ResultsByTime entry from {service: amount}.
+    """
+    return {
+        'TimePeriod': {'Start': day, 'End': day},
+        'Groups': [{'Keys': [key], 'Metrics': {'UnblendedCost': {'Amount': str(amount), 'Unit': 'USD'}}}
+                   for key, amount in groups.items()]
+    }
+
+RESULTS = [
+    ce_day("2024-03-01", {"EC2": 2.0, "S3": 0.5, "Tax": 0.25}),
+    ce_day("2024-03-02", {"EC2": 3.0, "Credits": -1.0}),
+    # Cost Explorer split this day's groups across two pages
+    ce_day("2024-03-02", {"S3": 0.5}),
+    # after now, so left out of the per-day views
+    ce_day("2024-03-03", {"EC2": 4.0}),
+]
+
+class TestCostAggregator(unittest.TestCase):
+    def setUp(self):
+        self.costs = CostAggregator(datetime(2024, 3, 2, 12, 0)).update(iter(RESULTS))
+
+    def test_detail(self):
+        data, headers = self.costs.detail()
+        self.assertEqual(headers, ['Service', 'Cost'])
+        # credits are left out, cheapest first
+        self.assertEqual(data, [['Tax', '$ 0.25'], ['S3', '$ 1.00'], ['EC2', '$ 9.00'], ['Total', '$10.25']])
+
+    def test_daily(self):
+        data, headers = self.costs.daily()
+        self.assertEqual(headers, ['Date', 'Mar-01', 'Mar-02'])
+        self.assertEqual(data, [['Total', '$2.75', '$2.50']])
+
+    def test_table(self):
+        data, headers = self.costs.table()
+        self.assertEqual(headers, ['Service', 'Total', 'Mar-01', 'Mar-02'])
+        # cheapest first, but Tax always just above the Total row
+        self.assertEqual(data, [
+            ['Credits', '$-1.00', '$0.00', '$-1.00'],
+            ['S3', '$1.00', '$0.50', '$0.50'],
+            ['EC2', '$9.00', '$2.00', '$3.00'],
+            ['Tax', '$0.25', '$0.25', '$0.00'],
+            ['Total', '$5.25', '$2.75', '$2.50'],
+        ])
+
+    def test_summary(self):
+        # the month total includes every day fetched
+        self.assertEqual(self.costs.summary(), ([['Current Month', '$9.25']], ['Period', 'Cost']))
+
+if __name__ == "__main__":
+    unittest.main()
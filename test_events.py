@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+import typer
+from typer.testing import CliRunner
+
+from events import iter_event_rows, events
+
+START = datetime(2024, 3, 1)
+END = datetime(2024, 3, 2)
+
+def event(number, name="PutObject", user="alice", service=False, detail=None):
+    identity = {'type': 'AWSService' if service else 'IAMUser'}
+    return {
+        'EventId': f"event-{number}",
+        'EventName': name,
+        'Username': user,
+        'EventTime': datetime(2024, 3, 1, 12, 0, number),
+        'EventSource': "s3.amazonaws.com",
+        'CloudTrailEvent': detail if detail is not None else json.dumps({'userIdentity': identity, 'awsRegion': 'us-east-1'}),
+    }
+
+class FakeCloudTrail:
+    """
+    lookup_events serving fixed pages, recording the arguments of each call.
+    """
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def lookup_events(self, **args):
+        self.calls.append(args)
+        page = int(args.get('NextToken', 0))
+        if isinstance(self.pages[page], Exception):
+            raise self.pages[page]
+        response = {'Events': self.pages[page]}
+        if page + 1 < len(self.pages):
+            response['NextToken'] = str(page + 1)
+        return response
+
+class TestEventRows(unittest.TestCase):
+    def test_first_filter_is_pushed_down_and_the_rest_checked_locally(self):
+        client = FakeCloudTrail([[event(1), event(2, name="GetObject"), event(3, user="bob")], [event(4)]])
+        filters = {"resource": None, "user": "alice", "event_name": "PutObject", "event_source": None}
+
+        rows = list(iter_event_rows(client, START, END, filters, ['EventId']))
+
+        self.assertEqual(client.calls[0]['LookupAttributes'], [{'AttributeKey': 'Username', 'AttributeValue': 'alice'}])
+        # CloudTrail filtered on the user already, so only the event name is checked here
+        self.assertEqual(rows, [{'EventId': "event-1"}, {'EventId': "event-3"}, {'EventId': "event-4"}])
+
+    def test_service_events_are_skipped(self):
+        client = FakeCloudTrail([[event(1, service=True), event(2)]])
+        rows = list(iter_event_rows(client, START, END, {}, ['EventId', 'awsRegion']))
+        self.assertEqual(client.calls[0]['LookupAttributes'], [])
+        self.assertEqual(rows, [{'EventId': "event-2", 'awsRegion': "us-east-1"}])
+
+    def test_event_json_is_only_parsed_for_projected_fields(self):
+        client = FakeCloudTrail([[event(1, detail="not json")]])
+        self.assertEqual(list(iter_event_rows(client, START, END, {}, ['EventId', 'eventName'])),
+                         [{'EventId': "event-1", 'eventName': "PutObject"}])
+
+    def test_limit_stops_fetching(self):
+        client = FakeCloudTrail([[event(1), event(2), event(3)], [event(4)]])
+        rows = list(iter_event_rows(client, START, END, {}, ['EventId'], limit=2))
+        self.assertEqual([row['EventId'] for row in rows], ["event-1", "event-2"])
+        self.assertEqual(len(client.calls), 1)
+
+class TestEventsCommand(unittest.TestCase):
+    def invoke(self, client, args, ofile):
+        app = typer.Typer()
+        app.command()(events)
+        obj = {'DRY_RUN': False, 'QUIET': False, 'FORCE': False, 'OUTPUT': 'csv', 'OFILE': ofile}
+        with mock.patch("events.get_aws_client", return_value=client):
+            return CliRunner().invoke(app, args, obj=obj)
+
+    def test_csv_streams_to_the_output_file(self):
+        client = FakeCloudTrail([[event(1), event(2)]])
+        with tempfile.TemporaryDirectory() as directory:
+            ofile = os.path.join(directory, "events.csv")
+            result = self.invoke(client, ["--fields", "EventId,EventTime", "--limit", "1"], ofile)
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(result.output, "")
+            with open(ofile, newline="") as file:
+                self.assertEqual(file.read().splitlines(), ["Event ID,Event Time", "event-1,2024-03-01T12:00:01"])
+
+    def test_csv_error_part_way_exits_non_zero(self):
+        error = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'slow down'}}, 'LookupEvents')
+        client = FakeCloudTrail([[event(1)], error])
+        with tempfile.TemporaryDirectory() as directory:
+            ofile = os.path.join(directory, "events.csv")
+            result = self.invoke(client, ["--fields", "EventId"], ofile)
+
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("An AWS ClientError occurred", result.output)
+            # the rows before the error, and no table after them
+            with open(ofile, newline="") as file:
+                self.assertEqual(file.read().splitlines(), ["Event ID", "event-1"])
+
+if __name__ == "__main__":
+    unittest.main()
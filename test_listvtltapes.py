@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import threading
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+from listvtltapes import tape_batches, describe_tape_batch, list_tapes
+
+GATEWAYS = [f"arn:aws:storagegateway:us-east-1:111122223333:gateway/sgw-0000000{number}" for number in range(3)]
+
+def tape_info(number, gateway_arn=None):
+    info = {'TapeARN': f"arn:aws:storagegateway:us-east-1:111122223333:tape/TAPE{number:04d}",
+            'TapeBarcode': f"TAPE{number:04d}"}
+    if gateway_arn:
+        info['GatewayARN'] = gateway_arn
+    return info
+
+def tape_data(tape_arn, status="AVAILABLE"):
+    return {'TapeARN': tape_arn, 'TapeBarcode': tape_arn.split('/')[-1], 'TapeCreatedDate': datetime(2024, 1, 1),
+            'TapeSizeInBytes': 100, 'TapeUsedInBytes': 10, 'TapeStatus': status}
+
+class FakeStorageGateway:
+    """
+    A tape library answering describe calls two tapes per page, in a random order across threads.
+    """
+    PAGE_SIZE = 2
+
+    def __init__(self, infos):
+        self.infos = infos
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def list_tapes(self, **args):
+        return {'TapeInfos': self.infos}
+
+    def page(self, operation, args, key, status):
+        with self.lock:
+            self.calls.append((operation, args.get('GatewayARN'), list(args['TapeARNs']), args.get('Marker')))
+        # let batches finish out of order
+        time.sleep(random.random() / 100)
+        start = int(args.get('Marker', 0))
+        response = {key: [tape_data(tape_arn, status) for tape_arn in args['TapeARNs'][start:start + self.PAGE_SIZE]]}
+        if start + self.PAGE_SIZE < len(args['TapeARNs']):
+            response['Marker'] = str(start + self.PAGE_SIZE)
+        return response
+
+    def describe_tapes(self, **args):
+        return self.page('describe_tapes', args, 'Tapes', "AVAILABLE")
+
+    def describe_tape_archives(self, **args):
+        return self.page('describe_tape_archives', args, 'TapeArchives', "ARCHIVED")
+
+class TestTapeBatches(unittest.TestCase):
+    def test_batches_split_at_the_batch_size(self):
+        infos = [tape_info(number, GATEWAYS[0]) for number in range(250)]
+        batches = tape_batches(infos)
+        self.assertEqual([len(tape_arns) for _, tape_arns in batches], [100, 100, 50])
+        self.assertEqual([tape_arn for _, tape_arns in batches for tape_arn in tape_arns], [info['TapeARN'] for info in infos])
+
+    def test_archived_tapes_are_batched_separately(self):
+        infos = [tape_info(number, GATEWAYS[number % 2] if number < 6 else None) for number in range(9)]
+        batches = tape_batches(infos, gateway_arns=["sgw-00000001"], batch_size=2)
+
+        # only the chosen gateway's tapes, but every archived tape
+        self.assertEqual([(gateway_arn, [tape_arn.split('/')[-1] for tape_arn in tape_arns]) for gateway_arn, tape_arns in batches], [
+            (GATEWAYS[1], ["TAPE0001", "TAPE0003"]),
+            (GATEWAYS[1], ["TAPE0005"]),
+            (None, ["TAPE0006", "TAPE0007"]),
+            (None, ["TAPE0008"]),
+        ])
+
+class TestDescribeTapeBatch(unittest.TestCase):
+    def test_pages_within_a_batch_are_followed(self):
+        infos = [tape_info(number, GATEWAYS[0]) for number in range(5)]
+        client = FakeStorageGateway(infos)
+        rows = describe_tape_batch(client, (GATEWAYS[0], [info['TapeARN'] for info in infos]))
+
+        self.assertEqual([row['TapeBarcode'] for row in rows], [info['TapeBarcode'] for info in infos])
+        self.assertEqual([marker for _, _, _, marker in client.calls], [None, "2", "4"])
+        self.assertTrue(all(row['GatewayARN'] == GATEWAYS[0] for row in rows))
+
+    def test_archived_batches_use_describe_tape_archives(self):
+        infos = [tape_info(number) for number in range(3)]
+        client = FakeStorageGateway(infos)
+        rows = describe_tape_batch(client, (None, [info['TapeARN'] for info in infos]))
+
+        self.assertEqual({operation for operation, _, _, _ in client.calls}, {'describe_tape_archives'})
+        self.assertEqual([(row['TapeStatus'], row['GatewayARN']) for row in rows], [("ARCHIVED", None)] * 3)
+
+class TestListTapes(unittest.TestCase):
+    def test_rows_are_sorted_after_concurrent_batches(self):
+        numbers = list(range(230))
+        random.shuffle(numbers)
+        infos = [tape_info(number, GATEWAYS[number % 3] if number % 5 else None) for number in numbers]
+        client = FakeStorageGateway(infos)
+        ctx = SimpleNamespace(obj={'MAX_WORKERS': 8, 'CONFIG': None})
+
+        with mock.patch("listvtltapes.get_aws_client", return_value=client):
+            tapes = list_tapes(ctx)
+
+        self.assertEqual([row['TapeBarcode'] for row in tapes.data], [f"TAPE{number:04d}" for number in range(230)])
+        # every describe call covers at most 100 tapes of one gateway, or only archived tapes
+        first_pages = [call for call in client.calls if call[3] is None]
+        self.assertTrue(all(len(tape_arns) <= 100 for _, _, tape_arns, _ in first_pages))
+        self.assertEqual(sum(len(tape_arns) for _, _, tape_arns, _ in first_pages), 230)
+        self.assertEqual(sum(len(tape_arns) for operation, _, tape_arns, _ in first_pages if operation == 'describe_tape_archives'), 46)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
+
+from botocore.exceptions import ClientError
+
+from mktapes import create_tapes, create_tapes_bulk
+from utils.barcodes import BarcodeAllocator, BARCODE_STORE_FILE
+
+GATEWAY_ARN = "arn:aws:storagegateway:us-east-1:111122223333:gateway/sgw-12345678"
+
+class FakeStorageGateway:
+    """
+    A gateway holding some tapes, refusing to create tapes with barcodes it already has.
+    """
+    def __init__(self, barcodes):
+        self.barcodes = set(barcodes)
+        self.list_calls = 0
+        self.create_calls = []
+
+    def list_tapes(self, **kwargs):
+        self.list_calls += 1
+        return {'TapeInfos': [{'TapeBarcode': barcode, 'PoolId': "GLACIER"} for barcode in sorted(self.barcodes)]}
+
+    def create_tape_with_barcode(self, GatewayARN, TapeSizeInBytes, TapeBarcode, PoolId):
+        self.create_calls.append(TapeBarcode)
+        if TapeBarcode in self.barcodes:
+            raise ClientError({'Error': {'Code': 'InvalidGatewayRequestException',
+                                         'Message': 'TapeBarcode is already in use (BarcodeAlreadyInUse)'}},
+                              'CreateTapeWithBarcode')
+        self.barcodes.add(TapeBarcode)
+        return {'TapeARN': f"arn:aws:storagegateway:us-east-1:111122223333:tape/{TapeBarcode}"}
+
+class TestCreateTapes(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.ctx = SimpleNamespace(obj={'CACHE_DIR': self.directory.name, 'MAX_WORKERS': 2})
+        # keep a real ~/.awstapes out of the scans
+        patcher = mock.patch("mktapes.TAPE_STORAGE_FILE", os.path.join(self.directory.name, "awstapes"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # the store was last seeded when the gateway only had TAPE000001 and TAPE000002; since then
+        # another host has created three more
+        with BarcodeAllocator(self.directory.name) as allocator:
+            allocator.seed("TAPE", "us-east-1", [("TAPE000001", "GLACIER"), ("TAPE000002", "GLACIER")])
+        self.client = FakeStorageGateway([f"TAPE00000{number}" for number in range(1, 6)])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_quietly(self, function, *args, **kwargs):
+        with redirect_stdout(io.StringIO()) as output:
+            function(*args, **kwargs)
+        return output.getvalue()
+
+    def test_conflict_rescans_instead_of_stepping(self):
+        self.run_quietly(create_tapes, self.ctx, self.client, 2, "TAPE", GATEWAY_ARN, 100, "GLACIER", False, "us-east-1")
+
+        self.assertEqual(self.client.create_calls, ["TAPE000003", "TAPE000006", "TAPE000007"])
+        self.assertEqual(self.client.list_calls, 1)
+
+    def test_bulk_conflicts_rescan_once_per_round(self):
+        self.run_quietly(create_tapes_bulk, self.ctx, self.client, 4, "TAPE", GATEWAY_ARN, 100, "GLACIER", False,
+                         "us-east-1", explicit=True)
+
+        # 3, 4 and 5 fail together, then one rescan moves them all past the gateway's tapes
+        self.assertEqual(sorted(self.client.create_calls[:4]), ["TAPE000003", "TAPE000004", "TAPE000005", "TAPE000006"])
+        self.assertEqual(sorted(self.client.create_calls[4:]), ["TAPE000007", "TAPE000008", "TAPE000009"])
+        self.assertEqual(self.client.list_calls, 1)
+        with BarcodeAllocator(self.directory.name) as allocator:
+            self.assertEqual(allocator.high_water("TAPE", "us-east-1")[0], 9)
+
+    def test_dry_run_does_not_persist(self):
+        os.remove(os.path.join(self.directory.name, BARCODE_STORE_FILE))
+        output = self.run_quietly(create_tapes, self.ctx, self.client, 2, "TAPE", GATEWAY_ARN, 100, "GLACIER", True,
+                                  "us-east-1")
+
+        self.assertIn("Barcode: TAPE000006", output)
+        self.assertEqual(self.client.create_calls, [])
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, BARCODE_STORE_FILE)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import unittest
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+from sgstatus import describe_gateways, gateway_metric_queries
+
+def gateway(name, gateway_type="VTL"):
+    return {'GatewayARN': f"arn:aws:storagegateway:us-east-1:111122223333:gateway/sgw-{name}",
+            'GatewayId': f"sgw-{name}", 'GatewayName': name, 'GatewayType': gateway_type}
+
+class FakeStorageGateway:
+    """
+    Detail calls answering for running gateways and failing for stopped ones.
+    """
+    def __init__(self, stopped):
+        self.stopped = stopped
+
+    def check(self, operation, gateway_arn):
+        if gateway_arn.split('/')[-1] in self.stopped:
+            raise ClientError({'Error': {'Code': 'InvalidGatewayRequestException', 'Message': 'The gateway is offline'}},
+                              operation)
+
+    def describe_gateway_information(self, GatewayARN):
+        self.check('DescribeGatewayInformation', GatewayARN)
+        return {'GatewayState': 'RUNNING', 'EndpointType': 'STANDARD',
+                'GatewayNetworkInterfaces': [{'Ipv4Address': '10.0.0.1'}]}
+
+    def describe_cache(self, GatewayARN):
+        self.check('DescribeCache', GatewayARN)
+        return {'CacheAllocatedInBytes': 2**31, 'CacheUsedPercentage': 12.5}
+
+    def describe_upload_buffer(self, GatewayARN):
+        self.check('DescribeUploadBuffer', GatewayARN)
+        return {'UploadBufferAllocatedInBytes': 400, 'UploadBufferUsedInBytes': 100}
+
+    def describe_vtl_devices(self, GatewayARN, Marker=None):
+        self.check('DescribeVTLDevices', GatewayARN)
+        if Marker is None:
+            return {'VTLDevices': [{}, {}], 'Marker': 'next'}
+        return {'VTLDevices': [{}]}
+
+class TestSgstatus(unittest.TestCase):
+    def test_failing_gateway_does_not_blank_others(self):
+        gateways = [gateway("AAAA0001"), gateway("BBBB0002"), gateway("CCCC0003", "FILE_S3")]
+        rows = {gw['GatewayARN']: {'GatewayState': None, 'CacheUsedPercentage': None, **gw} for gw in gateways}
+        ctx = SimpleNamespace(obj={'MAX_WORKERS': 4})
+
+        failures = describe_gateways(ctx, FakeStorageGateway(stopped={"sgw-BBBB0002"}), gateways, rows)
+
+        running, stopped, file_gateway = (rows[gw['GatewayARN']] for gw in gateways)
+        self.assertEqual(running['GatewayState'], 'RUNNING')
+        self.assertEqual(running['CacheUsedPercentage'], '12.5')
+        self.assertEqual(running['UploadBufferUsedPercentage'], '25.0')
+        self.assertEqual(running['VTLDevices'], 3)
+        self.assertEqual(file_gateway['GatewayState'], 'RUNNING')
+        self.assertNotIn('VTLDevices', file_gateway)
+        # the stopped gateway keeps its list_gateways fields and its empty columns
+        self.assertEqual(stopped['GatewayName'], "BBBB0002")
+        self.assertIsNone(stopped['GatewayState'])
+
+        self.assertEqual(list(failures), [gateways[1]['GatewayARN']])
+        self.assertEqual(sorted(operation for operation, _ in failures[gateways[1]['GatewayARN']]),
+                         ["describe_cache", "describe_gateway_information", "describe_upload_buffer", "describe_vtl_devices"])
+
+    def test_buffer_metric_is_the_maximum(self):
+        stats = {query['MetricStat']['Metric']['MetricName']: query['MetricStat']['Stat']
+                 for query in gateway_metric_queries([gateway("AAAA0001")], 300)}
+        self.assertEqual(stats['UploadBufferPercentUsed'], 'Maximum')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+from contextlib import redirect_stderr
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+from tapes import poll_retrievals, TapeUtilization
+
+GATEWAY_ARN = "arn:aws:storagegateway:us-east-1:111122223333:gateway/sgw-12345678"
+
+def tape(number, used=2**30):
+    return {'TapeARN': f"arn:tape/TAPE{number:02d}", 'TapeBarcode': f"TAPE{number:02d}", 'TapeUsedInBytes': used}
+
+class FakeClock:
+    """
+    A sleep and monotonic clock pair where sleeping is instant but moves the clock on.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.delays = []
+
+    def sleep(self, delay):
+        self.delays.append(delay)
+        self.now += delay
+
+    def clock(self):
+        return self.now
+
+class FakeStorageGateway:
+    """
+    describe_tapes answering from one {tape ARN: (status, progress)} dict per polling round.
+
+    A round may instead be an exception to raise.  The last round repeats once they run out.
+    """
+    def __init__(self, rounds):
+        self.rounds = rounds
+        self.round = -1
+        self.calls = 0
+
+    def start_round(self):
+        self.round = min(self.round + 1, len(self.rounds) - 1)
+
+    def describe_tapes(self, GatewayARN, TapeARNs, Marker=None):
+        self.calls += 1
+        states = self.rounds[self.round]
+        if isinstance(states, Exception):
+            raise states
+        return {'Tapes': [{'TapeARN': tape_arn, 'TapeStatus': states[tape_arn][0], 'Progress': states[tape_arn][1]}
+                          for tape_arn in TapeARNs if tape_arn in states]}
+
+class TestPollRetrievals(unittest.TestCase):
+    def setUp(self):
+        self.ctx = SimpleNamespace(obj={'QUIET': True, 'MAX_WORKERS': 2})
+        self.time = FakeClock()
+
+    def poll(self, client, tapes, **kwargs):
+        def sleep(delay):
+            self.time.sleep(delay)
+            client.start_round()
+
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            finished = poll_retrievals(self.ctx, client, GATEWAY_ARN, tapes, sleep=sleep, clock=self.time.clock,
+                                       initial_delay=10, max_delay=40, **kwargs)
+        return finished, stderr.getvalue()
+
+    def test_finishes_when_all_tapes_are_done(self):
+        tapes = [tape(1), tape(2)]
+        client = FakeStorageGateway([
+            {tapes[0]['TapeARN']: ("RETRIEVING", 10), tapes[1]['TapeARN']: ("RETRIEVING", 0)},
+            {tapes[0]['TapeARN']: ("RETRIEVED", None), tapes[1]['TapeARN']: ("RETRIEVING", 50)},
+            {tapes[1]['TapeARN']: ("IRRECOVERABLE", None)},
+        ])
+        finished, errors = self.poll(client, tapes)
+
+        self.assertEqual(finished, {tapes[0]['TapeARN']: "RETRIEVED", tapes[1]['TapeARN']: "IRRECOVERABLE"})
+        self.assertIn("TAPE02 could not be retrieved", errors)
+        # the wait doubles up to max_delay
+        self.assertEqual(self.time.delays, [10, 20, 40])
+
+    def test_stuck_and_missing_tapes_fail(self):
+        tapes = [tape(1), tape(2), tape(3)]
+        client = FakeStorageGateway([
+            {tapes[0]['TapeARN']: ("ARCHIVED", None), tapes[1]['TapeARN']: ("RETRIEVING", 5)},
+        ])
+        finished, errors = self.poll(client, tapes, max_stalled_rounds=3, timeout=1000)
+
+        # the ARCHIVED tape counts from its first sighting, the missing one from the first round
+        self.assertEqual(finished[tapes[0]['TapeARN']], "ARCHIVED")
+        self.assertEqual(finished[tapes[2]['TapeARN']], "NOT_FOUND")
+        self.assertIn("TAPE01 could not be retrieved: still ARCHIVED after 3 checks", errors)
+        # a retrieval in progress isn't stalled however long it sits at the same percentage, so it
+        # only ends at the timeout
+        self.assertEqual(finished[tapes[1]['TapeARN']], "TIMED_OUT")
+
+    def test_repeated_describe_errors_fail(self):
+        tapes = [tape(1)]
+        error = ClientError({'Error': {'Code': 'InternalServerError', 'Message': 'down'}}, 'DescribeTapes')
+        client = FakeStorageGateway([error])
+        finished, errors = self.poll(client, tapes, max_stalled_rounds=4)
+
+        self.assertEqual(finished, {tapes[0]['TapeARN']: "NOT_FOUND"})
+        self.assertEqual(client.calls, 4)
+        self.assertIn("Failed to check 1 tapes", errors)
+
+    def test_timeout(self):
+        tapes = [tape(1)]
+        client = FakeStorageGateway([{tapes[0]['TapeARN']: ("RETRIEVING", 1)}])
+        finished, errors = self.poll(client, tapes, timeout=100)
+
+        self.assertEqual(finished, {tapes[0]['TapeARN']: "TIMED_OUT"})
+        # 10 + 20 + 40 + 40 seconds
+        self.assertEqual(len(self.time.delays), 4)
+        self.assertIn("still pending after", errors)
+
+def tape_row(number, pool, gateway_arn, used, size=2**40):
+    return {'TapeBarcode': f"TAPE{number:04d}", 'PoolId': pool, 'GatewayARN': gateway_arn, 'TapeStatus': "AVAILABLE",
+            'TapeSizeInBytes': size, 'TapeUsedInBytes': used}
+
+class TestTapeUtilization(unittest.TestCase):
+    def setUp(self):
+        pools = ["GLACIER", "DEEP_ARCHIVE"]
+        # every third tape has never been written, and reports no TapeUsedInBytes at all
+        self.rows = [tape_row(number, pools[number % 2], GATEWAY_ARN if number % 4 else None,
+                              None if number % 3 == 0 else number * 2**30)
+                     for number in range(60)]
+
+    def test_merged_batches_match_one_pass(self):
+        single = TapeUtilization(["pool", "gateway"])
+        for row in self.rows:
+            single.add(row)
+
+        merged = TapeUtilization(["pool", "gateway"])
+        for start in range(0, len(self.rows), 7):
+            batch = TapeUtilization(["pool", "gateway"])
+            for row in self.rows[start:start + 7]:
+                batch.add(row)
+            merged.merge(batch)
+
+        self.assertEqual(merged.groups, single.groups)
+        self.assertEqual(merged.report().data, single.report().data)
+
+    def test_totals(self):
+        totals = TapeUtilization(["pool"])
+        for row in self.rows:
+            totals.add(row)
+
+        glacier = totals.groups[("GLACIER",)]
+        self.assertEqual(glacier[0], 30)
+        # tapes 3, 9, ... 57 have no used bytes
+        self.assertEqual(glacier[1], 10)
+        self.assertEqual(glacier[2], 30 * 2**40)
+        self.assertEqual(glacier[3], sum(number * 2**30 for number in range(1, 60, 2) if number % 3))
+
+        report = totals.report(units="GiB").data
+        self.assertEqual([row['pool'] for row in report], ["DEEP_ARCHIVE", "GLACIER", "Total"])
+        self.assertEqual(report[-1]['Tapes'], 60)
+        self.assertEqual(report[-1]['Empty'], 20)
+
+    def test_archived_tapes_group_without_gateway(self):
+        totals = TapeUtilization(["gateway"])
+        for row in self.rows:
+            totals.add(row)
+        self.assertEqual(sorted(totals.groups), [("(archive)",), ("sgw-12345678",)])
+        self.assertEqual(totals.groups[("(archive)",)][0], 15)
+
+if __name__ == "__main__":
+    unittest.main()
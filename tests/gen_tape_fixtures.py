@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# gen_tape_fixtures.py
+# Write a synthetic tape library as --replay fixtures, for timing listvtltapes and friends
+# without AWS:
+#
+#   python tests/gen_tape_fixtures.py /tmp/tapes --tapes 50000 --gateways 4
+#   python sauce.py --replay /tmp/tapes --replay-latency 50 --stats listvtltapes
+#
+# Fixtures are keyed on the exact call parameters, so the describe batches written here follow
+# listvtltapes.tape_batches() with the default batch size.
+
+import os
+import sys
+import json
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import botocore.session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.amazon import fixture_key, _encode_fixture_value, FIXTURE_SESSION_FILE, FIXTURE_VERSION
+from listvtltapes import tape_batches, DEFAULT_DESCRIBE_BATCH_SIZE
+
+LIST_PAGE_SIZE = 1000
+TAPE_SIZE = 100 * 1024 ** 3
+STATUSES = ["AVAILABLE", "AVAILABLE", "AVAILABLE", "IN TRANSIT TO VTS", "RETRIEVED"]
+POOLS = ["GLACIER", "DEEP_ARCHIVE"]
+
+def write_fixture(directory, model, params, parsed, counts):
+    key = fixture_key(model, params)
+    index = counts.get((model.name, key), 0)
+    counts[(model.name, key)] = index + 1
+
+    path = os.path.join(directory, "storagegateway", model.name)
+    os.makedirs(path, exist_ok=True)
+    fixture = {
+        "service": "storagegateway",
+        "operation": model.name,
+        "params": params,
+        "status_code": 200,
+        "headers": {},
+        "parsed": parsed
+    }
+    with open(os.path.join(path, f"{key}-{index}.json"), "w") as file:
+        json.dump(fixture, file, default=_encode_fixture_value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic tape library replay fixtures.")
+    parser.add_argument("directory", help="Fixture directory to write.")
+    parser.add_argument("--tapes", type=int, default=50000, help="Number of tapes.")
+    parser.add_argument("--gateways", type=int, default=4, help="Number of gateways.")
+    parser.add_argument("--archived", type=float, default=0.3, help="Fraction of tapes archived.")
+    parser.add_argument("--region", default="us-east-1", help="Region of the recording.")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed.")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    model = botocore.session.get_session().get_service_model("storagegateway")
+    prefix = f"arn:aws:storagegateway:{args.region}:123456789012"
+    gateways = [f"{prefix}:gateway/sgw-{index:08X}" for index in range(args.gateways)]
+    created = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+    infos = []
+    tapes = {}
+    for index in range(args.tapes):
+        barcode = f"SYN{index:05X}"
+        archived = random.random() < args.archived
+        gateway = None if archived else gateways[index % len(gateways)]
+        arn = f"{prefix}:tape/{barcode}"
+        tape = {
+            "TapeARN": arn,
+            "TapeBarcode": barcode,
+            "TapeCreatedDate": created + timedelta(minutes=index),
+            "TapeSizeInBytes": TAPE_SIZE,
+            "TapeStatus": "ARCHIVED" if archived else random.choice(STATUSES),
+            "TapeUsedInBytes": random.randint(0, TAPE_SIZE),
+            "PoolId": random.choice(POOLS),
+            "Worm": False,
+            "PoolEntryDate": created + timedelta(minutes=index, days=1)
+        }
+        info = {key: tape[key] for key in ("TapeARN", "TapeBarcode", "TapeSizeInBytes", "TapeStatus", "PoolId", "PoolEntryDate")}
+        if gateway:
+            info["GatewayARN"] = gateway
+        infos.append(info)
+        tapes[arn] = tape
+
+    os.makedirs(args.directory, exist_ok=True)
+    with open(os.path.join(args.directory, FIXTURE_SESSION_FILE), "w") as file:
+        json.dump({"version": FIXTURE_VERSION, "region": args.region}, file, indent=2)
+
+    counts = {}
+    list_model = model.operation_model("ListTapes")
+    for start in range(0, len(infos), LIST_PAGE_SIZE):
+        params = {"Marker": str(start)} if start else {}
+        parsed = {"TapeInfos": infos[start:start + LIST_PAGE_SIZE]}
+        if start + LIST_PAGE_SIZE < len(infos):
+            parsed["Marker"] = str(start + LIST_PAGE_SIZE)
+        write_fixture(args.directory, list_model, params, parsed, counts)
+
+    describe_model = model.operation_model("DescribeTapes")
+    archives_model = model.operation_model("DescribeTapeArchives")
+    batches = tape_batches(infos, batch_size=DEFAULT_DESCRIBE_BATCH_SIZE)
+    for gateway, arns in batches:
+        if gateway:
+            write_fixture(args.directory, describe_model, {"GatewayARN": gateway, "TapeARNs": arns},
+                          {"Tapes": [tapes[arn] for arn in arns]}, counts)
+        else:
+            archives = [{**tapes[arn], "CompletionTime": tapes[arn]["PoolEntryDate"]} for arn in arns]
+            write_fixture(args.directory, archives_model, {"TapeARNs": arns}, {"TapeArchives": archives}, counts)
+
+    print(f"Wrote {len(infos)} tapes in {len(batches)} describe batches to {args.directory}")
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,39 @@
 
 import re
 import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from datetime import datetime
 import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, ClientError
 import typer
 from typer.models import Context
 
-def build_arn(service, resource_type, resource_id, partition='aws', region=None):
+# Defaults for the [aws] section of the sauce config file.  These match botocore's own defaults
+# except for the retry mode, which is 'standard' rather than 'legacy'.
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+DEFAULT_CONNECT_TIMEOUT = 60
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_RETRY_MODE = "standard"
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_TCP_KEEPALIVE = False
+DEFAULT_MAX_WORKERS = 8
+RETRY_MODES = ["legacy", "standard", "adaptive"]
+
+# On-disk cache of resolved account identities, keyed by credential fingerprint
+IDENTITY_CACHE_FILE = "identity.json"
+IDENTITY_CACHE_MAX_ENTRIES = 64
+
+# Record/replay fixture layout: DIR/session.json and DIR/<service>/<Operation>/<key>-<n>.json
+FIXTURE_SESSION_FILE = "session.json"
+FIXTURE_VERSION = 1
+
+def build_arn(service, resource_type, resource_id, partition='aws', region=None, account_id=None):
     """
     Build an AWS ARN for a given resource.
 
@@ -16,22 +43,25 @@ def build_arn(service, resource_type, resource_id, partition='aws', region=None)
     :param resource_id: The ID of the resource (e.g., 'my-lambda-function', 'my-bucket').
     :param partition: The partition in which the resource is located (default: 'aws').
     :param region: The AWS region (default: None, attempts to read from environment or config, fallback 'us-east-1').
+    :param account_id: The account ID (default: None, looked up with STS).  Pass the value from
+                       get_identity() to build the ARN without any network calls.
     :return: The ARN string or None if an error occurs.
     """
     # Attempt to determine the region
     if region is None:
         region = boto3.session.Session().region_name or 'us-east-1'
 
-    # Create a boto3 STS client to get the account ID
-    sts_client = boto3.client('sts', region_name=region)
-    try:
-        account_id = sts_client.get_caller_identity()["Account"]
-    except NoCredentialsError:
-        print("No AWS credentials found. Please configure your AWS credentials.")
-        return None
-    except ClientError as e:
-        print(f"An error occurred accessing AWS STS: {e}")
-        return None
+    if account_id is None:
+        # Create a boto3 STS client to get the account ID
+        sts_client = boto3.client('sts', region_name=region)
+        try:
+            account_id = sts_client.get_caller_identity()["Account"]
+        except NoCredentialsError:
+            print("No AWS credentials found. Please configure your AWS credentials.")
+            return None
+        except ClientError as e:
+            print(f"An error occurred accessing AWS STS: {e}")
+            return None
 
     return f"arn:{partition}:{service}:{region}:{account_id}:{resource_type}/{resource_id}"
 
@@ -122,27 +152,325 @@ def get_aws_session ( ctx: typer.Context):
     :param ctx: The Typer context object.
     :return: A boto3 session object.
     """
-    if "AWS_SESSION" not in ctx.obj:
-        # Get profile name from PROFILE in ctx or use "default"
-        profile_name = ctx.obj.get("PROFILE", "default")
-        ctx.obj["AWS_SESSION"] = build_aws_session(profile_name)
-    else:
-        # verify the session is valid/active
-        try:
-            ctx.obj["AWS_SESSION"].client("sts").get_caller_identity()
-        except NoCredentialsError:
-            # if the session is invalid, rebuild it
-            ctx.obj["AWS_SESSION"] = build_aws_session(profile_name)
+    replayer = ctx.obj.get("AWS_REPLAY")
+
+    if "AWS_SESSION" not in ctx.obj or (replayer is None and ctx.obj["AWS_SESSION"].get_credentials() is None):
+        # a missing session, or one with no usable credentials, is (re)built here.  This is a local
+        # check only; the credentials are validated against AWS once per profile by get_identity()
+        if replayer is not None:
+            # replayed calls never reach AWS, so no profile or credentials are needed
+            session = boto3.Session(region_name=replayer.region)
+        else:
+            # Get profile name from PROFILE in ctx or use "default"
+            session = build_aws_session(ctx.obj.get("PROFILE", "default"))
+
+        # event hooks must be registered before any clients are created from the session
+        for hook in ctx.obj.get("AWS_HOOKS", []):
+            hook.register(session)
+        ctx.obj["AWS_SESSION"] = session
     
     return ctx.obj["AWS_SESSION"]
 
-def get_aws_client (ctx: typer.Context, service_name: str):
+### Account identity
+def credential_fingerprint(session) -> str:
+    """
+    Return a stable, non-reversible fingerprint of the session's profile and access key.
+
+    :param session: A boto3 session object.
+    :return: A hex digest identifying the credentials.
+    :raises NoCredentialsError: If the session has no credentials.
+    """
+    credentials = session.get_credentials()
+    if credentials is None:
+        raise NoCredentialsError()
+    access_key = credentials.get_frozen_credentials().access_key
+    return hashlib.sha256(f"{session.profile_name}:{access_key}".encode()).hexdigest()
+
+def read_identity_cache(cache_dir: str) -> dict:
+    """
+    Read the identity cache from cache_dir.
+
+    :param cache_dir: The sauce cache directory, or None.
+    :return: A dictionary of fingerprint -> identity.  Empty if the cache is missing or unreadable.
+    """
+    if not cache_dir:
+        return {}
+    try:
+        with open(os.path.join(cache_dir, IDENTITY_CACHE_FILE), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def write_identity_cache(cache_dir: str, cache: dict):
+    """
+    Atomically write the identity cache to cache_dir, keeping only the newest entries.
+
+    :param cache_dir: The sauce cache directory, or None to skip writing.
+    :param cache: A dictionary of fingerprint -> identity.
+    """
+    if not cache_dir:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    entries = dict(list(cache.items())[-IDENTITY_CACHE_MAX_ENTRIES:])
+    path = os.path.join(cache_dir, IDENTITY_CACHE_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+        json.dump(entries, file)
+    os.replace(tmp_path, path)
+
+def get_identity(ctx: typer.Context) -> dict:
+    """
+    Resolve the account ID, ARN and partition of the active credentials.
+
+    The identity is looked up with STS at most once per set of credentials and cached on disk in
+    CACHE_DIR.  The result is also stored in ctx as IDENTITY, ACCOUNT_ID and PARTITION.
+
+    :param ctx: The Typer context object.
+    :return: A dictionary with Account, Arn, UserId and Partition keys.
+    """
+    if "IDENTITY" in ctx.obj:
+        return ctx.obj["IDENTITY"]
+
+    session = get_aws_session(ctx)
+    if ctx.obj.get("AWS_REPLAY"):
+        # the identity comes from the fixtures and must not leak into the real cache
+        cache_dir, fingerprint = None, "replay"
+    else:
+        cache_dir = ctx.obj.get("CACHE_DIR")
+        fingerprint = credential_fingerprint(session)
+    cache = read_identity_cache(cache_dir)
+
+    identity = cache.get(fingerprint)
+    if identity is not None and ctx.obj.get("STATS"):
+        ctx.obj["STATS"].record_cache_hit("identity")
+    if identity is None:
+        response = get_aws_client(ctx, "sts").get_caller_identity()
+        identity = {
+            "Account": response["Account"],
+            "Arn": response["Arn"],
+            "UserId": response["UserId"],
+            "Partition": Arn(response["Arn"]).partition
+        }
+        cache[fingerprint] = identity
+        write_identity_cache(cache_dir, cache)
+
+    ctx.obj["IDENTITY"] = identity
+    ctx.obj["ACCOUNT_ID"] = identity["Account"]
+    ctx.obj["PARTITION"] = identity["Partition"]
+    return identity
+
+def get_max_workers(ctx: typer.Context) -> int:
+    """
+    Return the number of concurrent workers commands should use for fan-out work.
+
+    :param ctx: The Typer context object.
+    :return: The worker count from ctx, or the [aws] max_workers config setting.
+    """
+    if ctx.obj.get("MAX_WORKERS"):
+        return ctx.obj["MAX_WORKERS"]
+
+    config = ctx.obj.get("CONFIG")
+    if config is None:
+        return DEFAULT_MAX_WORKERS
+    return max(1, config.getint("aws", "max_workers", fallback=DEFAULT_MAX_WORKERS))
+
+def build_client_config(config, max_workers: int = 0) -> Config:
+    """
+    Build a botocore Config from the [aws] section of the sauce config file.
+
+    The connection pool is never smaller than the number of workers that may share the client,
+    otherwise concurrent calls block waiting for a free connection.
+
+    :param config: A configparser object, or None to use the defaults.
+    :param max_workers: The number of workers that will share clients built with this config.
+    :return: A botocore Config object.
+    """
+    if config is None or not config.has_section("aws"):
+        section = {}
+        tcp_keepalive = DEFAULT_TCP_KEEPALIVE
+    else:
+        section = config["aws"]
+        tcp_keepalive = section.getboolean("tcp_keepalive", fallback=DEFAULT_TCP_KEEPALIVE)
+
+    pool_size = int(section.get("max_pool_connections", DEFAULT_MAX_POOL_CONNECTIONS))
+    retry_mode = section.get("retry_mode", DEFAULT_RETRY_MODE)
+    if retry_mode not in RETRY_MODES:
+        raise ValueError(f"Invalid retry_mode in [aws] config: {retry_mode}. Use one of {RETRY_MODES}")
+
+    return Config(
+        max_pool_connections=max(pool_size, max_workers),
+        connect_timeout=float(section.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)),
+        read_timeout=float(section.get("read_timeout", DEFAULT_READ_TIMEOUT)),
+        retries={
+            "mode": retry_mode,
+            "max_attempts": int(section.get("max_attempts", DEFAULT_MAX_ATTEMPTS)),
+        },
+        tcp_keepalive=tcp_keepalive,
+    )
+
+def get_aws_client (ctx: typer.Context, service_name: str, region_name: str = None, max_workers: int = None):
     """
     Get a boto3 client using the given service name.
 
+    Clients are configured from the [aws] section of the sauce config and cached in ctx, so
+    repeated calls for the same service and region share one connection pool.
+
     :param ctx: The Typer context object.
     :param service_name: The name of the AWS service to use.
+    :param region_name: The region to connect to (default: the session's region).
+    :param max_workers: The number of workers that will share the client (default: get_max_workers()).
     :return: A boto3 client object.
     """
-    session = get_aws_session(ctx)
-    return session.client(service_name)
\ No newline at end of file
+    workers = max_workers or get_max_workers(ctx)
+    clients = ctx.obj.setdefault("AWS_CLIENTS", {})
+    key = (service_name, region_name, workers)
+
+    if key not in clients:
+        session = get_aws_session(ctx)
+        client_config = build_client_config(ctx.obj.get("CONFIG"), workers)
+        clients[key] = session.client(service_name, region_name=region_name, config=client_config)
+
+    return clients[key]
+
+### Record/replay of AWS calls
+def _encode_fixture_value(value):
+    """
+    json.dumps default hook for the non-JSON types botocore puts in parsed responses.
+    """
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Cannot record value of type {type(value).__name__}")
+
+def _decode_fixture_value(value: dict):
+    """
+    json.load object hook reversing _encode_fixture_value.
+    """
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    if "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+def fixture_key(model, params: dict) -> str:
+    """
+    Return a stable key for an API call, ignoring idempotency tokens botocore generates randomly.
+
+    :param model: The botocore OperationModel for the call.
+    :param params: The API parameters of the call.
+    :return: A short hex digest of the parameters.
+    """
+    tokens = set()
+    if model.input_shape is not None:
+        tokens = {name for name, shape in model.input_shape.members.items() if shape.metadata.get("idempotencyToken")}
+    keyed = {name: value for name, value in params.items() if name not in tokens}
+    encoded = json.dumps(keyed, sort_keys=True, default=_encode_fixture_value)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:20]
+
+class _ReplayBody:
+    """
+    Minimal stand-in for urllib3's response, enough for AWSResponse.content.
+
+    The body is the recorded response re-serialized as JSON, built only if something reads it.
+    """
+    def __init__(self, parsed: dict):
+        self.parsed = parsed
+
+    def stream(self):
+        return iter([json.dumps(self.parsed, default=_encode_fixture_value).encode()])
+
+class AwsRecorder:
+    """
+    Capture every AWS call made through a session as JSON fixtures in a directory.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def register(self, session):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, FIXTURE_SESSION_FILE), "w") as file:
+            json.dump({"version": FIXTURE_VERSION, "region": session.region_name}, file, indent=2)
+        session.events.register("before-parameter-build", self.before_parameter_build)
+        session.events.register("after-call", self.after_call)
+
+    def before_parameter_build(self, params, model, context, **kwargs):
+        # remember the caller's parameters; after-call only sees the serialized request
+        context["sauce_fixture"] = (model.service_model.service_name, model.name, fixture_key(model, params), params)
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        if "sauce_fixture" not in context:
+            return
+        service, operation, key, params = context["sauce_fixture"]
+
+        with self.lock:
+            index = self.counts.get((service, operation, key), 0)
+            self.counts[(service, operation, key)] = index + 1
+
+        path = os.path.join(self.directory, service, operation)
+        os.makedirs(path, exist_ok=True)
+        fixture = {
+            "service": service,
+            "operation": operation,
+            "params": params,
+            "status_code": http_response.status_code,
+            "headers": dict(http_response.headers),
+            "parsed": parsed
+        }
+        with open(os.path.join(path, f"{key}-{index}.json"), "w") as file:
+            json.dump(fixture, file, default=_encode_fixture_value)
+
+class AwsReplayer:
+    """
+    Serve AWS calls from fixtures written by AwsRecorder instead of the network.
+
+    Repeated identical calls are served the recorded responses in order; once those run out the
+    last one is repeated, which suits status polling loops.
+    """
+    def __init__(self, directory: str, latency_ms: float = 0):
+        self.directory = directory
+        self.latency = latency_ms / 1000.0
+        self.counts = {}
+        self.lock = threading.Lock()
+
+        try:
+            with open(os.path.join(directory, FIXTURE_SESSION_FILE), "r") as file:
+                self.region = json.load(file).get("region") or "us-east-1"
+        except OSError as e:
+            raise ValueError(f"Not a sauce recording directory: {directory}: {e}")
+
+    def register(self, session):
+        session.events.register("before-parameter-build", self.before_parameter_build)
+        session.events.register("before-call", self.before_call)
+
+    def before_parameter_build(self, params, model, context, **kwargs):
+        context["sauce_fixture"] = (model.service_model.service_name, model.name, fixture_key(model, params))
+
+    def before_call(self, model, context, **kwargs):
+        service, operation, key = context["sauce_fixture"]
+
+        with self.lock:
+            index = self.counts.get((service, operation, key), 0)
+            self.counts[(service, operation, key)] = index + 1
+
+        path = os.path.join(self.directory, service, operation)
+        filename = os.path.join(path, f"{key}-{index}.json")
+        if not os.path.exists(filename):
+            # past the end of the recording, repeat the last response for this call
+            recorded = []
+            if os.path.isdir(path):
+                recorded = [int(f[len(key) + 1:-5]) for f in os.listdir(path) if f.startswith(f"{key}-")]
+            if not recorded:
+                raise LookupError(f"No recorded response for {service}.{operation} with these parameters (key {key}) in {self.directory}")
+            filename = os.path.join(path, f"{key}-{max(recorded)}.json")
+
+        with open(filename, "r") as file:
+            fixture = json.load(file, object_hook=_decode_fixture_value)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        http_response = AWSResponse(f"replay://{service}/{operation}", fixture["status_code"], fixture["headers"], _ReplayBody(fixture["parsed"]))
+        return http_response, fixture["parsed"]
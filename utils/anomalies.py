@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# anomalies.py
+# Cost anomaly detection over the daily series in the cost store, using exponentially weighted
+# moving averages (EWMA) of each key's daily cost.  Baselines are kept in the store and only the
+# days since the last run are folded in, so a run costs the same however long the history is.
+
+import math
+from datetime import date, timedelta
+
+from utils.coststore import KEY_SEPARATOR, parse_date
+
+DEFAULT_ALPHA = 0.1
+DEFAULT_THRESHOLD = 3.0
+DEFAULT_MIN_AMOUNT = 1.0
+# A key needs this many days of history before its days can be flagged
+MIN_BASELINE_DAYS = 7
+# The deviation is never taken as less than this fraction of the mean, so near-constant costs
+# don't turn every cent of change into an anomaly
+MIN_STDDEV_FRACTION = 0.1
+
+def ewma_update(mean: float, variance: float, count: int, value: float, alpha: float) -> tuple:
+    """
+    Fold one value into an exponentially weighted mean and variance.
+
+    Returns:
+    tuple: (mean, variance, count) after the update.
+    """
+    if count == 0:
+        return value, 0.0, 1
+    difference = value - mean
+    increment = alpha * difference
+    return mean + increment, (1 - alpha) * (variance + difference * increment), count + 1
+
+def deviation_score(mean: float, variance: float, value: float) -> float:
+    """
+    Return how many deviations value lies above mean.
+    """
+    stddev = max(math.sqrt(variance), abs(mean) * MIN_STDDEV_FRACTION, 0.01)
+    return (value - mean) / stddev
+
+def detect_anomalies(store, account: str, dimension: str, today: date = None, alpha: float = DEFAULT_ALPHA,
+                     threshold: float = DEFAULT_THRESHOLD, min_amount: float = DEFAULT_MIN_AMOUNT) -> list:
+    """
+    Update the stored baselines with new final days and return the anomalous days found.
+
+    Days fetched at least FINAL_AFTER_DAYS after they ended are final: they are checked against
+    the baseline, folded into it and any anomaly is stored.  Folding stops at the first day that
+    isn't final, because a day stored before its costs settled is corrected by a later refetch and
+    the baseline must not move past it.  That day and all later ones are checked against the
+    baseline but neither folded in nor stored; they are reported as provisional.
+
+    Parameters:
+    store (CostStore): The open cost store.
+    account (str): The AWS account ID.
+    dimension (str): The stored dimension, e.g. 'SERVICE'.
+    today (date, optional): Override the current date.
+    alpha (float): The EWMA smoothing factor; higher reacts faster.
+    threshold (float): Deviations above the baseline at which a day is flagged.
+    min_amount (float): Smallest increase over the baseline worth flagging.
+
+    Returns:
+    list: (date, key, amount, baseline, score, final) tuples for days after the last update.
+    """
+    today = today or date.today()
+    end = today + timedelta(days=1)
+
+    baselines = store.baselines(account, dimension)
+    watermark = max((baseline[0] for baseline in baselines.values()), default=None)
+    start = parse_date(watermark) + timedelta(days=1) if watermark else date(2000, 1, 1)
+
+    results = store.results_by_time(account, dimension, start, end)
+    # the first day that was never fetched, or only fetched before its costs were final
+    stale = store.stale_days(account, dimension, results[0]['TimePeriod']['Start'], end, today) if results else []
+    final_before = stale[0].isoformat() if stale else end.isoformat()
+
+    updated = dict(baselines)
+    provisional = dict(baselines)
+    final_anomalies = []
+    provisional_anomalies = []
+    for result in results:
+        day = result['TimePeriod']['Start']
+        final = day < final_before
+        current = updated if final else provisional
+        values = {KEY_SEPARATOR.join(group['Keys']): float(group['Metrics']['UnblendedCost']['Amount'])
+                  for group in result['Groups']}
+
+        # keys seen before but missing today cost nothing today
+        for key in set(current) | set(values):
+            value = values.get(key, 0.0)
+            _, mean, variance, count = current.get(key, (day, 0.0, 0.0, 0))
+            if count >= MIN_BASELINE_DAYS:
+                score = deviation_score(mean, variance, value)
+                if score >= threshold and value - mean >= min_amount:
+                    (final_anomalies if final else provisional_anomalies).append((day, key, value, mean, score))
+            if final:
+                updated[key] = (day, *ewma_update(mean, variance, count, value, alpha))
+        if final:
+            provisional = dict(updated)
+
+    changed = {key: baseline for key, baseline in updated.items() if baselines.get(key) != baseline}
+    if changed:
+        store.save_baselines(account, dimension, changed, final_anomalies)
+
+    return [(*anomaly, True) for anomaly in final_anomalies] + [(*anomaly, False) for anomaly in provisional_anomalies]
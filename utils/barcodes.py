@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+# barcodes.py
+# Tape barcode allocation for mktapes.  The highest number allocated per (prefix, region) is kept
+# in SQLite, so the next barcode is one lookup, and a file lock serialises allocation between
+# concurrent mktapes runs on the same host.  The same store journals bulk runs so an interrupted
+# run can be resumed.
+
+import os
+import re
+import fcntl
+import uuid
+import sqlite3
+from datetime import datetime
+
+BARCODE_STORE_FILE = "barcodes.sqlite"
+BARCODE_LOCK_FILE = "barcodes.lock"
+# Barcodes are the prefix followed by a six digit hex sequence number
+BARCODE_DIGITS = 6
+BARCODE_NUMBER = re.compile(rf"^[0-9A-F]{{{BARCODE_DIGITS}}}$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS high_water (
+    prefix TEXT NOT NULL,
+    region TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    pool TEXT,
+    scanned_at TEXT,
+    PRIMARY KEY (prefix, region)
+);
+CREATE TABLE IF NOT EXISTS barcodes (
+    region TEXT NOT NULL,
+    barcode TEXT NOT NULL,
+    pool TEXT,
+    recorded_at TEXT NOT NULL,
+    PRIMARY KEY (region, barcode)
+);
+CREATE TABLE IF NOT EXISTS bulk_runs (
+    run_id TEXT PRIMARY KEY,
+    gateway_arn TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    region TEXT NOT NULL,
+    pool TEXT,
+    size INTEGER,
+    count INTEGER NOT NULL,
+    explicit INTEGER NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS bulk_items (
+    run_id TEXT NOT NULL,
+    item TEXT NOT NULL,
+    tapes INTEGER NOT NULL,
+    tape_arns TEXT,
+    PRIMARY KEY (run_id, item)
+);
+"""
+
+def barcode_number(barcode: str, prefix: str):
+    """
+    Return the sequence number of a barcode with this prefix, or None if it isn't one of ours.
+    """
+    if not barcode.startswith(prefix):
+        return None
+    suffix = barcode[len(prefix):]
+    return int(suffix, 16) if BARCODE_NUMBER.match(suffix) else None
+
+def format_barcode(prefix: str, number: int) -> str:
+    return f"{prefix}{number:0{BARCODE_DIGITS}X}"
+
+class BarcodeAllocator:
+    """
+    Allocate barcodes from a per (prefix, region) high-water mark, under an exclusive file lock.
+
+    Use as a context manager; the lock is held until the block exits, so a second mktapes run
+    waits instead of allocating the same barcodes.
+
+    With dry_run, the store is copied into memory and nothing is locked or written, so a dry run
+    can seed, preview and allocate exactly like a real one without moving the stored mark.
+    """
+    def __init__(self, directory: str, on_wait=None, dry_run: bool = False):
+        self.directory = directory
+        self.on_wait = on_wait
+        self.dry_run = dry_run
+        self.lock_file = None
+        self.connection = None
+
+    def __enter__(self):
+        path = os.path.join(self.directory, BARCODE_STORE_FILE)
+        if self.dry_run:
+            self.connection = sqlite3.connect(":memory:")
+            if os.path.exists(path):
+                stored = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                stored.backup(self.connection)
+                stored.close()
+            self.connection.executescript(SCHEMA)
+            return self
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock_file = open(os.path.join(self.directory, BARCODE_LOCK_FILE), "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if self.on_wait:
+                self.on_wait()
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        return self
+
+    def __exit__(self, *exc):
+        self.connection.close()
+        if self.lock_file:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+        return False
+
+    def high_water(self, prefix: str, region: str):
+        """
+        Return (highest allocated number, its pool) for the prefix and region, or None if never scanned.
+        """
+        row = self.connection.execute("SELECT number, pool FROM high_water WHERE prefix = ? AND region = ?",
+                                      (prefix, region)).fetchone()
+        return tuple(row) if row else None
+
+    def seed(self, prefix: str, region: str, barcodes):
+        """
+        Set the high-water mark from existing (barcode, pool) pairs, e.g. from list_tapes.
+
+        The mark never moves backwards, so barcodes allocated but not yet listed stay reserved.
+        """
+        current = self.high_water(prefix, region)
+        number, pool = current if current else (0, None)
+        known = []
+        for barcode, barcode_pool in barcodes:
+            known.append((region, barcode, barcode_pool, datetime.now().isoformat(timespec="seconds")))
+            parsed = barcode_number(barcode, prefix)
+            if parsed is not None and parsed > number:
+                number, pool = parsed, barcode_pool
+
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO barcodes (region, barcode, pool, recorded_at) VALUES (?, ?, ?, ?)", known)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO high_water (prefix, region, number, pool, scanned_at) VALUES (?, ?, ?, ?, ?)",
+                (prefix, region, number, pool, datetime.now().isoformat(timespec="seconds")))
+
+    def preview(self, prefix: str, region: str, count: int) -> list:
+        """
+        Return the next count barcodes without allocating them, for dry runs.
+        """
+        number = (self.high_water(prefix, region) or (0, None))[0]
+        return [format_barcode(prefix, number + offset) for offset in range(1, count + 1)]
+
+    def allocate(self, prefix: str, region: str, pool: str = None) -> str:
+        """
+        Allocate and return the next barcode.  It stays allocated even if creating the tape fails.
+        """
+        number = (self.high_water(prefix, region) or (0, None))[0] + 1
+        barcode = format_barcode(prefix, number)
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO high_water (prefix, region, number, pool) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (prefix, region) DO UPDATE SET number = excluded.number",
+                (prefix, region, number, pool))
+            self.connection.execute("INSERT OR IGNORE INTO barcodes (region, barcode, pool, recorded_at) VALUES (?, ?, ?, ?)",
+                                    (region, barcode, pool, datetime.now().isoformat(timespec="seconds")))
+        return barcode
+
+    def find_run(self, gateway_arn: str, prefix: str, region: str, pool: str, size: int, count: int, explicit: bool):
+        """
+        Return the ID of an unfinished bulk run with exactly these parameters, or None.
+        """
+        row = self.connection.execute(
+            "SELECT run_id FROM bulk_runs WHERE finished_at IS NULL AND gateway_arn = ? AND prefix = ? AND region = ? "
+            "AND pool IS ? AND size IS ? AND count = ? AND explicit = ? ORDER BY started_at DESC",
+            (gateway_arn, prefix, region, pool, size, count, int(explicit))).fetchone()
+        return row[0] if row else None
+
+    def start_run(self, gateway_arn: str, prefix: str, region: str, pool: str, size: int, count: int, explicit: bool,
+                  items: list) -> str:
+        """
+        Journal a bulk run and its work items and return the run ID.
+
+        items are (item, number of tapes) pairs: barcodes for explicit runs, CreateTapes client
+        tokens otherwise.
+        """
+        run_id = uuid.uuid4().hex
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO bulk_runs (run_id, gateway_arn, prefix, region, pool, size, count, explicit, started_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, gateway_arn, prefix, region, pool, size, count, int(explicit), datetime.now().isoformat(timespec="seconds")))
+            self.connection.executemany("INSERT INTO bulk_items (run_id, item, tapes) VALUES (?, ?, ?)",
+                                        [(run_id, item, tapes) for item, tapes in items])
+        return run_id
+
+    def pending_items(self, run_id: str) -> list:
+        """
+        Return the (item, number of tapes) pairs of a run that haven't been created yet.
+        """
+        return [tuple(row) for row in self.connection.execute(
+            "SELECT item, tapes FROM bulk_items WHERE run_id = ? AND tape_arns IS NULL ORDER BY item", (run_id,))]
+
+    def complete_item(self, run_id: str, item: str, tape_arns: list):
+        with self.connection:
+            self.connection.execute("UPDATE bulk_items SET tape_arns = ? WHERE run_id = ? AND item = ?",
+                                    (",".join(tape_arns), run_id, item))
+
+    def replace_item(self, run_id: str, item: str, new_item: str):
+        with self.connection:
+            self.connection.execute("UPDATE bulk_items SET item = ? WHERE run_id = ? AND item = ?", (new_item, run_id, item))
+
+    def finish_run(self, run_id: str):
+        with self.connection:
+            self.connection.execute("UPDATE bulk_runs SET finished_at = ? WHERE run_id = ?",
+                                    (datetime.now().isoformat(timespec="seconds"), run_id))
+
+def read_legacy_barcodes(path: str, region: str) -> list:
+    """
+    Return (barcode, pool) pairs for a region from the old ~/.awstapes file (barcode,region,pool lines).
+    """
+    if not os.path.exists(path):
+        return []
+    barcodes = []
+    with open(path, "r") as file:
+        for line in file:
+            fields = line.strip().split(",")
+            if len(fields) == 3 and fields[1] == region:
+                barcodes.append((fields[0], fields[2]))
+    return barcodes
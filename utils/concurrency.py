@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# concurrency.py
+# Bounded worker pools and shared per-service AWS rate limits for fan-out commands.
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import typer
+
+from utils.amazon import get_max_workers
+
+# Requests per second allowed per AWS service, overridden from the [ratelimits] section of the
+# config.  Services not listed here are not limited.
+DEFAULT_RATE_LIMITS = {
+    "ce": 5.0,
+    "storagegateway": 10.0,
+    "cloudtrail": 2.0,
+    "cloudwatch": 20.0,
+}
+
+class RateLimiter:
+    """
+    A thread-safe token bucket allowing `rate` calls per second with bursts of up to `burst` calls.
+    """
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Block until a call is allowed.
+
+        :return: The number of seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class AwsRateLimits:
+    """
+    Session hook applying a shared RateLimiter per AWS service to every call, from any thread.
+
+    Registered ahead of the replayer so replayed runs are paced like real ones.
+    """
+    def __init__(self, rates: dict):
+        self.limiters = {service: RateLimiter(rate) for service, rate in rates.items() if rate > 0}
+
+    @classmethod
+    def from_config(cls, config):
+        rates = dict(DEFAULT_RATE_LIMITS)
+        if config is not None and config.has_section("ratelimits"):
+            for service, rate in config.items("ratelimits"):
+                rates[service] = float(rate)
+        return cls(rates)
+
+    def register(self, session):
+        session.events.register("before-call", self.before_call)
+
+    def before_call(self, model, **kwargs):
+        limiter = self.limiters.get(model.service_model.service_name)
+        if limiter is not None:
+            limiter.acquire()
+
+def run_concurrently(ctx: typer.Context, function, items, max_workers: int = None):
+    """
+    Call function(item) for every item on a bounded thread pool.
+
+    Results are yielded on the calling thread as they complete, so the caller can write them to
+    SQLite stores or SauceData without locking.  An exception raised for one item is yielded in
+    place of its result rather than stopping the others.
+
+    :param ctx: The Typer context object.
+    :param function: The function to call with each item.
+    :param items: The items to process.
+    :param max_workers: The pool size (default: get_max_workers()).
+    :return: A generator of (item, result, exception) tuples in completion order.
+    """
+    items = list(items)
+    if not items:
+        return
+    workers = min(len(items), max_workers or get_max_workers(ctx))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sauce-worker") as executor:
+        futures = {executor.submit(function, item): item for item in items}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# coststore.py
+# Local SQLite store of daily Cost Explorer results, so billing commands only fetch the days that
+# are missing or may still change.
+
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+COST_STORE_FILE = "costs.sqlite"
+
+# Cost Explorer daily figures are effectively final this many days after the day ends
+FINAL_AFTER_DAYS = 3
+
+# Separates the values of multi-dimension group keys in the key column
+KEY_SEPARATOR = "\x1f"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_costs (
+    account TEXT NOT NULL,
+    date TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    amount REAL NOT NULL,
+    unit TEXT NOT NULL,
+    PRIMARY KEY (account, dimension, date, key)
+);
+CREATE TABLE IF NOT EXISTS fetched_days (
+    account TEXT NOT NULL,
+    date TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    estimated INTEGER NOT NULL,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (account, dimension, date)
+);
+CREATE TABLE IF NOT EXISTS baselines (
+    account TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    mean REAL NOT NULL,
+    variance REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (account, dimension, key)
+);
+CREATE TABLE IF NOT EXISTS anomalies (
+    account TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    date TEXT NOT NULL,
+    key TEXT NOT NULL,
+    amount REAL NOT NULL,
+    baseline REAL NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (account, dimension, date, key)
+);
+"""
+
+def dimension_name(group_by: list) -> str:
+    """
+    Return the store's name for a Cost Explorer GroupBy list, e.g. 'SERVICE' or 'SERVICE,USAGE_TYPE'.
+    """
+    return ",".join(group['Key'] for group in group_by or []) or "TOTAL"
+
+def parse_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+class CostStore:
+    """
+    Daily costs keyed by (account, date, dimension), plus a record of when each day was fetched.
+
+    A day needs fetching if it has never been fetched or was last fetched less than FINAL_AFTER_DAYS
+    after it ended.  Cost Explorer's Estimated flag is stored but not used for this: it covers the
+    whole open month, so honouring it would refetch every day of the month on every run.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def stale_days(self, account: str, dimension: str, start, end, today=None) -> list:
+        """
+        Return the days in [start, end) that must be fetched from Cost Explorer.
+
+        Days after today have no data yet and are never returned.
+
+        Parameters:
+        account (str): The AWS account ID.
+        dimension (str): The dimension name, see dimension_name().
+        start, end (str or date): The period, end exclusive, as in Cost Explorer.
+        today (date, optional): Override the current date, for testing.
+
+        Returns:
+        list: date objects, in order.
+        """
+        today = today or date.today()
+        start, end = parse_date(start), min(parse_date(end), today + timedelta(days=1))
+
+        fetched = {}
+        for day, fetched_at in self.connection.execute(
+                "SELECT date, fetched_at FROM fetched_days WHERE account = ? AND dimension = ? AND date >= ? AND date < ?",
+                (account, dimension, start.isoformat(), end.isoformat())):
+            fetched[day] = parse_date(fetched_at[:10])
+
+        stale = []
+        day = start
+        while day < end:
+            fetched_on = fetched.get(day.isoformat())
+            if fetched_on is None or fetched_on < day + timedelta(days=FINAL_AFTER_DAYS):
+                stale.append(day)
+            day += timedelta(days=1)
+        return stale
+
+    def stale_range(self, account: str, dimension: str, start, end, today=None):
+        """
+        Return the single (start, end) period, end exclusive, covering every stale day, or None.
+
+        Fetching one slightly larger period is cheaper than one Cost Explorer request per gap.
+        """
+        stale = self.stale_days(account, dimension, start, end, today)
+        if not stale:
+            return None
+        return stale[0], stale[-1] + timedelta(days=1)
+
+    def store_results(self, account: str, dimension: str, results_by_time: list, fetched_at: datetime = None):
+        """
+        Replace the stored costs for every day covered by Cost Explorer ResultsByTime entries.
+
+        results_by_time may be a generator streaming pages as they arrive.  A day split across pages
+        is merged, and if the iteration raises nothing from this call is kept.
+        """
+        fetched_at = (fetched_at or datetime.now()).isoformat(timespec="seconds")
+        replaced = set()
+        with self.connection:
+            for result in results_by_time:
+                day = result['TimePeriod']['Start']
+                if day not in replaced:
+                    self.connection.execute("DELETE FROM daily_costs WHERE account = ? AND dimension = ? AND date = ?",
+                                            (account, dimension, day))
+                    replaced.add(day)
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO daily_costs (account, date, dimension, key, amount, unit) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(account, day, dimension, KEY_SEPARATOR.join(group['Keys']),
+                      float(group['Metrics']['UnblendedCost']['Amount']),
+                      group['Metrics']['UnblendedCost'].get('Unit', 'USD'))
+                     for group in result.get('Groups', [])])
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO fetched_days (account, date, dimension, estimated, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                    (account, day, dimension, int(bool(result.get('Estimated'))), fetched_at))
+
+    def rows(self, account: str, dimension: str, start, end):
+        """
+        Yield (date, keys, amount, unit) for every stored group in [start, end), ordered by date.
+        """
+        cursor = self.connection.execute(
+            "SELECT date, key, amount, unit FROM daily_costs WHERE account = ? AND dimension = ? AND date >= ? AND date < ? ORDER BY date, key",
+            (account, dimension, parse_date(start).isoformat(), parse_date(end).isoformat()))
+        for day, key, amount, unit in cursor:
+            yield day, key.split(KEY_SEPARATOR), amount, unit
+
+    def results_by_time(self, account: str, dimension: str, start, end) -> list:
+        """
+        Return stored costs in [start, end) shaped like Cost Explorer's ResultsByTime list.
+        """
+        start, end = parse_date(start).isoformat(), parse_date(end).isoformat()
+        # start from the fetched days so days without any cost still appear, as they do in Cost Explorer
+        results = {}
+        for (day,) in self.connection.execute(
+                "SELECT date FROM fetched_days WHERE account = ? AND dimension = ? AND date >= ? AND date < ?",
+                (account, dimension, start, end)):
+            next_day = (parse_date(day) + timedelta(days=1)).isoformat()
+            results[day] = {'TimePeriod': {'Start': day, 'End': next_day}, 'Groups': []}
+
+        for day, keys, amount, unit in self.rows(account, dimension, start, end):
+            results[day]['Groups'].append({'Keys': keys, 'Metrics': {'UnblendedCost': {'Amount': str(amount), 'Unit': unit}}})
+        return [results[day] for day in sorted(results)]
+
+    def unit(self, account: str, dimension: str, default: str = 'USD') -> str:
+        """
+        Return the currency of an account's stored costs, as Cost Explorer reported it, or default
+        if nothing is stored.
+        """
+        row = self.connection.execute(
+            "SELECT unit FROM daily_costs WHERE account = ? AND dimension = ? ORDER BY date DESC LIMIT 1",
+            (account, dimension)).fetchone()
+        return row[0] if row else default
+
+    def accounts(self, dimension: str) -> list:
+        """
+        Return every account with stored costs for a dimension.
+        """
+        return [account for (account,) in self.connection.execute(
+            "SELECT DISTINCT account FROM fetched_days WHERE dimension = ? ORDER BY account", (dimension,))]
+
+    def baselines(self, account: str, dimension: str) -> dict:
+        """
+        Return the stored anomaly baselines as {key: (last_date, mean, variance, count)}.
+        """
+        return {key: (last_date, mean, variance, count) for key, last_date, mean, variance, count in self.connection.execute(
+            "SELECT key, last_date, mean, variance, count FROM baselines WHERE account = ? AND dimension = ?",
+            (account, dimension))}
+
+    def save_baselines(self, account: str, dimension: str, baselines: dict, anomalies: list):
+        """
+        Store updated baselines and the anomalies found while updating them, in one transaction.
+
+        Parameters:
+        baselines (dict): {key: (last_date, mean, variance, count)}.
+        anomalies (list): (date, key, amount, baseline, score) tuples.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO baselines (account, dimension, key, last_date, mean, variance, count) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(account, dimension, key, *baseline) for key, baseline in baselines.items()])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO anomalies (account, dimension, date, key, amount, baseline, score) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(account, dimension, *anomaly) for anomaly in anomalies])
+
+    def anomalies(self, account: str, dimension: str, start) -> list:
+        """
+        Return stored anomalies on or after start as (date, key, amount, baseline, score) tuples.
+        """
+        return list(self.connection.execute(
+            "SELECT date, key, amount, baseline, score FROM anomalies WHERE account = ? AND dimension = ? AND date >= ? ORDER BY date, key",
+            (account, dimension, parse_date(start).isoformat())))
+
+def get_cost_store(ctx) -> CostStore:
+    """
+    Open the cost store in the sauce cache directory.
+
+    Parameters:
+    ctx (typer.Context): The Typer context object.
+    """
+    return CostStore(os.path.join(ctx.obj["CACHE_DIR"], COST_STORE_FILE))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+# cur.py
+# Streaming aggregation of AWS Cost and Usage Report (CUR) CSV files, plain or gzipped.
+# Files are read one row at a time, so memory use depends on the number of groups, not file size.
+
+import os
+import io
+import csv
+import gzip
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+# Friendly column names and the CUR columns they map to, legacy CUR first, then CUR 2.0
+CUR_COLUMNS = {
+    'date': ['lineItem/UsageStartDate', 'line_item_usage_start_date'],
+    'service': ['product/ProductName', 'product_product_name', 'lineItem/ProductCode', 'line_item_product_code'],
+    'usage-type': ['lineItem/UsageType', 'line_item_usage_type'],
+    'operation': ['lineItem/Operation', 'line_item_operation'],
+    'resource': ['lineItem/ResourceId', 'line_item_resource_id'],
+    'account': ['lineItem/UsageAccountId', 'line_item_usage_account_id'],
+    'region': ['product/region', 'product_region_code', 'product_region'],
+    'line-item-type': ['lineItem/LineItemType', 'line_item_line_item_type'],
+}
+COST_COLUMNS = ['lineItem/UnblendedCost', 'line_item_unblended_cost']
+CURRENCY_COLUMNS = ['lineItem/CurrencyCode', 'line_item_currency_code']
+
+CUR_SUFFIXES = ('.csv', '.csv.gz')
+MANIFEST_SUFFIX = '-Manifest.json'
+
+def manifest_report_files(directory: str, manifest: str) -> list:
+    """
+    Return the local paths of the report files a CUR manifest lists in reportKeys.
+
+    The keys are S3 keys ending <assemblyId>/<file>.  A billing period's manifest sits above the
+    assembly folders, while each folder holds a copy of its own manifest, so both layouts are tried.
+    """
+    try:
+        with open(os.path.join(directory, manifest), 'r', encoding='utf-8') as file:
+            report_keys = json.load(file).get('reportKeys', [])
+    except (OSError, ValueError) as e:
+        raise ValueError(f"{os.path.join(directory, manifest)}: {e}")
+
+    files = []
+    for report_key in report_keys:
+        parts = report_key.split('/')
+        candidates = [os.path.join(directory, *parts[-2:]), os.path.join(directory, parts[-1])]
+        # a file listed but not synced is still returned, so reading it reports the problem
+        files.append(next((candidate for candidate in candidates if os.path.isfile(candidate)), candidates[0]))
+    return files
+
+def find_cur_files(path: str) -> list:
+    """
+    Return the CUR files at path: the file itself, or the .csv and .csv.gz files below a directory.
+
+    A CUR bucket keeps every version of a billing period's report in its own assemblyId folder, next
+    to a <report>-Manifest.json naming the current one.  Below a directory holding a manifest, only
+    the files listed in its reportKeys are read.  Without manifests every file found is read, so the
+    directory must then hold a single version of each billing period.
+    """
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, directories, names in os.walk(path):
+        manifests = [name for name in names if name.endswith(MANIFEST_SUFFIX)]
+        if manifests:
+            for manifest in manifests:
+                files += manifest_report_files(root, manifest)
+            # the other assembly folders hold superseded versions of the same costs
+            directories.clear()
+            continue
+        files += [os.path.join(root, name) for name in names if name.endswith(CUR_SUFFIXES)]
+    return sorted(set(files))
+
+def open_cur_file(path: str):
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+def resolve_column(header: list, name: str) -> int:
+    """
+    Return the index of a column in a CUR header.
+
+    name is a friendly name from CUR_COLUMNS, 'tag:KEY' for a user cost allocation tag, or a raw CUR
+    column name.  Raises ValueError if the file has no such column.
+    """
+    if name in CUR_COLUMNS:
+        candidates = CUR_COLUMNS[name]
+    elif name.startswith('tag:'):
+        candidates = [f"resourceTags/user:{name[4:]}", f"resource_tags_user_{name[4:].lower()}"]
+    else:
+        candidates = [name]
+
+    for candidate in candidates:
+        if candidate in header:
+            return header.index(candidate)
+    raise ValueError(f"Column {name} not found")
+
+def aggregate_cur_file(path: str, columns: list) -> tuple:
+    """
+    Sum the unblended cost of one CUR file by the given columns.
+
+    Parameters:
+    path (str): The CUR file, .csv or .csv.gz.
+    columns (list): Column names as accepted by resolve_column().  The 'date' column is cut to
+                    YYYY-MM-DD.
+
+    Returns:
+    tuple: ({key tuple: cost}, currency code, number of line items read).
+
+    Raises ValueError naming the file, and the line where there is one, if the file can't be read.
+    """
+    totals = {}
+    currency = None
+    count = 0
+    try:
+        with open_cur_file(path) as file:
+            reader = csv.reader(file)
+            header = next(reader, None)
+            if header is None:
+                return totals, currency, count
+
+            indexes = [resolve_column(header, column) for column in columns]
+            cost_index = next((header.index(column) for column in COST_COLUMNS if column in header), None)
+            if cost_index is None:
+                raise ValueError(f"{path} has no unblended cost column")
+            currency_index = next((header.index(column) for column in CURRENCY_COLUMNS if column in header), None)
+            date_positions = [position for position, column in enumerate(columns) if column == 'date']
+
+            for row in reader:
+                count += 1
+                try:
+                    key = [row[index] for index in indexes]
+                    for position in date_positions:
+                        key[position] = key[position][:10]
+                    key = tuple(key)
+                    totals[key] = totals.get(key, 0.0) + float(row[cost_index] or 0)
+                    if currency is None and currency_index is not None:
+                        currency = row[currency_index] or None
+                except IndexError:
+                    raise ValueError(f"{path}, line {reader.line_num}: {len(row)} columns, the header has {len(header)}")
+                except ValueError as e:
+                    raise ValueError(f"{path}, line {reader.line_num}: {e}")
+    except (csv.Error, OSError, EOFError, UnicodeDecodeError) as e:
+        # a corrupt or truncated gzip file, a malformed CSV row, or a file that isn't text
+        raise ValueError(f"{path}: {e}")
+
+    return totals, currency, count
+
+def aggregate_cur_files(paths: list, columns: list, workers: int = None) -> tuple:
+    """
+    Aggregate several CUR files in parallel, one file per worker process, and merge the results.
+
+    Returns:
+    tuple: ({key tuple: cost}, currency code, number of line items read).
+    """
+    totals = {}
+    currency = None
+    count = 0
+    if not paths:
+        return totals, currency, count
+
+    workers = min(len(paths), workers or os.cpu_count() or 1)
+    if workers == 1:
+        results = (aggregate_cur_file(path, columns) for path in paths)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(aggregate_cur_file, paths, [columns] * len(paths))
+
+    try:
+        for file_totals, file_currency, file_count in results:
+            for key, cost in file_totals.items():
+                totals[key] = totals.get(key, 0.0) + cost
+            currency = currency or file_currency
+            count += file_count
+    finally:
+        if workers > 1:
+            executor.shutdown()
+
+    return totals, currency, count
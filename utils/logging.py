@@ -1,18 +1,270 @@
 #!/usr/bin/env python3
 
 import os
+import re
+import gzip
+import lzma
+import json
+import time
+import queue
+import atexit
+import random
+import shutil
 import logging
-from logging.handlers import RotatingFileHandler
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
 
-def setup_logging(log_dir, log_level=logging.INFO):
+# The background writer shared by all sauce loggers, and the directory it writes to.
+# setup_logging() is a no-op while these are set for the same directory.
+_listener = None
+_queue_handlers = {}
+_log_dir = None
+# Single background thread that compresses rotated logs and enforces retention
+_compressor = None
+
+# Rotation and retention defaults, overridden from the [logging] section of the config
+DEFAULT_MAX_BYTES = 10485760
+DEFAULT_COMPRESSION = "gzip"
+DEFAULT_RETAIN_BYTES = 52428800
+DEFAULT_RETAIN_DAYS = 30
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "xz": ".xz", "none": ""}
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    A QueueHandler that leaves formatting to the writer thread.
+
+    The stock QueueHandler formats every record in the calling thread so it can be pickled.  The
+    queue here never leaves the process, so records are passed through as they are and message
+    arguments are only interpolated by the file handlers on the listener thread.  Arguments must
+    therefore not be mutated after they are logged.
+    """
+    def prepare(self, record):
+        return record
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format json logger records as one JSON object per line.
+
+    The record message becomes the 'type' field and the 'payload' dict passed in extra= is merged
+    in.  A bytes 'body' in the payload is decoded here, on the writer thread: as JSON if it parses,
+    otherwise as text.
+    """
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "type": record.getMessage()
+        }
+        payload = getattr(record, "payload", None)
+        if payload:
+            entry.update(payload)
+            if isinstance(entry.get("body"), bytes):
+                entry["body"] = decode_body(entry["body"])
+        return json.dumps(entry, default=str)
+
+def decode_body(body: bytes):
+    """
+    Return a response body as parsed JSON where possible, otherwise as text.
+    """
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode("utf-8", errors="replace")
+
+class AwsResponseLogger:
+    """
+    Log raw AWS responses to the json logger as JSON Lines records.
+
+    Each record carries the operation, region, request ID, status, latency and size of the call.
+    Calls are sampled at sample_rate and bodies are cut to max_bytes so large listings don't
+    swamp the log.  Only the raw bytes are captured on the calling thread; decoding and
+    serialization happen on the logging thread.
+    """
+    def __init__(self, sample_rate: float = 1.0, max_bytes: int = 65536):
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+
+    def register(self, session):
+        session.events.register("before-call", self.before_call)
+        session.events.register("after-call", self.after_call)
+
+    def before_call(self, context, **kwargs):
+        context["sauce_json_start"] = time.perf_counter()
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        logger = logging.getLogger('json')
+        if not logger.isEnabledFor(logging.INFO) or random.random() >= self.sample_rate:
+            return
+
+        latency_ms = (time.perf_counter() - context.get("sauce_json_start", time.perf_counter())) * 1000
+        # streaming bodies belong to the caller and haven't been read yet
+        body = b"" if model.has_streaming_output else (http_response.content or b"")
+
+        logger.info("response", extra={"payload": {
+            "service": model.service_model.service_name,
+            "operation": model.name,
+            "region": context.get("client_region"),
+            "request_id": parsed.get("ResponseMetadata", {}).get("RequestId"),
+            "status": http_response.status_code,
+            "latency_ms": round(latency_ms, 1),
+            "bytes": len(body),
+            "truncated": len(body) > self.max_bytes,
+            "body": body[:self.max_bytes]
+        }})
+
+def list_log_segments(log_dir: str, filename: str) -> list:
+    """
+    Return the rotated segments of a log file, oldest first.
+
+    Segments are named <filename>.<timestamp>[.gz|.xz].  Numbered backups from older versions of
+    sauce (<filename>.1 and so on) are included too.  The active log file is not.
+
+    Args:
+    log_dir (str): The log directory.
+    filename (str): The base log file name, e.g. 'debug.log'.
+
+    Returns:
+        list: Full paths of the segments.
+    """
+    pattern = re.compile(rf"^{re.escape(filename)}\.(\d+|\d{{8}}T\d{{12}})(\.gz|\.xz)?$")
+    try:
+        names = [name for name in os.listdir(log_dir) if pattern.match(name)]
+    except OSError:
+        return []
+
+    def age_key(name):
+        # timestamped segments sort by name; legacy numbered backups are older, highest number first
+        suffix = pattern.match(name).group(1)
+        return (1, suffix, 0) if "T" in suffix else (0, "", -int(suffix))
+
+    return [os.path.join(log_dir, name) for name in sorted(names, key=age_key)]
+
+def open_log_segment(path: str):
+    """
+    Open a log segment for streaming text reads, decompressing on the fly if needed.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", errors="replace")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rt", errors="replace")
+    return open(path, "r", errors="replace")
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """
+    A RotatingFileHandler that hands rotated files to a background thread for compression.
+
+    Rollover only renames the full log to <filename>.<timestamp>, so the writer thread is never
+    held up by compression.  The background job compresses the segment, then deletes the oldest
+    segments until they fit in retain_bytes and none is older than retain_days.
+    """
+    def __init__(self, filename, maxBytes=DEFAULT_MAX_BYTES, compression=DEFAULT_COMPRESSION,
+                 retain_bytes=DEFAULT_RETAIN_BYTES, retain_days=DEFAULT_RETAIN_DAYS, compressor=None):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unsupported log compression: {compression}. Use one of {list(COMPRESSION_SUFFIXES)}")
+        super().__init__(filename, maxBytes=maxBytes, backupCount=0)
+        self.compression = compression
+        self.retain_bytes = retain_bytes
+        self.retain_days = retain_days
+        self.compressor = compressor
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if os.path.exists(self.baseFilename):
+            segment = f"{self.baseFilename}.{datetime.now().strftime('%Y%m%dT%H%M%S%f')}"
+            os.rename(self.baseFilename, segment)
+            try:
+                if self.compressor is None:
+                    raise RuntimeError("no compressor")
+                self.compressor.submit(self.compress_and_prune, segment)
+            except RuntimeError:
+                # no background thread, or the interpreter is shutting down and won't start jobs
+                self.compress_and_prune(segment)
+
+        if not self.delay:
+            self.stream = self._open()
+
+    def compress_and_prune(self, segment: str):
+        try:
+            suffix = COMPRESSION_SUFFIXES[self.compression]
+            if suffix:
+                opener = gzip.open if self.compression == "gzip" else lzma.open
+                with open(segment, "rb") as source, opener(f"{segment}.tmp", "wb") as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                os.replace(f"{segment}.tmp", f"{segment}{suffix}")
+                os.remove(segment)
+            self.prune()
+        except OSError as e:
+            # never let housekeeping take logging down; try again at the next rollover.  This runs
+            # inside the logging pipeline, so report straight to stderr rather than through a logger
+            print(f"Error compressing log segment {segment}: {e}", file=sys.stderr)
+
+    def prune(self):
+        log_dir, filename = os.path.split(self.baseFilename)
+        cutoff = time.time() - self.retain_days * 86400
+        total = 0
+
+        # walk newest to oldest, keeping segments until the size or age limit is reached.  Segments
+        # still waiting to be compressed are left to their own job
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        for path in reversed(list_log_segments(log_dir, filename)):
+            if suffix and "T" in os.path.basename(path)[len(filename):] and not path.endswith(suffix):
+                continue
+            stat = os.stat(path)
+            total += stat.st_size
+            if total > self.retain_bytes or stat.st_mtime < cutoff:
+                os.remove(path)
+
+def stop_logging():
+    """
+    Flush queued records and stop the background writer.  Safe to call more than once.
+    """
+    global _listener, _log_dir, _compressor
+    if _listener is None:
+        return
+
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    # let any compression in progress finish so no half-written segments are left behind
+    _compressor.shutdown(wait=True)
+    _compressor = None
+    for name, handler in _queue_handlers.items():
+        logging.getLogger(name).removeHandler(handler)
+    _queue_handlers.clear()
+    _listener = None
+    _log_dir = None
+
+def setup_logging(log_dir, log_level=logging.INFO, debug_level=logging.DEBUG, max_bytes=DEFAULT_MAX_BYTES,
+                  compression=DEFAULT_COMPRESSION, retain_bytes=DEFAULT_RETAIN_BYTES, retain_days=DEFAULT_RETAIN_DAYS):
     """
     Set up logging for the application.
 
+    Records are put on an in-memory queue and written to rotating log files by a background
+    thread.  Rotated files are compressed by a second background thread.  Calling this again
+    with the same directory does nothing, so handlers are never added twice.
+
     Args:
     log_dir (str): Directory where log files will be stored.
     log_level (int): Logging level. Default is logging.INFO.
+    debug_level (int): Level of the debug and json logs. Default is logging.DEBUG; raise it to
+                       disable debug logging entirely.
+    max_bytes (int): Size at which a log file is rotated.
+    compression (str): Compression for rotated files: 'gzip', 'xz' or 'none'.
+    retain_bytes (int): Total size of rotated files kept per log.
+    retain_days (int): Age after which rotated files are deleted.
     """
+    global _listener, _log_dir, _compressor
+    if _listener is not None:
+        if _log_dir == log_dir:
+            return
+        stop_logging()
+
     if not os.path.exists(log_dir):
         try:
             os.makedirs(log_dir)
@@ -21,7 +273,7 @@ def setup_logging(log_dir, log_level=logging.INFO):
 
     # Configure loggers
     loggers = {
-        # log commands 
+        # log commands
         'cmdline': {
             'filename': 'cmdline.log',
             'level': log_level,
@@ -35,26 +287,44 @@ def setup_logging(log_dir, log_level=logging.INFO):
         # debug log
         'debug': {
             'filename': 'debug.log',
-            'level': logging.DEBUG,
+            'level': debug_level,
             'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         },
-        # log json from AWS, etc.
+        # log json from AWS, etc.  One JSON object per line
         'json': {
             'filename': 'json.log',
-            'level': logging.DEBUG,
-            'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            'level': debug_level,
+            'formatter': JsonLinesFormatter()
         }
     }
 
+    _compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sauce-logcompress")
+    log_queue = queue.SimpleQueue()
+    file_handlers = []
     for key, value in loggers.items():
-        handler = RotatingFileHandler(os.path.join(log_dir, value['filename']), maxBytes=10485760, backupCount=5)
+        handler = CompressingRotatingFileHandler(os.path.join(log_dir, value['filename']), maxBytes=max_bytes,
+                                                 compression=compression, retain_bytes=retain_bytes,
+                                                 retain_days=retain_days, compressor=_compressor)
         handler.setLevel(value['level'])
-        formatter = logging.Formatter(value['format'])
+        formatter = value.get('formatter') or logging.Formatter(value['format'])
         handler.setFormatter(formatter)
+        # the listener hands every record to every handler, so each file only accepts its own logger
+        handler.addFilter(logging.Filter(key))
+        file_handlers.append(handler)
+
+        # the level is set on the logger so disabled calls return before a record is created
+        queue_handler = DeferredQueueHandler(log_queue)
         logger = logging.getLogger(key)
         logger.setLevel(value['level'])
-        logger.addHandler(handler)
+        logger.addHandler(queue_handler)
         logger.propagate = False
+        _queue_handlers[key] = queue_handler
+
+    _listener = QueueListener(log_queue, *file_handlers, respect_handler_level=True)
+    _listener.start()
+    _log_dir = log_dir
+
+atexit.register(stop_logging)
 
 def get_loggers():
     """
@@ -65,6 +335,7 @@ def get_loggers():
     """
     return {
         'cmdline': logging.getLogger('cmdline'),
+        'error': logging.getLogger('error'),
         'debug': logging.getLogger('debug'),
         'json': logging.getLogger('json')
     }
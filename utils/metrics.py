@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# metrics.py
+# Batched CloudWatch GetMetricData and text sparklines for summarising the results.
+
+from datetime import datetime, timedelta, timezone
+
+# GetMetricData takes at most this many queries per call
+MAX_METRIC_DATA_QUERIES = 500
+SPARKLINE_CHARS = "▁▂▃▄▅▆▇█"
+
+def metric_window(hours: int, period: int, now: datetime = None) -> tuple:
+    """
+    Return the (start, end) of the last hours, with end rounded down to a whole period.
+
+    Rounding keeps the window, and so any cache key built from it, stable within a period.
+    """
+    now = now or datetime.now(timezone.utc)
+    end = datetime.fromtimestamp(int(now.timestamp()) // period * period, timezone.utc)
+    return end - timedelta(hours=hours), end
+
+def get_metric_data(client, queries: list, start: datetime, end: datetime) -> dict:
+    """
+    Run any number of metric data queries, packing up to MAX_METRIC_DATA_QUERIES into each call.
+
+    :param client: A CloudWatch client.
+    :param queries: MetricDataQueries entries, each with a unique Id.
+    :param start: The start of the window.
+    :param end: The end of the window.
+    :return: A dictionary of query Id -> [(timestamp, value), ...] in ascending time order.
+    """
+    results = {query['Id']: [] for query in queries}
+    for offset in range(0, len(queries), MAX_METRIC_DATA_QUERIES):
+        args = {
+            'MetricDataQueries': queries[offset:offset + MAX_METRIC_DATA_QUERIES],
+            'StartTime': start,
+            'EndTime': end,
+            'ScanBy': 'TimestampAscending'
+        }
+        while True:
+            response = client.get_metric_data(**args)
+            for result in response.get('MetricDataResults', []):
+                results[result['Id']] += zip(result.get('Timestamps', []), result.get('Values', []))
+            token = response.get('NextToken')
+            if not token:
+                break
+            args['NextToken'] = token
+    return results
+
+def sparkline(points: list, start: datetime, end: datetime, width: int = 12, low: float = None, high: float = None) -> str:
+    """
+    Draw (timestamp, value) points as a sparkline of width characters spanning start to end.
+
+    Each character shows the mean of the points in its slice of the window; slices without points
+    are blank.  The scale runs from low to high, by default the smallest and largest slice means.
+    """
+    if not points:
+        return ""
+    span = (end - start).total_seconds()
+    buckets = [[] for _ in range(width)]
+    for timestamp, value in points:
+        position = int((timestamp - start).total_seconds() / span * width)
+        buckets[min(max(position, 0), width - 1)].append(value)
+
+    means = [sum(bucket) / len(bucket) if bucket else None for bucket in buckets]
+    present = [mean for mean in means if mean is not None]
+    low = min(present) if low is None else low
+    high = max(present) if high is None else high
+    scale = (len(SPARKLINE_CHARS) - 1) / (high - low) if high > low else 0
+
+    return "".join(" " if mean is None else SPARKLINE_CHARS[min(max(int((mean - low) * scale), 0), len(SPARKLINE_CHARS) - 1)]
+                   for mean in means)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# profiling.py
+# CPU (cProfile) and memory (tracemalloc) profiling of a single subcommand run.
+# Enabled with --profile-cpu and --profile-mem.
+
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+from utils.logging import get_loggers
+
+# Number of functions/allocation sites listed in the text reports
+PROFILE_TOP_N = 25
+
+# Buckets used to attribute CPU time.  The first matching fragment of a code path wins.
+TIME_CATEGORIES = [
+    ("import", ["<frozen importlib", "importlib/"]),
+    ("aws", ["/botocore/", "/boto3/", "/urllib3/", "/s3transfer/", "/ssl.py", "/socket.py", "/http/client.py"]),
+    ("SauceData", ["/SauceData/"]),
+    ("tabulate", ["/tabulate"]),
+    ("logging", ["/logging/"]),
+]
+
+def categorize(filename: str) -> str:
+    """
+    Return the TIME_CATEGORIES bucket a code path belongs to.
+
+    :param filename: The filename from a pstats entry.
+    :return: The category name, 'sauce' for code in this project, or 'other'.
+    """
+    for category, fragments in TIME_CATEGORIES:
+        if any(fragment in filename for fragment in fragments):
+            return category
+    if filename.startswith(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))):
+        return "sauce"
+    return "other"
+
+def resolve_category(entries: dict, function: tuple, resolved: dict, depth: int = 0) -> str:
+    """
+    Return the category of a pstats entry, charging stdlib and builtin functions to their caller.
+
+    json decoding called from botocore's model loader counts as AWS time, for example.
+
+    :param entries: The pstats stats dictionary.
+    :param function: The (filename, line, name) key of the entry.
+    :param resolved: Memo of already resolved entries, shared between calls.
+    :param depth: Recursion depth, used to stop on deep or cyclic call chains.
+    :return: The category name.
+    """
+    if function in resolved:
+        return resolved[function]
+
+    category = categorize(function[0])
+    if category == "other" and depth < 20:
+        # follow the caller that spent the most time in this function
+        callers = entries.get(function, (0, 0, 0, 0, {}))[4]
+        if callers:
+            caller = max(callers.items(), key=lambda item: item[1][2])[0]
+            resolved[function] = "other"  # guards against recursion through call cycles
+            category = resolve_category(entries, caller, resolved, depth + 1)
+
+    resolved[function] = category
+    return category
+
+class CommandProfiler:
+    """
+    Profile a subcommand and write the reports to the log directory.
+
+    Reports are named <logdir>/profiles/<timestamp>-<command>.* and start with the command line,
+    matching the entry written to the cmdline log.
+
+    cProfile only sees the thread that enables it before Python 3.12, so threads started while
+    profiling (the run_concurrently workers) get a profiler of their own, merged into the report.
+    """
+    def __init__(self, log_dir: str, command: str, command_line: str, cpu: bool = False, mem: bool = False,
+                 startup_seconds: float = 0.0):
+        self.directory = os.path.join(log_dir, "profiles")
+        self.command_line = command_line
+        self.prefix = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{command or 'sauce'}"
+        self.cpu = cpu
+        self.mem = mem
+        self.startup_seconds = startup_seconds
+        self.profiler = cProfile.Profile() if cpu else None
+        self.thread_profilers = []
+        self.lock = threading.Lock()
+        self.started = None
+
+    def _profile_thread(self, frame, event, arg):
+        # installed by threading.setprofile, so this runs once at the start of each new thread and
+        # replaces itself with a cProfile profiler for that thread
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.thread_profilers.append(profiler)
+        profiler.enable()
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mem:
+            tracemalloc.start()
+        if self.cpu:
+            # from 3.12 cProfile uses sys.monitoring, which already covers every thread
+            if sys.version_info < (3, 12):
+                threading.setprofile(self._profile_thread)
+            self.profiler.enable()
+
+    def stop(self):
+        """
+        Stop profiling and write the reports.
+
+        :return: A list of the report files written.
+        """
+        if self.cpu:
+            self.profiler.disable()
+            threading.setprofile(None)
+        elapsed = time.perf_counter() - self.started
+        os.makedirs(self.directory, exist_ok=True)
+
+        written = []
+        if self.cpu:
+            written += self._write_cpu_reports(elapsed)
+        if self.mem:
+            written.append(self._write_mem_report())
+            tracemalloc.stop()
+
+        cmdline_logger = get_loggers()["cmdline"]
+        for filename in written:
+            cmdline_logger.info("Profile written to %s", filename)
+        return written
+
+    def _header(self, elapsed: float = None) -> str:
+        header = f"Command Line: {self.command_line}\n"
+        header += f"Startup before profiling (imports, config): {self.startup_seconds * 1000:.1f} ms\n"
+        if elapsed is not None:
+            header += f"Profiled wall time: {elapsed * 1000:.1f} ms\n"
+        return header + "\n"
+
+    def _write_cpu_reports(self, elapsed: float) -> list:
+        pstats_file = os.path.join(self.directory, f"{self.prefix}.pstats")
+        text_file = os.path.join(self.directory, f"{self.prefix}.cpu.txt")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, *self.thread_profilers, stream=stream)
+        stats.dump_stats(pstats_file)
+
+        # attribute own (not cumulative) time to each bucket so nothing is counted twice
+        categories = {}
+        resolved = {}
+        for function, (_, _, own_time, _, _) in stats.stats.items():
+            category = resolve_category(stats.stats, function, resolved)
+            categories[category] = categories.get(category, 0.0) + own_time
+
+        with open(text_file, "w") as file:
+            file.write(self._header(elapsed))
+            file.write("CPU time by area:\n")
+            for category, seconds in sorted(categories.items(), key=lambda item: item[1], reverse=True):
+                file.write(f"  {category:<12} {seconds * 1000:10.1f} ms\n")
+            file.write("\n")
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+            stats.sort_stats("tottime").print_stats(PROFILE_TOP_N)
+            file.write(stream.getvalue())
+
+        return [pstats_file, text_file]
+
+    def _write_mem_report(self) -> str:
+        text_file = os.path.join(self.directory, f"{self.prefix}.mem.txt")
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+
+        with open(text_file, "w") as file:
+            file.write(self._header())
+            file.write(f"Traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n\n")
+
+            file.write(f"Top {PROFILE_TOP_N} allocation sites by size:\n")
+            for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+                file.write(f"  {stat}\n")
+
+            file.write(f"\nTop {PROFILE_TOP_N} files by size:\n")
+            for stat in snapshot.statistics("filename")[:PROFILE_TOP_N]:
+                file.write(f"  {stat}\n")
+
+        return text_file
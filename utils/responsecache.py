@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# responsecache.py
+# Short-lived on-disk cache of AWS results, for data that is slow or costly to fetch but fine to
+# show a few minutes old, e.g. CloudWatch metrics.  Entries are keyed on a hash of the request.
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+RESPONSE_CACHE_FILE = "responses.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    value TEXT NOT NULL
+);
+"""
+
+def request_key(namespace: str, params) -> str:
+    """
+    Return the cache key of a request: a hash of the namespace and JSON-encoded params.
+    """
+    encoded = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(f"{namespace}:{encoded}".encode()).hexdigest()
+
+class ResponseCache:
+    """
+    JSON values with an expiry time, keyed by namespace and request parameters.
+
+    Only use from one thread; fetch concurrently and read or write the cache on the calling thread.
+    """
+    def __init__(self, path: str, stats=None):
+        self.path = path
+        self.stats = stats
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, namespace: str, params):
+        """
+        Return the cached value for a request, or None if there is none or it has expired.
+
+        :param namespace: The kind of request, e.g. 'cloudwatch-metrics'.  Hits are recorded in the
+                          --stats output under this name.
+        :param params: The request parameters; anything JSON-serialisable.
+        """
+        row = self.connection.execute("SELECT value FROM responses WHERE key = ? AND expires_at > ?",
+                                      (request_key(namespace, params), time.time())).fetchone()
+        if row is None:
+            return None
+        if self.stats:
+            self.stats.record_cache_hit(namespace)
+        return json.loads(row[0])
+
+    def put(self, namespace: str, params, value, ttl: float):
+        """
+        Cache a value for ttl seconds, dropping any entries that have expired.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, namespace, expires_at, value) VALUES (?, ?, ?, ?)",
+                                    (request_key(namespace, params), namespace, now + ttl, json.dumps(value, default=str)))
+
+def get_response_cache(ctx):
+    """
+    Open the response cache in the sauce cache directory.
+
+    Returns None when replaying, so fixture data never mixes with real responses.
+
+    :param ctx: The Typer context object.
+    """
+    if ctx.obj.get("AWS_REPLAY") or not ctx.obj.get("CACHE_DIR"):
+        return None
+    return ResponseCache(os.path.join(ctx.obj["CACHE_DIR"], RESPONSE_CACHE_FILE), ctx.obj.get("STATS"))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# stats.py
+# Per-operation AWS call statistics, collected from botocore events.  Enabled with --stats.
+
+import time
+import bisect
+import threading
+import typer
+
+from utils.logging import get_loggers
+from SauceData.handler import SauceData
+
+# Upper bounds, in milliseconds, of the latency histogram buckets.  The last bucket is unbounded.
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Error codes AWS uses to signal throttling
+THROTTLE_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "SlowDown",
+    "LimitExceededException",
+}
+
+class OperationStats:
+    """
+    Counters for a single service operation.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.bytes = 0
+        self.latencies = []
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add_latency(self, latency_ms: float):
+        self.latencies.append(latency_ms)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+
+    def percentile(self, pct: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def to_dict(self) -> dict:
+        total = sum(self.latencies)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "throttles": self.throttles,
+            "bytes": self.bytes,
+            "total_ms": round(total, 1),
+            "mean_ms": round(total / len(self.latencies), 1) if self.latencies else 0.0,
+            "p50_ms": round(self.percentile(50), 1),
+            "p95_ms": round(self.percentile(95), 1),
+            "max_ms": round(max(self.latencies), 1) if self.latencies else 0.0,
+            "histogram": dict(zip([f"<={b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"], self.histogram))
+        }
+
+class ApiStats:
+    """
+    Collect per-operation call counts, latencies, retries, throttles and bytes received.
+
+    Register with a boto3 session before any clients are created from it.  Cache lookups that
+    avoid an AWS call entirely are recorded with record_cache_hit().
+    """
+    def __init__(self):
+        self.operations = {}
+        self.cache_hits = {}
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def register(self, session):
+        session.events.register("before-call", self.before_call)
+        session.events.register("needs-retry", self.needs_retry)
+        session.events.register("after-call", self.after_call)
+        session.events.register("after-call-error", self.after_call_error)
+
+    def _operation(self, model) -> OperationStats:
+        # callers must hold self.lock
+        name = f"{model.service_model.service_name}.{model.name}"
+        if name not in self.operations:
+            self.operations[name] = OperationStats()
+        return self.operations[name]
+
+    def before_call(self, model, context, **kwargs):
+        context["sauce_stats_start"] = time.perf_counter()
+        context["sauce_stats_model"] = model
+
+    def needs_retry(self, response, operation, **kwargs):
+        # called once per attempt, so throttled attempts that later succeed are still counted
+        if response is None:
+            return
+        error_code = response[1].get("Error", {}).get("Code")
+        if error_code in THROTTLE_CODES:
+            with self.lock:
+                self._operation(operation).throttles += 1
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        latency_ms = (time.perf_counter() - context.get("sauce_stats_start", time.perf_counter())) * 1000
+
+        # don't touch the body of streaming responses, it hasn't been read yet
+        length = http_response.headers.get("Content-Length")
+        if length is None and not model.has_streaming_output:
+            length = len(http_response.content or b"")
+
+        with self.lock:
+            stats = self._operation(model)
+            stats.calls += 1
+            stats.add_latency(latency_ms)
+            stats.bytes += int(length or 0)
+            stats.retries += parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+            if http_response.status_code >= 300:
+                stats.errors += 1
+
+    def after_call_error(self, context, **kwargs):
+        # connection errors and the like never produce an after-call event
+        if "sauce_stats_model" not in context:
+            return
+        latency_ms = (time.perf_counter() - context["sauce_stats_start"]) * 1000
+        with self.lock:
+            stats = self._operation(context["sauce_stats_model"])
+            stats.calls += 1
+            stats.errors += 1
+            stats.add_latency(latency_ms)
+
+    def record_cache_hit(self, name: str):
+        """
+        Record a lookup that was answered from a local cache instead of AWS.
+
+        :param name: The name of the cache, e.g. 'identity'.
+        """
+        with self.lock:
+            self.cache_hits[name] = self.cache_hits.get(name, 0) + 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "elapsed_ms": round((time.perf_counter() - self.started) * 1000, 1),
+                "operations": {name: stats.to_dict() for name, stats in sorted(self.operations.items())},
+                "cache_hits": dict(self.cache_hits)
+            }
+
+    def summary(self) -> SauceData:
+        """
+        Return the statistics as a SauceData table, slowest operations first.
+        """
+        record = self.to_dict()
+        data = SauceData(data=[])
+        for name, stats in record["operations"].items():
+            data.append({
+                "Operation": name,
+                "Calls": stats["calls"],
+                "Total ms": stats["total_ms"],
+                "Mean ms": stats["mean_ms"],
+                "p50 ms": stats["p50_ms"],
+                "p95 ms": stats["p95_ms"],
+                "Max ms": stats["max_ms"],
+                "Errors": stats["errors"],
+                "Retries": stats["retries"],
+                "Throttles": stats["throttles"],
+                "Bytes": stats["bytes"]
+            })
+        for name, hits in record["cache_hits"].items():
+            data.append({"Operation": f"cache:{name}", "Calls": hits, "Total ms": 0.0})
+        data.sort_data([("Total ms", "desc")])
+        data.mincol = 1
+        return data
+
+    def report(self, output_format: str = "table"):
+        """
+        Write the statistics to stderr as a table, or to the json logger as a single record.
+
+        :param output_format: 'table' or 'json'.
+        """
+        if output_format == "json":
+            get_loggers()["json"].info("stats", extra={"payload": self.to_dict()})
+            return
+
+        record = self.to_dict()
+        typer.echo(f"AWS calls: {sum(op['calls'] for op in record['operations'].values())}, elapsed {record['elapsed_ms']} ms", err=True)
+        typer.echo(self.summary(), err=True)
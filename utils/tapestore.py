@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# tapestore.py
+# Local SQLite inventory of VTL tapes, kept up to date by `sauce tapes sync` and queried by
+# `listvtltapes --cached` and `--where`.
+
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+from utils.utilities import convert_size_to_bytes
+
+TAPE_STORE_FILE = "tapes.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tapes (
+    arn TEXT PRIMARY KEY,
+    barcode TEXT NOT NULL,
+    region TEXT,
+    gateway_arn TEXT,
+    gateway_id TEXT,
+    status TEXT,
+    created TEXT,
+    size INTEGER,
+    used INTEGER,
+    pool_id TEXT,
+    worm INTEGER,
+    pool_entry_date TEXT,
+    synced_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tapes_barcode ON tapes (barcode);
+CREATE INDEX IF NOT EXISTS tapes_gateway ON tapes (gateway_id);
+CREATE INDEX IF NOT EXISTS tapes_status ON tapes (status);
+"""
+
+# --where fields and the columns they query
+WHERE_FIELDS = {
+    "barcode": "barcode",
+    "arn": "arn",
+    "region": "region",
+    "gateway": "gateway_id",
+    "status": "status",
+    "pool": "pool_id",
+    "created": "created",
+    "entered": "pool_entry_date",
+    "size": "size",
+    "used": "used",
+    "worm": "worm",
+}
+SIZE_FIELDS = ("size", "used")
+WHERE_CLAUSE = re.compile(r"^\s*(\w+)\s*(!=|<=|>=|=|<|>|~)\s*(.*?)\s*$")
+SIZE_VALUE = re.compile(r"^([\d.]+)\s*([kmgtpe]i?b)?$", re.IGNORECASE)
+
+def to_iso(value) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def parse_where(expression: str) -> tuple:
+    """
+    Turn a --where expression into an SQL condition and its parameters.
+
+    Clauses are joined with 'and' or commas.  Each is FIELD OP VALUE, where FIELD is one of
+    WHERE_FIELDS and OP is =, !=, <, <=, >, >= or ~ (shell-style wildcards, e.g. barcode~SYN01*).
+    Sizes accept units, e.g. used>50GiB.  Dates compare as ISO strings, e.g. entered<2024-01-01.
+
+    Raises:
+    ValueError: If a clause can't be parsed.
+    """
+    conditions = []
+    params = []
+    for clause in re.split(r",|\s+and\s+", expression, flags=re.IGNORECASE):
+        if not clause.strip():
+            continue
+        match = WHERE_CLAUSE.match(clause)
+        if not match or match.group(1).lower() not in WHERE_FIELDS:
+            raise ValueError(f"Can't parse --where clause '{clause.strip()}'. Fields: {', '.join(WHERE_FIELDS)}")
+        field, operator, value = match.group(1).lower(), match.group(2), match.group(3).strip("'\"")
+        column = WHERE_FIELDS[field]
+
+        if field in SIZE_FIELDS:
+            size = SIZE_VALUE.match(value)
+            if not size:
+                raise ValueError(f"Invalid size in --where: {value}")
+            value = int(convert_size_to_bytes(float(size.group(1)), size.group(2)) if size.group(2) else float(size.group(1)))
+        elif field == "worm":
+            value = int(value.lower() in ("1", "true", "yes"))
+
+        if operator == "~":
+            conditions.append(f"{column} GLOB ?")
+        else:
+            conditions.append(f"{column} {operator} ?")
+        params.append(value)
+
+    return " AND ".join(conditions) or "1", params
+
+class TapeStore:
+    """
+    Tapes keyed by ARN and indexed by barcode, gateway and status.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def states(self) -> dict:
+        """
+        Return {arn: (status, pool entry date, gateway ARN)} for every stored tape.
+        """
+        return {arn: (status, pool_entry_date, gateway_arn) for arn, status, pool_entry_date, gateway_arn in
+                self.connection.execute("SELECT arn, status, pool_entry_date, gateway_arn FROM tapes")}
+
+    def upsert(self, rows: list, synced_at: datetime = None):
+        """
+        Store tape rows as built by listvtltapes.tape_row().
+        """
+        synced_at = (synced_at or datetime.now()).isoformat(timespec="seconds")
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO tapes (arn, barcode, region, gateway_arn, gateway_id, status, created, size, used, "
+                "pool_id, worm, pool_entry_date, synced_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(row['TapeARN'], row['TapeBarcode'], row['TapeARN'].split(':')[3], row['GatewayARN'],
+                  row['GatewayARN'].split('/')[-1] if row['GatewayARN'] else None, row['TapeStatus'],
+                  to_iso(row['TapeCreatedDate']), row['TapeSizeInBytes'], row['TapeUsedInBytes'], row['PoolId'],
+                  None if row['Worm'] is None else int(row['Worm']), to_iso(row['PoolEntryDate']), synced_at)
+                 for row in rows])
+
+    def delete(self, arns):
+        with self.connection:
+            self.connection.executemany("DELETE FROM tapes WHERE arn = ?", [(arn,) for arn in arns])
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM tapes").fetchone()[0]
+
+    def query(self, where: str = None):
+        """
+        Yield stored tapes matching a --where expression as listvtltapes rows, ordered by barcode.
+        """
+        condition, params = parse_where(where or "")
+        cursor = self.connection.execute(
+            "SELECT barcode, created, size, status, used, pool_id, worm, pool_entry_date, gateway_arn, arn "
+            f"FROM tapes WHERE {condition} ORDER BY barcode", params)
+        for barcode, created, size, status, used, pool_id, worm, pool_entry_date, gateway_arn, arn in cursor:
+            yield {
+                'TapeBarcode': barcode,
+                'TapeCreatedDate': created,
+                'TapeSizeInBytes': size,
+                'TapeStatus': status,
+                'TapeUsedInBytes': used,
+                'PoolId': pool_id,
+                'Worm': None if worm is None else bool(worm),
+                'PoolEntryDate': pool_entry_date,
+                'GatewayARN': gateway_arn,
+                'TapeARN': arn
+            }
+
+def get_tape_store(ctx) -> TapeStore:
+    """
+    Open the tape inventory in the sauce cache directory.
+
+    Parameters:
+    ctx (typer.Context): The Typer context object.
+    """
+    return TapeStore(os.path.join(ctx.obj["CACHE_DIR"], TAPE_STORE_FILE))
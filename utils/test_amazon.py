@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+import boto3
+from botocore.stub import Stubber
+
+from utils.amazon import AwsRecorder, AwsReplayer
+
+GATEWAY_ARN = "arn:aws:storagegateway:us-east-1:111122223333:gateway/sgw-12345678"
+TAPE_ARN = "arn:aws:storagegateway:us-east-1:111122223333:tape/TAPE0001"
+
+def make_session(hook):
+    session = boto3.Session(region_name="us-east-1", aws_access_key_id="testing", aws_secret_access_key="testing")
+    hook.register(session)
+    return session
+
+def describe_response(status, created):
+    return {'Tapes': [{'TapeARN': TAPE_ARN, 'TapeBarcode': "TAPE0001", 'TapeStatus': status, 'TapeCreatedDate': created}]}
+
+class TestRecordReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.directory = self.tmpdir.name
+
+    def record(self, responses):
+        """
+        Make describe_tapes calls against a stubbed client with an AwsRecorder on its session.
+        """
+        client = make_session(AwsRecorder(self.directory)).client("storagegateway")
+        with Stubber(client) as stubber:
+            for response in responses:
+                stubber.add_response("describe_tapes", response, {'GatewayARN': GATEWAY_ARN, 'TapeARNs': [TAPE_ARN]})
+            return [client.describe_tapes(GatewayARN=GATEWAY_ARN, TapeARNs=[TAPE_ARN]) for _ in responses]
+
+    def test_replay_returns_the_recorded_responses(self):
+        created = datetime(2024, 3, 1, 12, 30, tzinfo=timezone.utc)
+        recorded = self.record([describe_response("RETRIEVING", created), describe_response("RETRIEVED", created)])
+
+        replayer = AwsReplayer(self.directory)
+        self.assertEqual(replayer.region, "us-east-1")
+        # no Stubber here: anything not answered by the replayer would go to the network and fail
+        client = make_session(replayer).client("storagegateway")
+        replayed = [client.describe_tapes(GatewayARN=GATEWAY_ARN, TapeARNs=[TAPE_ARN]) for _ in range(3)]
+
+        self.assertEqual(replayed[:2], recorded)
+        self.assertEqual(replayed[1]['Tapes'][0]['TapeCreatedDate'], created)
+        # past the end of the recording the last response repeats
+        self.assertEqual(replayed[2], recorded[1])
+
+    def test_unrecorded_parameters_fail(self):
+        self.record([describe_response("AVAILABLE", datetime(2024, 3, 1, tzinfo=timezone.utc))])
+
+        client = make_session(AwsReplayer(self.directory)).client("storagegateway")
+        with self.assertRaises(LookupError):
+            client.describe_tapes(GatewayARN=GATEWAY_ARN, TapeARNs=["arn:aws:storagegateway:us-east-1:111122223333:tape/TAPE0002"])
+
+    def test_not_a_recording(self):
+        with self.assertRaises(ValueError):
+            AwsReplayer(os.path.join(self.directory, "missing"))
+
+if __name__ == "__main__":
+    unittest.main()
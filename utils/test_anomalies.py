@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import unittest
+from datetime import date, datetime, timedelta
+
+from utils.coststore import CostStore
+from utils.anomalies import detect_anomalies, ewma_update
+
+def ce_days(start, amounts, key="EC2"):
+    return [{
+        'TimePeriod': {'Start': (start + timedelta(days=offset)).isoformat()},
+        'Groups': [{'Keys': [key], 'Metrics': {'UnblendedCost': {'Amount': str(amount), 'Unit': 'USD'}}}]
+    } for offset, amount in enumerate(amounts)]
+
+class TestAnomalies(unittest.TestCase):
+    def setUp(self):
+        self.store = CostStore(":memory:")
+        self.start = date(2024, 3, 1)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_ewma_update(self):
+        mean, variance, count = ewma_update(0.0, 0.0, 0, 10.0, 0.5)
+        self.assertEqual((mean, variance, count), (10.0, 0.0, 1))
+        mean, variance, count = ewma_update(mean, variance, count, 20.0, 0.5)
+        self.assertEqual((mean, variance, count), (15.0, 25.0, 2))
+
+    def test_spike_is_flagged_once_and_baselines_are_incremental(self):
+        amounts = [10.0, 10.5, 9.5] * 6 + [40.0] + [10.0] * 5
+        self.store.store_results("111", "SERVICE", ce_days(self.start, amounts))
+        today = self.start + timedelta(days=len(amounts) + 5)
+
+        found = detect_anomalies(self.store, "111", "SERVICE", today)
+        self.assertEqual([(day, key, final) for day, key, _, _, _, final in found], [("2024-03-19", "EC2", True)])
+        self.assertEqual(len(self.store.anomalies("111", "SERVICE", self.start)), 1)
+
+        # a second run has no new days to fold in
+        self.assertEqual(detect_anomalies(self.store, "111", "SERVICE", today), [])
+        self.assertEqual(self.store.baselines("111", "SERVICE")["EC2"][0], "2024-03-24")
+
+    def test_recent_days_are_provisional(self):
+        amounts = [10.0] * 20 + [50.0]
+        today = self.start + timedelta(days=len(amounts) - 1)
+        self.store.store_results("111", "SERVICE", ce_days(self.start, amounts), fetched_at=datetime(2024, 3, 21))
+
+        found = detect_anomalies(self.store, "111", "SERVICE", today)
+        self.assertEqual([(day, final) for day, _, _, _, _, final in found], [("2024-03-21", False)])
+        self.assertEqual(self.store.anomalies("111", "SERVICE", self.start), [])
+
+    def test_days_fetched_early_are_folded_in_once_refetched(self):
+        amounts = [10.0] * 20
+        self.store.store_results("111", "SERVICE", ce_days(self.start, amounts), fetched_at=datetime(2024, 3, 21))
+        # fetched on the 21st, so the 19th and 20th still hold early figures; one of them looks like a
+        # spike that a refetch later corrects
+        self.store.store_results("111", "SERVICE", ce_days(date(2024, 3, 19), [45.0]), fetched_at=datetime(2024, 3, 20))
+        today = date(2024, 3, 30)
+
+        found = detect_anomalies(self.store, "111", "SERVICE", today)
+        self.assertEqual([(day, final) for day, _, _, _, _, final in found], [("2024-03-19", False)])
+        self.assertEqual(self.store.baselines("111", "SERVICE")["EC2"][0], "2024-03-18")
+        self.assertEqual(self.store.anomalies("111", "SERVICE", self.start), [])
+
+        self.store.store_results("111", "SERVICE", ce_days(date(2024, 3, 19), [10.0, 10.0]), fetched_at=datetime(2024, 3, 30))
+        self.assertEqual(detect_anomalies(self.store, "111", "SERVICE", today), [])
+        baseline = self.store.baselines("111", "SERVICE")["EC2"]
+        self.assertEqual((baseline[0], baseline[1], baseline[3]), ("2024-03-20", 10.0, 20))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import fcntl
+import os
+import tempfile
+import unittest
+
+from utils.barcodes import BarcodeAllocator, BARCODE_LOCK_FILE, barcode_number
+
+class TestBarcodeAllocator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_barcode_number(self):
+        self.assertEqual(barcode_number("TAPE00001F", "TAPE"), 31)
+        self.assertIsNone(barcode_number("TAPEX0001F", "TAPE"))
+        self.assertIsNone(barcode_number("SYN00001", "TAPE"))
+
+    def test_allocates_after_high_water(self):
+        with BarcodeAllocator(self.directory.name) as allocator:
+            self.assertIsNone(allocator.high_water("TAPE", "us-east-1"))
+            allocator.seed("TAPE", "us-east-1", [("TAPE000009", "GLACIER"), ("TAPE000002", "DEEP_ARCHIVE"), ("OTHER1", None)])
+            self.assertEqual(allocator.preview("TAPE", "us-east-1", 2), ["TAPE00000A", "TAPE00000B"])
+            self.assertEqual(allocator.allocate("TAPE", "us-east-1"), "TAPE00000A")
+
+        with BarcodeAllocator(self.directory.name) as allocator:
+            self.assertEqual(allocator.high_water("TAPE", "us-east-1"), (10, "GLACIER"))
+            # a rescan that hasn't seen the new tape yet doesn't move the mark back
+            allocator.seed("TAPE", "us-east-1", [("TAPE000009", "GLACIER")])
+            self.assertEqual(allocator.allocate("TAPE", "us-east-1"), "TAPE00000B")
+            self.assertEqual(allocator.allocate("TAPE", "eu-west-1"), "TAPE000001")
+
+    def test_dry_run_leaves_store_untouched(self):
+        with BarcodeAllocator(self.directory.name, dry_run=True) as allocator:
+            allocator.seed("TAPE", "us-east-1", [("TAPE000009", "GLACIER")])
+            self.assertEqual(allocator.allocate("TAPE", "us-east-1"), "TAPE00000A")
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+        with BarcodeAllocator(self.directory.name) as allocator:
+            allocator.seed("TAPE", "us-east-1", [("TAPE000002", "GLACIER")])
+        with BarcodeAllocator(self.directory.name, dry_run=True) as allocator:
+            # a dry run starts from the stored mark, but its changes are thrown away
+            self.assertEqual(allocator.allocate("TAPE", "us-east-1"), "TAPE000003")
+        with BarcodeAllocator(self.directory.name) as allocator:
+            self.assertEqual(allocator.high_water("TAPE", "us-east-1"), (2, "GLACIER"))
+
+    def test_bulk_run_journal(self):
+        with BarcodeAllocator(self.directory.name) as allocator:
+            run_id = allocator.start_run("gw", "TAPE", "us-east-1", "GLACIER", 100, 15, False, [("t-0", 10), ("t-1", 5)])
+            allocator.complete_item(run_id, "t-0", ["arn:1"])
+
+        with BarcodeAllocator(self.directory.name) as allocator:
+            self.assertIsNone(allocator.find_run("gw", "TAPE", "us-east-1", "GLACIER", 100, 20, False))
+            self.assertEqual(allocator.find_run("gw", "TAPE", "us-east-1", "GLACIER", 100, 15, False), run_id)
+            self.assertEqual(allocator.pending_items(run_id), [("t-1", 5)])
+            allocator.finish_run(run_id)
+            self.assertIsNone(allocator.find_run("gw", "TAPE", "us-east-1", "GLACIER", 100, 15, False))
+
+    def test_lock_is_exclusive(self):
+        with BarcodeAllocator(self.directory.name):
+            with open(os.path.join(self.directory.name, BARCODE_LOCK_FILE), "a") as other:
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+if __name__ == "__main__":
+    unittest.main()
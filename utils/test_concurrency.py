@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+from types import SimpleNamespace
+
+from utils.concurrency import RateLimiter, run_concurrently
+
+class TestConcurrency(unittest.TestCase):
+    def test_rate_limiter_paces_after_burst(self):
+        limiter = RateLimiter(rate=20, burst=2)
+        started = time.monotonic()
+        for _ in range(4):
+            limiter.acquire()
+        # two calls from the burst, then two more at 20 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_run_concurrently_isolates_failures(self):
+        ctx = SimpleNamespace(obj={"MAX_WORKERS": 3})
+
+        def work(item):
+            if item == 2:
+                raise ValueError("bad item")
+            return item * 10
+
+        results = {item: (result, error) for item, result, error in run_concurrently(ctx, work, range(5))}
+        self.assertEqual(sorted(results), [0, 1, 2, 3, 4])
+        self.assertEqual(results[4], (40, None))
+        self.assertIsInstance(results[2][1], ValueError)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import unittest
+from datetime import date, datetime
+
+from utils.coststore import CostStore
+
+def ce_day(day, groups, estimated=False, unit='USD'):
+    """
+    Build one Cost Explorer ResultsByTime entry from {service: amount}.
+    """
+    return {
+        'TimePeriod': {'Start': day, 'End': day},
+        'Estimated': estimated,
+        'Groups': [{'Keys': [key], 'Metrics': {'UnblendedCost': {'Amount': str(amount), 'Unit': unit}}}
+                   for key, amount in groups.items()]
+    }
+
+class TestCostStore(unittest.TestCase):
+    def setUp(self):
+        self.store = CostStore(":memory:")
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_empty_store_is_all_stale(self):
+        stale = self.store.stale_range("111", "SERVICE", "2024-03-01", "2024-03-11", today=date(2024, 3, 20))
+        self.assertEqual(stale, (date(2024, 3, 1), date(2024, 3, 11)))
+
+    def test_future_days_are_not_stale(self):
+        stale = self.store.stale_days("111", "SERVICE", "2024-03-01", "2024-04-01", today=date(2024, 3, 2))
+        self.assertEqual(stale, [date(2024, 3, 1), date(2024, 3, 2)])
+
+    def test_only_missing_and_recent_days_are_refetched(self):
+        self.store.store_results("111", "SERVICE", [
+            ce_day("2024-03-01", {"EC2": 1.5}),
+            ce_day("2024-03-02", {"EC2": 2.0}),
+            ce_day("2024-03-03", {"EC2": 2.5}, estimated=True),
+            ce_day("2024-03-08", {"EC2": 3.0}),
+        ], fetched_at=datetime(2024, 3, 9, 12, 0))
+
+        stale = self.store.stale_days("111", "SERVICE", "2024-03-01", "2024-03-10", today=date(2024, 3, 9))
+        # 04 to 07 were never fetched, 08 is too recent to be final, 09 is today.  03 was fetched as
+        # estimated but long enough after it ended to be final
+        self.assertEqual([day.day for day in stale], [4, 5, 6, 7, 8, 9])
+        # other accounts and dimensions are stored separately
+        self.assertEqual(len(self.store.stale_days("222", "SERVICE", "2024-03-01", "2024-03-10", today=date(2024, 3, 9))), 9)
+
+    def test_estimated_open_month_is_not_refetched(self):
+        # Cost Explorer marks every day of the current month as estimated
+        self.store.store_results("111", "SERVICE", [ce_day(f"2024-03-{day:02d}", {"EC2": 1.0}, estimated=True)
+                                                    for day in range(1, 20)], fetched_at=datetime(2024, 3, 19, 12, 0))
+
+        stale = self.store.stale_days("111", "SERVICE", "2024-03-01", "2024-04-01", today=date(2024, 3, 20))
+        # the next run only fetches the days that weren't final when last fetched, and today
+        self.assertEqual([day.day for day in stale], [17, 18, 19, 20])
+        self.assertEqual(self.store.stale_range("111", "SERVICE", "2024-03-01", "2024-04-01", today=date(2024, 3, 20)),
+                         (date(2024, 3, 17), date(2024, 3, 21)))
+
+    def test_results_round_trip_and_replace(self):
+        self.store.store_results("111", "SERVICE", [ce_day("2024-03-01", {"EC2": 1.5, "S3": 0.25}),
+                                                    ce_day("2024-03-02", {})])
+        self.store.store_results("111", "SERVICE", [ce_day("2024-03-01", {"EC2": 4.0})])
+
+        results = self.store.results_by_time("111", "SERVICE", "2024-03-01", "2024-03-03")
+        self.assertEqual([result['TimePeriod']['Start'] for result in results], ["2024-03-01", "2024-03-02"])
+        self.assertEqual(results[0]['Groups'], [{'Keys': ['EC2'], 'Metrics': {'UnblendedCost': {'Amount': '4.0', 'Unit': 'USD'}}}])
+        self.assertEqual(results[1]['Groups'], [])
+
+    def test_unit_is_stored_per_account(self):
+        self.assertEqual(self.store.unit("111", "SERVICE"), "USD")
+        self.store.store_results("111", "SERVICE", [ce_day("2024-03-01", {"EC2": 1.0}, unit="EUR")])
+        self.store.store_results("222", "SERVICE", [ce_day("2024-03-01", {"EC2": 1.0}, unit="JPY")])
+        self.assertEqual(self.store.unit("111", "SERVICE"), "EUR")
+        self.assertEqual(self.store.unit("222", "SERVICE"), "JPY")
+
+    def test_day_split_across_pages_is_merged(self):
+        pages = iter([ce_day("2024-03-01", {"EC2": 1.0}), ce_day("2024-03-01", {"S3": 2.0})])
+        self.store.store_results("111", "SERVICE", pages)
+
+        keys = [keys for _, keys, _, _ in self.store.rows("111", "SERVICE", "2024-03-01", "2024-03-02")]
+        self.assertEqual(keys, [["EC2"], ["S3"]])
+
+    def test_failed_fetch_keeps_previous_costs(self):
+        self.store.store_results("111", "SERVICE", [ce_day("2024-03-01", {"EC2": 1.0})])
+
+        def failing_pages():
+            yield ce_day("2024-03-01", {"EC2": 9.0})
+            raise RuntimeError("throttled")
+
+        with self.assertRaises(RuntimeError):
+            self.store.store_results("111", "SERVICE", failing_pages())
+        amounts = [amount for _, _, amount, _ in self.store.rows("111", "SERVICE", "2024-03-01", "2024-03-02")]
+        self.assertEqual(amounts, [1.0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import gzip
+import json
+import tempfile
+import unittest
+
+from utils.cur import aggregate_cur_file, aggregate_cur_files, find_cur_files
+
+HEADER = ['lineItem/UsageStartDate', 'lineItem/UsageType', 'lineItem/UnblendedCost', 'lineItem/CurrencyCode',
+          'product/ProductName', 'resourceTags/user:Name']
+ROWS = [
+    ['2024-03-01T00:00:00Z', 'BoxUsage', '1.5', 'USD', 'Amazon EC2', 'web'],
+    ['2024-03-01T01:00:00Z', 'BoxUsage', '0.5', 'USD', 'Amazon EC2', 'db'],
+    ['2024-03-02T00:00:00Z', 'Requests', '0.25', 'USD', 'Amazon S3', ''],
+]
+
+class TestCur(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.plain = os.path.join(self.directory.name, 'a.csv')
+        self.gzipped = os.path.join(self.directory.name, 'sub', 'b.csv.gz')
+        os.makedirs(os.path.dirname(self.gzipped))
+        with open(self.plain, 'w', newline='') as file:
+            csv.writer(file).writerows([HEADER] + ROWS)
+        with gzip.open(self.gzipped, 'wt', newline='') as file:
+            csv.writer(file).writerows([HEADER] + ROWS)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_aggregate_by_friendly_columns_and_tags(self):
+        totals, currency, count = aggregate_cur_file(self.gzipped, ['date', 'service'])
+        self.assertEqual(totals, {('2024-03-01', 'Amazon EC2'): 2.0, ('2024-03-02', 'Amazon S3'): 0.25})
+        self.assertEqual((currency, count), ('USD', 3))
+
+        totals, _, _ = aggregate_cur_file(self.plain, ['tag:Name'])
+        self.assertEqual(totals, {('web',): 1.5, ('db',): 0.5, ('',): 0.25})
+
+    def test_files_are_merged_across_processes(self):
+        files = find_cur_files(self.directory.name)
+        self.assertEqual(len(files), 2)
+        totals, _, count = aggregate_cur_files(files, ['usage-type'], workers=2)
+        self.assertEqual(totals, {('BoxUsage',): 4.0, ('Requests',): 0.5})
+        self.assertEqual(count, 6)
+
+    def test_manifest_selects_the_current_version(self):
+        period = os.path.join(self.directory.name, 'bucket', 'report', '20240301-20240401')
+        for assembly in ['old-assembly', 'new-assembly']:
+            os.makedirs(os.path.join(period, assembly))
+            with gzip.open(os.path.join(period, assembly, 'report-1.csv.gz'), 'wt', newline='') as file:
+                csv.writer(file).writerows([HEADER] + ROWS)
+        manifest = {'assemblyId': 'new-assembly', 'reportKeys': ['prefix/report/20240301-20240401/new-assembly/report-1.csv.gz']}
+        with open(os.path.join(period, 'report-Manifest.json'), 'w') as file:
+            json.dump(manifest, file)
+        # each assembly folder keeps a copy of its own manifest
+        with open(os.path.join(period, 'old-assembly', 'report-Manifest.json'), 'w') as file:
+            json.dump({**manifest, 'reportKeys': ['prefix/report/20240301-20240401/old-assembly/report-1.csv.gz']}, file)
+
+        self.assertEqual(find_cur_files(os.path.join(self.directory.name, 'bucket')),
+                         [os.path.join(period, 'new-assembly', 'report-1.csv.gz')])
+        self.assertEqual(find_cur_files(os.path.join(period, 'old-assembly')),
+                         [os.path.join(period, 'old-assembly', 'report-1.csv.gz')])
+        # without manifests below it, the rest of the tree is read as before
+        self.assertEqual(len(find_cur_files(self.directory.name)), 3)
+
+    def test_unknown_column(self):
+        with self.assertRaises(ValueError):
+            aggregate_cur_file(self.plain, ['no-such-column'])
+
+    def test_short_rows_name_the_file_and_line(self):
+        with open(self.plain, 'a', newline='') as file:
+            csv.writer(file).writerow(['2024-03-03T00:00:00Z', 'BoxUsage'])
+        with self.assertRaisesRegex(ValueError, r"a\.csv, line 5: 2 columns"):
+            aggregate_cur_file(self.plain, ['service'])
+
+    def test_unreadable_files_raise_value_error(self):
+        not_gzip = os.path.join(self.directory.name, 'c.csv.gz')
+        with open(not_gzip, 'w') as file:
+            file.write("plain text\n")
+        with self.assertRaisesRegex(ValueError, r"c\.csv\.gz: "):
+            aggregate_cur_files([self.plain, not_gzip], ['service'], workers=2)
+
+if __name__ == "__main__":
+    unittest.main()
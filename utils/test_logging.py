@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import re
+import json
+import time
+import logging
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+from types import SimpleNamespace
+
+import typer
+from typer.testing import CliRunner
+
+from utils.logging import (AwsResponseLogger, CompressingRotatingFileHandler, DeferredQueueHandler, JsonLinesFormatter,
+                           list_log_segments, open_log_segment, setup_logging, stop_logging, get_loggers)
+from logs import iter_log_lines, logs
+
+def make_record(message):
+    return logging.LogRecord("debug", logging.INFO, __file__, 0, message, None, None)
+
+class TestLogRotation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_dir = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_segment(self, name, size, age_days=0):
+        path = os.path.join(self.log_dir, name)
+        with open(path, "wb") as file:
+            file.write(b"x" * size)
+        mtime = time.time() - age_days * 86400
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_rotated_segments_are_compressed(self):
+        # no compressor thread, so compression runs inline at rollover
+        handler = CompressingRotatingFileHandler(os.path.join(self.log_dir, "debug.log"), maxBytes=200)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        for number in range(20):
+            handler.emit(make_record(f"line {number:02d} " + "." * 40))
+        handler.close()
+
+        segments = list_log_segments(self.log_dir, "debug.log")
+        self.assertGreater(len(segments), 1)
+        self.assertTrue(all(segment.endswith(".gz") for segment in segments))
+        lines = [line.rstrip("\n")[:7] for segment in segments for line in open_log_segment(segment)]
+        with open(os.path.join(self.log_dir, "debug.log")) as active:
+            lines += [line[:7] for line in active]
+        self.assertEqual(lines, [f"line {number:02d}" for number in range(20)])
+
+    def test_legacy_backups_sort_before_timestamped_segments(self):
+        for name in ["debug.log.20240102T000000000000.gz", "debug.log.1", "debug.log.2", "other.log.1"]:
+            self.write_segment(name, 1)
+        self.assertEqual([os.path.basename(path) for path in list_log_segments(self.log_dir, "debug.log")],
+                         ["debug.log.2", "debug.log.1", "debug.log.20240102T000000000000.gz"])
+
+    def test_prune_by_total_size(self):
+        for day in range(1, 5):
+            self.write_segment(f"debug.log.2024010{day}T000000000000.gz", 100)
+        handler = CompressingRotatingFileHandler(os.path.join(self.log_dir, "debug.log"), retain_bytes=250)
+        handler.prune()
+        handler.close()
+        # the newest two fit in 250 bytes
+        self.assertEqual([os.path.basename(path) for path in list_log_segments(self.log_dir, "debug.log")],
+                         ["debug.log.20240103T000000000000.gz", "debug.log.20240104T000000000000.gz"])
+
+    def test_prune_by_age(self):
+        self.write_segment("debug.log.20240101T000000000000.gz", 10, age_days=40)
+        self.write_segment("debug.log.20240102T000000000000.gz", 10, age_days=1)
+        # not yet compressed, so left to its own compression job
+        self.write_segment("debug.log.20240103T000000000000", 10, age_days=40)
+        handler = CompressingRotatingFileHandler(os.path.join(self.log_dir, "debug.log"), retain_days=30)
+        handler.prune()
+        handler.close()
+        self.assertEqual([os.path.basename(path) for path in list_log_segments(self.log_dir, "debug.log")],
+                         ["debug.log.20240102T000000000000.gz", "debug.log.20240103T000000000000"])
+
+    def test_compression_errors_go_to_stderr(self):
+        handler = CompressingRotatingFileHandler(os.path.join(self.log_dir, "debug.log"))
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            handler.compress_and_prune(os.path.join(self.log_dir, "missing"))
+        handler.close()
+        self.assertIn("Error compressing log segment", stderr.getvalue())
+
+class TestLogsCommand(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_dir = self.directory.name
+        handler = CompressingRotatingFileHandler(os.path.join(self.log_dir, "debug.log"), maxBytes=40, compression="xz")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        for number in range(12):
+            handler.emit(make_record(f"{'ERROR' if number % 3 == 0 else 'info'} event {number}"))
+        handler.close()
+
+        self.app = typer.Typer()
+        self.app.command()(logs)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def invoke(self, *args):
+        result = CliRunner().invoke(self.app, list(args), obj={"LOG_DIR": self.log_dir})
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output.splitlines()
+
+    def test_reads_across_segments(self):
+        self.assertGreater(len(list_log_segments(self.log_dir, "debug.log")), 1)
+        self.assertEqual(list(iter_log_lines(self.log_dir, "debug.log"))[-1], "info event 11")
+        self.assertEqual(len(self.invoke("debug")), 12)
+
+    def test_grep(self):
+        self.assertEqual(list(iter_log_lines(self.log_dir, "debug.log", re.compile("ERROR"))),
+                         ["ERROR event 0", "ERROR event 3", "ERROR event 6", "ERROR event 9"])
+        self.assertEqual(self.invoke("debug", "--grep", "error", "--ignore-case"),
+                         ["ERROR event 0", "ERROR event 3", "ERROR event 6", "ERROR event 9"])
+
+    def test_tail(self):
+        self.assertEqual(self.invoke("debug", "--tail", "2"), ["info event 10", "info event 11"])
+        self.assertEqual(self.invoke("debug", "--grep", "ERROR", "--tail", "1"), ["ERROR event 9"])
+
+class TestSetupLogging(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_dir = self.directory.name
+        self.addCleanup(self.directory.cleanup)
+        # stop before the directory is removed, cleanups run last in first out
+        self.addCleanup(stop_logging)
+
+    def read_log(self, filename):
+        with open(os.path.join(self.log_dir, filename)) as file:
+            return file.read().splitlines()
+
+    def queue_handlers(self):
+        # only our own handlers; pytest attaches capture handlers to non-propagating loggers
+        return {name: [handler for handler in logger.handlers if isinstance(handler, DeferredQueueHandler)]
+                for name, logger in get_loggers().items()}
+
+    def test_second_call_adds_no_handlers(self):
+        setup_logging(self.log_dir)
+        handlers = self.queue_handlers()
+        setup_logging(self.log_dir)
+
+        self.assertEqual(self.queue_handlers(), handlers)
+        self.assertTrue(all(len(logger_handlers) == 1 for logger_handlers in handlers.values()))
+
+        get_loggers()['debug'].info("written once")
+        stop_logging()
+        self.assertEqual(len([line for line in self.read_log("debug.log") if "written once" in line]), 1)
+
+    def test_new_directory_replaces_handlers(self):
+        other = tempfile.TemporaryDirectory()
+        self.addCleanup(other.cleanup)
+        setup_logging(other.name)
+        setup_logging(self.log_dir)
+        self.assertTrue(all(len(logger_handlers) == 1 for logger_handlers in self.queue_handlers().values()))
+
+        get_loggers()['error'].info("moved")
+        stop_logging()
+        self.assertEqual(len(self.read_log("error.log")), 1)
+        with open(os.path.join(other.name, "error.log")) as file:
+            self.assertEqual(file.read(), "")
+
+    def test_stop_removes_handlers(self):
+        setup_logging(self.log_dir)
+        stop_logging()
+        stop_logging()
+        self.assertTrue(all(not logger_handlers for logger_handlers in self.queue_handlers().values()))
+
+class TestJsonLines(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_dir = self.directory.name
+        self.addCleanup(self.directory.cleanup)
+        self.addCleanup(stop_logging)
+        self.model = SimpleNamespace(service_model=SimpleNamespace(service_name="storagegateway"),
+                                     name="ListTapes", has_streaming_output=False)
+
+    def log_responses(self, response_logger, bodies):
+        setup_logging(self.log_dir)
+        for body in bodies:
+            http_response = SimpleNamespace(status_code=200, content=body, headers={})
+            response_logger.after_call(http_response=http_response, parsed={'ResponseMetadata': {'RequestId': "req-1"}},
+                                       model=self.model, context={'client_region': "us-east-1"})
+        stop_logging()
+        with open(os.path.join(self.log_dir, "json.log")) as file:
+            return [json.loads(line) for line in file]
+
+    def test_formatter_merges_the_payload(self):
+        record = make_record("response")
+        record.payload = {'operation': "ListTapes", 'body': b'{"TapeInfos": []}'}
+        entry = json.loads(JsonLinesFormatter().format(record))
+        self.assertEqual((entry['type'], entry['level'], entry['operation']), ("response", "INFO", "ListTapes"))
+        self.assertEqual(entry['body'], {'TapeInfos': []})
+
+    def test_responses_are_written_one_per_line(self):
+        body = json.dumps({'TapeInfos': [{'TapeBarcode': "TAPE0001"}]}).encode()
+        entries = self.log_responses(AwsResponseLogger(), [body, b"not json"])
+
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]['body'], {'TapeInfos': [{'TapeBarcode': "TAPE0001"}]})
+        self.assertEqual((entries[0]['operation'], entries[0]['region'], entries[0]['request_id'], entries[0]['status']),
+                         ("ListTapes", "us-east-1", "req-1", 200))
+        self.assertEqual((entries[0]['bytes'], entries[0]['truncated']), (len(body), False))
+        self.assertEqual(entries[1]['body'], "not json")
+
+    def test_bodies_are_truncated(self):
+        body = json.dumps({'TapeInfos': [{'TapeBarcode': f"TAPE{number:04d}"} for number in range(10)]}).encode()
+        entries = self.log_responses(AwsResponseLogger(max_bytes=20), [body])
+
+        # a cut JSON body no longer parses, so it is kept as text
+        self.assertEqual(entries[0]['body'], body[:20].decode())
+        self.assertEqual((entries[0]['bytes'], entries[0]['truncated']), (len(body), True))
+
+    def test_sampling(self):
+        self.assertEqual(self.log_responses(AwsResponseLogger(sample_rate=0.0), [b"{}"] * 5), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from utils.metrics import get_metric_data, metric_window, sparkline, MAX_METRIC_DATA_QUERIES
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+class FakeCloudWatch:
+    def __init__(self):
+        self.calls = []
+
+    def get_metric_data(self, **args):
+        self.calls.append(args)
+        ids = [query['Id'] for query in args['MetricDataQueries']]
+        # the first page of each call returns the first point, the second page the next
+        if 'NextToken' not in args:
+            return {'MetricDataResults': [{'Id': id, 'Timestamps': [START], 'Values': [1.0]} for id in ids], 'NextToken': 'more'}
+        return {'MetricDataResults': [{'Id': id, 'Timestamps': [START + timedelta(minutes=5)], 'Values': [2.0]} for id in ids]}
+
+class TestMetrics(unittest.TestCase):
+    def test_queries_are_packed_and_paged(self):
+        client = FakeCloudWatch()
+        queries = [{'Id': f"q{index}"} for index in range(MAX_METRIC_DATA_QUERIES + 1)]
+        results = get_metric_data(client, queries, START, START + timedelta(hours=1))
+        self.assertEqual([len(call['MetricDataQueries']) for call in client.calls], [MAX_METRIC_DATA_QUERIES] * 2 + [1] * 2)
+        self.assertEqual([value for _, value in results['q500']], [1.0, 2.0])
+
+    def test_window_is_rounded_to_the_period(self):
+        start, end = metric_window(3, 300, now=datetime(2024, 1, 1, 12, 7, 30, tzinfo=timezone.utc))
+        self.assertEqual(end, datetime(2024, 1, 1, 12, 5, tzinfo=timezone.utc))
+        self.assertEqual(start, end - timedelta(hours=3))
+
+    def test_sparkline(self):
+        points = [(START + timedelta(minutes=15 * index), value) for index, value in enumerate([0, 100, 50])]
+        self.assertEqual(sparkline(points, START, START + timedelta(hours=1), width=4, low=0, high=100), "▁█▄ ")
+        self.assertEqual(sparkline([], START, START + timedelta(hours=1)), "")
+
+if __name__ == "__main__":
+    unittest.main()
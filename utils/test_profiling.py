@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import pstats
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from utils.concurrency import run_concurrently
+from utils.profiling import CommandProfiler
+
+def busy_worker(number):
+    return sum(range(number * 1000))
+
+class TestCommandProfiler(unittest.TestCase):
+    def test_worker_threads_are_profiled(self):
+        ctx = SimpleNamespace(obj={'MAX_WORKERS': 4})
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = CommandProfiler(directory, "test", "sauce test", cpu=True)
+            profiler.start()
+            results = list(run_concurrently(ctx, busy_worker, range(1, 9)))
+            pstats_file, text_file = profiler.stop()
+
+            self.assertEqual(len(results), 8)
+            calls = {name: entry[1] for (_, _, name), entry in pstats.Stats(pstats_file).stats.items()}
+            # every call ran on a worker thread, none on this one
+            self.assertEqual(calls["busy_worker"], 8)
+            with open(text_file) as file:
+                self.assertTrue(file.read().startswith("Command Line: sauce test\n"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+
+from utils.responsecache import ResponseCache
+from utils.stats import ApiStats
+
+class TestResponseCache(unittest.TestCase):
+    def test_values_expire(self):
+        stats = ApiStats()
+        cache = ResponseCache(":memory:", stats)
+        with mock.patch("utils.responsecache.time.time", return_value=1000.0):
+            cache.put("metrics", {"region": "us-east-1"}, {"q0": [1.0]}, ttl=60)
+            self.assertEqual(cache.get("metrics", {"region": "us-east-1"}), {"q0": [1.0]})
+            self.assertIsNone(cache.get("metrics", {"region": "eu-west-1"}))
+        with mock.patch("utils.responsecache.time.time", return_value=1060.0):
+            self.assertIsNone(cache.get("metrics", {"region": "us-east-1"}))
+        self.assertEqual(stats.cache_hits, {"metrics": 1})
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
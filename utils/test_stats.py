@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from utils.stats import ApiStats, OperationStats
+
+def operation_model(service, name, streaming=False):
+    return SimpleNamespace(service_model=SimpleNamespace(service_name=service), name=name, has_streaming_output=streaming)
+
+def http_response(status_code=200, body=b"{}", headers=None):
+    return SimpleNamespace(status_code=status_code, content=body, headers=headers or {})
+
+class TestApiStats(unittest.TestCase):
+    def setUp(self):
+        self.stats = ApiStats()
+        self.model = operation_model("storagegateway", "DescribeTapes")
+
+    def call(self, latency_ms, status_code=200, parsed=None, **kwargs):
+        context = {}
+        with mock.patch("utils.stats.time.perf_counter", return_value=100.0):
+            self.stats.before_call(model=self.model, context=context)
+        with mock.patch("utils.stats.time.perf_counter", return_value=100.0 + latency_ms / 1000):
+            self.stats.after_call(http_response=http_response(status_code, **kwargs), parsed=parsed or {},
+                                  model=self.model, context=context)
+
+    def test_throttled_attempts_and_retries_are_counted(self):
+        throttled = (http_response(400), {'Error': {'Code': "ThrottlingException"}})
+        other = (http_response(500), {'Error': {'Code': "InternalFailure"}})
+        # one needs-retry event per attempt: two throttles and a server error, then success
+        for response in [throttled, other, throttled, (http_response(), {})]:
+            self.stats.needs_retry(response=response, operation=self.model)
+        # a connection error has no response at all
+        self.stats.needs_retry(response=None, operation=self.model)
+        self.call(20, parsed={'ResponseMetadata': {'RetryAttempts': 3}})
+
+        stats = self.stats.to_dict()["operations"]["storagegateway.DescribeTapes"]
+        self.assertEqual((stats["calls"], stats["retries"], stats["throttles"], stats["errors"]), (1, 3, 2, 0))
+
+    def test_errors_and_bytes(self):
+        self.call(10, body=b"x" * 50)
+        self.call(10, status_code=400, headers={'Content-Length': "7"})
+
+        stats = self.stats.to_dict()["operations"]["storagegateway.DescribeTapes"]
+        self.assertEqual((stats["calls"], stats["errors"], stats["bytes"]), (2, 1, 57))
+
+    def test_failed_connections_count_as_errors(self):
+        context = {}
+        self.stats.before_call(model=self.model, context=context)
+        self.stats.after_call_error(context=context)
+        # an error before before-call ran can't be attributed to an operation
+        self.stats.after_call_error(context={})
+
+        stats = self.stats.to_dict()["operations"]["storagegateway.DescribeTapes"]
+        self.assertEqual((stats["calls"], stats["errors"]), (1, 1))
+
+    def test_streaming_bodies_are_not_read(self):
+        model = operation_model("s3", "GetObject", streaming=True)
+        response = SimpleNamespace(status_code=200, headers={})
+        # reading content would raise AttributeError
+        self.stats.after_call(http_response=response, parsed={}, model=model, context={})
+        self.assertEqual(self.stats.to_dict()["operations"]["s3.GetObject"]["bytes"], 0)
+
+class TestOperationStats(unittest.TestCase):
+    def test_percentiles(self):
+        stats = OperationStats()
+        self.assertEqual(stats.percentile(50), 0.0)
+        for latency_ms in reversed(range(1, 101)):
+            stats.add_latency(latency_ms)
+
+        self.assertEqual(stats.percentile(50), 51)
+        self.assertEqual(stats.percentile(95), 96)
+        self.assertEqual(stats.percentile(100), 100)
+        record = stats.to_dict()
+        self.assertEqual((record["p50_ms"], record["p95_ms"], record["max_ms"], record["mean_ms"]), (51, 96, 100, 50.5))
+
+    def test_histogram(self):
+        stats = OperationStats()
+        for latency_ms in [5, 10, 11, 20000]:
+            stats.add_latency(latency_ms)
+
+        histogram = stats.to_dict()["histogram"]
+        # bucket bounds are inclusive
+        self.assertEqual(histogram["<=10ms"], 2)
+        self.assertEqual(histogram["<=25ms"], 1)
+        self.assertEqual(histogram[">10000ms"], 1)
+        self.assertEqual(sum(histogram.values()), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import unittest
+from datetime import datetime
+
+from utils.tapestore import TapeStore, parse_where
+
+def tape(barcode, status="AVAILABLE", used=0, gateway="sgw-1"):
+    return {
+        'TapeARN': f"arn:aws:storagegateway:us-east-1:123456789012:tape/{barcode}",
+        'TapeBarcode': barcode,
+        'TapeCreatedDate': datetime(2024, 1, 1, 12, 0),
+        'TapeSizeInBytes': 100 * 1024 ** 3,
+        'TapeStatus': status,
+        'TapeUsedInBytes': used,
+        'PoolId': "GLACIER",
+        'Worm': False,
+        'PoolEntryDate': None,
+        'GatewayARN': f"arn:aws:storagegateway:us-east-1:123456789012:gateway/{gateway}" if gateway else None
+    }
+
+class TestTapeStore(unittest.TestCase):
+    def setUp(self):
+        self.store = TapeStore(":memory:")
+        self.store.upsert([tape("AAA001", used=60 * 1024 ** 3), tape("AAA002", status="IN TRANSIT TO VTS"),
+                           tape("BBB001", status="ARCHIVED", gateway=None)])
+
+    def tearDown(self):
+        self.store.close()
+
+    def barcodes(self, where):
+        return [row['TapeBarcode'] for row in self.store.query(where)]
+
+    def test_where_queries(self):
+        self.assertEqual(self.barcodes(None), ["AAA001", "AAA002", "BBB001"])
+        self.assertEqual(self.barcodes("barcode~AAA*"), ["AAA001", "AAA002"])
+        self.assertEqual(self.barcodes("status=IN TRANSIT TO VTS"), ["AAA002"])
+        self.assertEqual(self.barcodes("used>50GiB and gateway=sgw-1"), ["AAA001"])
+        self.assertEqual(self.barcodes("status!=ARCHIVED, barcode=AAA002"), ["AAA002"])
+
+    def test_where_rejects_unknown_fields(self):
+        with self.assertRaises(ValueError):
+            parse_where("colour=blue")
+        with self.assertRaises(ValueError):
+            parse_where("status; DROP TABLE tapes")
+
+    def test_states_and_delete(self):
+        states = self.store.states()
+        self.assertEqual(states[tape("AAA002")['TapeARN']][0], "IN TRANSIT TO VTS")
+        self.store.delete([tape("AAA001")['TapeARN']])
+        self.assertEqual(self.store.count(), 2)
+
+if __name__ == "__main__":
+    unittest.main()